@@ -1,5 +1,7 @@
 from functools import partial
 from .JsonRPCABC import JsonRPCABC
+from .custom_json import from_json_shared
+from .watching import CHANGED_METHOD
 from .Exceptions import (
         ParseError,
         InvalidRequestError,
@@ -10,6 +12,7 @@ from .Exceptions import (
 import logging
 import json
 import asyncio
+from collections import deque
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +20,8 @@ logger = logging.getLogger(__name__)
 class AioJsonClient(JsonRPCABC):
     '''Implementation of client side RPC'''
 
-    def __init__(self, event_loop, future_dict):
+    def __init__(self, event_loop, future_dict, trace_history=100,
+            shared_memory=False):
         '''takes an event loop argument on which to schedule futures
 
         Args:
@@ -25,10 +29,19 @@ class AioJsonClient(JsonRPCABC):
             future_dict (dict): used to hold a dictionary of existing futures
             to match incoming responses to.
             future_dict has records in the form:
-            req_id: (request_json, request_future)'''
+            req_id: (request_json, request_future)
+            trace_history (int): the number of timing breakdowns attached to
+            responses to keep in traces
+            shared_memory (bool): accept results placed in shared memory by a
+            server on the same host'''
 
         self.loop = event_loop
         self.future_dict = future_dict
+        self.traces = deque(maxlen=trace_history)
+        #subscription id: Subscription, for the methods being watched
+        self.subscriptions = {}
+        if shared_memory:
+            self.object_hook = from_json_shared
 
     async def process_incoming(self, json_obj:str):
         '''subclass to raise an exception if result is an error'''
@@ -39,28 +52,56 @@ class AioJsonClient(JsonRPCABC):
             raise exception
         return response
 
-    def process_error(self, result:dict):
-        id_num = result.get('id', None)
+    async def process_notification(self, notification):
+        '''hand changed results of watched methods to their subscriptions'''
+        params = notification.params
+        if notification.method != CHANGED_METHOD or type(params) != dict:
+            logger.debug("ignoring notification: {}".format(
+                notification.method))
+            return None, None
+        subscription = self.subscriptions.get(params.get('subscription'))
+        if subscription is None:
+            #unwatched while the notification was on its way
+            logger.debug("change for unknown subscription: {}".format(
+                params.get('subscription')))
+        elif 'error' in params:
+            subscription._update(
+                    error=self.exception_from_json_dict(params['error']))
+        else:
+            subscription._update(params.get('result'))
+        return None, None
+
+    def process_error(self, error):
+        id_num = error.id
         if id_num is not None:
-            f = self.future_dict.pop(id_num)
-            exc = self.exception_from_json_dict(result['error'])
-            f.set_exception(exc)
+            f = self.future_dict.pop(id_num, None)
+            exc = self.exception_from_json_dict(error.error)
+            if f is None:
+                #the caller has already given up waiting
+                logger.debug("error for unknown request {}: {}".format(id_num, exc))
+            elif not f.done():
+                f.set_exception(exc)
             return None, None
         else:
-            exc = self.exception_from_json_dict(result['error'])
+            exc = self.exception_from_json_dict(error.error)
             return None, exc
 
 
     def process_response(self, response):
         '''correlate response with stored requests/futures and set result on
         future accordingly'''
-        id_num = response['id']
+        id_num = response.id
+        trace = response.trace
+        if trace is not None:
+            self.traces.append(trace)
         if id_num in self.future_dict:
-            request_future = self.future_dict[id_num]
-            request_future.set_result(response['result'])
+            request_future = self.future_dict.pop(id_num)
+            if not request_future.done():
+                request_future.set_result(response.result)
         else:
             raise(InternalError('Received RPC response with an invalid ID'))
 
-        return response, None #not much use for this just yet
+        #nothing to send back, also when the response is part of a batch
+        return None, None
 
 
@@ -1,14 +1,23 @@
+import asyncio
 from functools import partial
 from .JsonRPCABC import JsonRPCABC
+from .Messages import Request, Response, parse
+from .Tracing import Trace
+from .discovery import DISCOVER_METHOD, RELEASE_METHOD, describe
+from .scripts import SCRIPT_METHOD
+from .watching import WATCH_METHOD, UNWATCH_METHOD
 from .Exceptions import (
         ParseError,
         InvalidRequestError,
         NotFoundError,
         InvalidParamsError,
         InternalError,
-        UnimplementedError)
+        UnimplementedError,
+        ScriptError,
+        JsonRPCError)
 import logging
 import json
+from time import perf_counter
 
 logger = logging.getLogger(__name__)
 
@@ -16,27 +25,247 @@ logger = logging.getLogger(__name__)
 class AioJsonSrv(JsonRPCABC):
     '''Implementation of server side serving up an instance of Wrapper'''
 
-    def __init__(self, *, obj):
+    def __init__(self, *, obj, metrics=None, tracer=None, attach_traces=False,
+            shared_buffers=None, methods=None, stream=False, watches=None,
+            min_watch_interval=0.1):
         '''Initialize the Json RPC wrapper
 
         Args:
             obj (object): The object to expose
+            metrics (Metrics): records calls, errors and call durations
+            tracer (Tracer): enables tracing of requests which carry a trace
+            id. Finished traces are kept by the tracer.
+            attach_traces (bool): add the timing breakdown of traced requests
+            to their responses
+            shared_buffers (SharedBuffers): places large buffers in results
+            into shared memory while export_buffers is set
+            methods (iterable): the only methods of obj which may be called,
+            e.g. the read only ones for observers. All exposed methods if
+            None.
+            stream (bool): return list and dict results as a Messages.Response
+            rather than json, for the transport to encode a piece at a time
+            with Response.iterencode as it sends them
+            watches (Watches): polls the methods connections watch. Watching
+            is only possible if set, and over connections which pass
+            themselves to process_incoming as the session.
+            min_watch_interval (float): the shortest interval in seconds at
+            which a watched method is called
         '''
         self.obj = obj
+        self.metrics = metrics
+        self.tracer = tracer
+        self.attach_traces = attach_traces
+        self.stream = stream
+        #methods provided by the server itself rather than the served object
+        self.builtins = {
+                DISCOVER_METHOD : self.discover,
+                RELEASE_METHOD  : self.release,
+                SCRIPT_METHOD   : self.script}
+        self.methods = frozenset(methods) if methods is not None else None
+        if self.methods is not None:
+            del self.builtins[RELEASE_METHOD]
+            #a script would get round an observer's rate limit
+            del self.builtins[SCRIPT_METHOD]
+        #methods which also take the session the request arrived on
+        self.session_builtins = {
+                WATCH_METHOD   : self.watch,
+                UNWATCH_METHOD : self.unwatch} if watches is not None else {}
+        self.watches = watches
+        self.min_watch_interval = min_watch_interval
+        self._description = None
+        self.shared_buffers = shared_buffers
+        #set for the connection of a client on the same host which accepts
+        #shared memory. The lease means there is only one client at a time.
+        self.export_buffers = False
+
+    def discover(self):
+        '''the methods of the served object with their signatures'''
+        if self._description is None:
+            self._description = describe(self.obj, self.methods)
+        return self._description
+
+    def release(self, names):
+        '''free shared memory segments the client is done with'''
+        if self.shared_buffers is None:
+            return 0
+        return self.shared_buffers.release(names)
+
+    def watch(self, session, subscription, method, params=None, interval=1):
+        '''call method every interval seconds, and notify the session with
+        rpc.changed when the result differs from the last one sent
+
+        Args:
+            subscription: an id of the client's choosing, unique to its
+            connection, which is sent with each notification. Watching again
+            with the same id replaces the watch.
+            params (list or dict): the arguments to call method with
+        '''
+        if method not in self.obj._func_sigs or (
+                self.methods is not None and method not in self.methods):
+            raise NotFoundError("method '{}' not found".format(method))
+        if type(params) == dict:
+            args, kwargs = [], params
+        elif params is None or type(params) == list:
+            args, kwargs = params or [], {}
+        else:
+            raise InvalidParamsError('params must be a list or object')
+        try:
+            self.obj._func_sigs[method].bind(*args, **kwargs)
+        except TypeError as e:
+            raise InvalidParamsError(e.__str__())
+        if type(interval) not in (int, float) or interval <= 0:
+            raise InvalidParamsError('interval must be a positive number')
+        if type(subscription) not in (int, str):
+            raise InvalidParamsError('subscription must be an integer or string')
+        self.watches.watch(session, subscription, method, args, kwargs,
+                max(interval, self.min_watch_interval))
+        return subscription
+
+    def unwatch(self, session, subscription):
+        '''stop watching
+
+        Returns:
+            bool: False if there was no such subscription'''
+        return self.watches.unwatch(session, subscription)
+
+    async def script(self, calls):
+        '''make a list of calls, each {"method": name, "params": list or
+        dict}, in one executor job and return their results. Arguments may
+        refer to earlier results, see scripts.ref.
+
+        Raises:
+            ScriptError: from the first call which failed, with the results
+            of the calls before it'''
+        if not isinstance(calls, list):
+            raise InvalidParamsError('calls must be a list')
+        steps = []
+        for index, call in enumerate(calls):
+            method_name = call.get('method') if isinstance(call, dict) else None
+            if method_name not in self.obj._func_sigs or (
+                    self.methods is not None and method_name not in self.methods):
+                raise NotFoundError("call {}: method '{}' not found".format(
+                    index, method_name))
+            params = call.get('params', None) or []
+            if type(params) == dict:
+                steps.append((method_name, [], params))
+            elif type(params) == list:
+                steps.append((method_name, params, {}))
+            else:
+                raise InvalidParamsError(
+                        'call {}: params must be a list or object'.format(index))
+        if self.metrics is not None:
+            for method_name, args, kwargs in steps:
+                self.metrics.calls.inc(method_name)
+        try:
+            results, failure = await self.obj.run_script(steps)
+        except asyncio.TimeoutError:
+            raise InternalError('script timed out')
+        if failure is not None:
+            index, e = failure
+            raise ScriptError('call {} ({}) failed: {}'.format(
+                index, steps[index][0], e), index=index, results=results,
+                cause=e)
+        return results
+
+    async def process_incoming(self, json_obj:str, session=None):
+        result = await super().process_incoming(json_obj, session)
+        if self.metrics is not None and result[1] is not None:
+            self.metrics.errors.inc(result[1].code)
+        return result
+
+    async def process_batch(self, messages, session=None):
+        response, errors = await super().process_batch(messages, session)
+        #counted here as only one exception is passed back for a batch
+        if self.metrics is not None:
+            for e in errors:
+                self.metrics.errors.inc(e.code)
+        return response, []
+
+    async def process_incoming_traced(self, json_obj:str, session=None):
+        '''process_incoming for when a tracer is set. Requests carrying a
+        trace id are timed through each stage.
+
+        Returns:
+            tuple: (response json, exception, Trace). The trace is None if the
+            message didn't ask for one. Otherwise the caller marks any further
+            stages and passes it to tracer.finish.'''
+        start = perf_counter()
+        try:
+            message = self.decode(json_obj)
+        except ParseError as p:
+            result = self.response_error(p), p
+            trace = None
+        else:
+            trace = None
+            if type(message) == list:
+                result = await self.process_message(message, session)
+            else:
+                message = parse(message, session)
+                if type(message) is Request and message.trace is not None:
+                    trace = Trace(message.trace, start)
+                    trace.mark('decode')
+                    message.trace = trace
+                result = await self.dispatch(message)
+        if self.metrics is not None and result[1] is not None:
+            self.metrics.errors.inc(result[1].code)
+        return result[0], result[1], trace
+
+    async def process_notification(self, notification):
+        #there's nothing to respond with
+        return None, None
 
     async def process_request(self, request):
 
-        method_name = request['method']
-        id_num = request['id']
+        method_name = request.method
+        id_num = request.id
+        trace = request.trace
+        if not isinstance(trace, Trace):
+            trace = None
+        else:
+            trace.method = method_name
+
+        builtin = self.builtins.get(method_name)
+        if builtin is None and request.session is not None:
+            builtin = self.session_builtins.get(method_name)
+            if builtin is not None:
+                builtin = partial(builtin, request.session)
+        if builtin is not None:
+            params = request.params or ()
+            try:
+                if type(params) == dict:
+                    result = builtin(**params)
+                else:
+                    result = builtin(*params)
+                if asyncio.iscoroutine(result):
+                    result = await result
+            except TypeError as e:
+                r = InvalidParamsError(e.__str__())
+                return self.response_error(r, id_num=id_num), r
+            except JsonRPCError as r:
+                return self.response_error(r, id_num=id_num), r
+            try:
+                return self.response_result(id_num=id_num, result=result), None
+            except Exception as e:
+                #e.g. a script result which can't be encoded
+                r = InternalError(e.__str__())
+                return self.response_error(r, id_num=id_num), r
+
+        if self.methods is not None and method_name not in self.methods:
+            r = NotFoundError("'{}' can't be called on this connection".format(
+                method_name))
+            return self.response_error(r, id_num=id_num), r
 
         try:
             method = getattr(self.obj, method_name)
         except AttributeError as e:
             r = NotFoundError(e.__str__())
-            return self.response_error(r, id_num=request['id']), r
+            return self.response_error(r, id_num=id_num), r
 
 
-        params = request.get('params', None)
+        if trace is not None:
+            method = partial(method.traced, trace)
+
+        params = request.params
         if params:
             if type(params) == list:
                 p      = partial(method, *params)
@@ -52,15 +281,39 @@ class AioJsonSrv(JsonRPCABC):
             p_test()
         except TypeError as e:
             r = InvalidParamsError(e.__str__())
-            return self.response_error(r, id_num=request['id']), r
+            return self.response_error(r, id_num=id_num), r
+
+        if trace is not None:
+            trace.mark('bind')
 
         try:
-            result = await p()
-            result_prepared = self.response_result(id_num=id_num, result=result)
+            if self.metrics is not None:
+                self.metrics.calls.inc(method_name)
+                start = perf_counter()
+                try:
+                    result = await p()
+                finally:
+                    self.metrics.call_duration.observe(
+                            perf_counter() - start, method_name)
+            else:
+                result = await p()
+            if self.export_buffers:
+                result = self.shared_buffers.export(result)
+            if trace is not None and self.attach_traces:
+                trace_dict = trace.to_dict()
+            else:
+                trace_dict = None
+            if self.stream and isinstance(result, (list, tuple, dict)):
+                result_prepared = Response(id_num, result, trace_dict)
+            else:
+                result_prepared = self.response_result(id_num=id_num,
+                        result=result, trace=trace_dict)
+            if trace is not None:
+                trace.mark('encode')
             return result_prepared, None
 
         except Exception as e:
             r = InternalError(e.__str__())
-            return self.response_error(r, id_num=request['id']), r
+            return self.response_error(r, id_num=id_num), r
             logger.error(e)
 
@@ -1,10 +1,18 @@
 import aiohttp
 from aiohttp import BasicAuth
 import asyncio
+from functools import partial
 from .AioJsonClient import AioJsonClient
 from .ClientObj import ClientObj
-from .Exceptions import NotFoundError
+from .Exceptions import (NotFoundError, JsonRPCError, ConnectionLostError,
+        ServerOverloadedError)
+from .Compressor import Compressor
+from . import SharedBuffers
+from .tls import client_context, parse_fingerprint
+from .constants import (RESUME_TOKEN_HEADER, CLOSE_NOT_GRANTED, DEFLATE_PROTOCOL,
+        SHARED_MEMORY_HEADER, OBSERVER_HEADER)
 import logging
+import time
 
 
 logger = logging.getLogger(__name__)
@@ -19,9 +27,27 @@ class AioRPCClient():
             timeout=2,
             retry_wait_time = 5,
             retry_attempts = 10,
+            reconnect_attempts = 5,
+            reconnect_wait_time = 0.1,
+            reconnect_max_wait_time = 5,
+            idempotent_methods = (),
             login='default',
             pw='123456',
-            secure = True
+            use_tokens = False,
+            token = None,
+            observer = False,
+            secure = True,
+            fingerprint = None,
+            cafile = None,
+            ssl_context = None,
+            trace = False,
+            compression = False,
+            compression_threshold = 1024,
+            compression_level = 6,
+            max_message_size = 1<<26,
+            shared_memory = False,
+            event_loop = None,
+            start = True
             ):
         '''initialize rpc client.
         Args:
@@ -30,25 +56,82 @@ class AioRPCClient():
             timeout (int):the time after which the client gives up connecting to
             the server
             retry_wait_time (int): the time between retrying server for resource if
-            it's busy. 
+            it's busy.
             retry_attempts (int): the amount of times to retry the server
+            reconnect_attempts (int): the amount of times to try reconnecting
+            after the websocket drops before giving up
+            reconnect_wait_time (float): the initial wait between reconnection
+            attempts. This doubles after every failed attempt.
+            reconnect_max_wait_time (float): the upper limit of the wait between
+            reconnection attempts
+            idempotent_methods (iterable): names of methods which are safe to
+            send again if the connection dropped before their response arrived.
+            Unanswered calls to any other method fail with ConnectionLostError.
+            use_tokens (bool): log in and take the lease in the websocket
+            upgrade with a bearer token from '/token' rather than going
+            through '/login' and '/get_access'. The token is reused until it
+            expires.
+            token (str): a bearer token obtained beforehand, so connecting takes
+            a single round trip. Implies use_tokens.
+            observer (bool): connect as a read only observer which can only
+            call the methods the server allows observers, without needing or
+            taking the lease
             secure (bool): To connect via https or http
+            fingerprint (bytes or str): sha256 fingerprint of the server's
+            certificate, as bytes or hex. The connection is refused if the
+            server presents any other certificate.
+            cafile (file_path): certificates to verify the server against.
+            Without this or a fingerprint the server isn't verified, which
+            suits a self-signed certificate on a trusted network.
+            ssl_context (ssl.SSLContext): used instead of building one from
+            cafile
+            trace (bool): ask the server to trace every request. Breakdowns
+            the server attaches to responses are kept in json_client.traces.
+            compression (bool): ask the server to deflate messages. Worthwhile
+            when bandwidth rather than CPU is the limit.
+            compression_threshold (int): the length in characters below which
+            messages are sent uncompressed
+            compression_level (int): zlib compression level, 1 to 9
+            max_message_size (int): the longest message accepted from the
+            server, in characters or bytes, also once inflated. The calls
+            waiting when a longer one arrives fail with ServerOverloadedError
+            as it can't be told which of them it answered. None accepts any
+            length.
+            shared_memory (bool): accept large buffers through shared memory
+            from a server on the same host. They arrive as SharedBuffer objects
+            which are handed back with client_obj._release. Needs python 3.8
+            or later.
+            event_loop (asyncio event loop): the loop to run on, e.g. one from
+            uvloop. Defaults to asyncio.get_event_loop(). Several clients may
+            share a loop.
+            start (bool): start connecting straight away. Otherwise the client
+            starts when entered as an async context manager or on start().
         '''
 
-        event_loop = asyncio.get_event_loop()
+        if event_loop is None:
+            event_loop = asyncio.get_event_loop()
+        self.event_loop = event_loop
+        #the tasks this client started, cancelled by shutdown
+        self._tasks = set()
+        self._task = None
+        #one context for every connection rather than one per handshake
+        self.ssl_context = ssl_context if ssl_context is not None \
+                else client_context(cafile)
+        self.fingerprint = parse_fingerprint(fingerprint) \
+                if fingerprint is not None else None
         #unsafe=True because could be connecting to server at localhost
         self.jar = aiohttp.CookieJar(unsafe=True, loop=event_loop)
-        #using verify_ssl=False because the server could use a self-signed cert
-        self.conn = aiohttp.TCPConnector(verify_ssl=False, loop=event_loop)
+        self.conn = self.new_connector()
         future_dict = {}
         q = asyncio.Queue(maxsize=5, loop=event_loop)
-        json_client = AioJsonClient( event_loop=event_loop, future_dict=future_dict)
-        self.client_obj = ClientObj(event_loop=event_loop, q=q, json_client=json_client)
+        self.shared_memory = shared_memory and SharedBuffers.available()
+        json_client = AioJsonClient( event_loop=event_loop, future_dict=future_dict,
+                shared_memory=self.shared_memory)
+        self.client_obj = ClientObj(event_loop=event_loop, q=q, json_client=json_client,
+                trace=trace)
 
         self.q = q
         self.json_client = json_client
-        self.event_loop = event_loop
-        asyncio.ensure_future(self.issue_requests(), loop=event_loop)
 
         self.host_addr = host_addr
         self.port = port
@@ -56,20 +139,84 @@ class AioRPCClient():
         self.timeout = timeout
         self.retry_attempts = retry_attempts
         self.retry_wait_time = retry_wait_time
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_wait_time = reconnect_wait_time
+        self.reconnect_max_wait_time = reconnect_max_wait_time
+        self.idempotent_methods = frozenset(idempotent_methods)
+        self.max_message_size = max_message_size
+        if compression:
+            self.compressor = Compressor(threshold=compression_threshold,
+                    level=compression_level, max_size=max_message_size)
+        else:
+            self.compressor = None
+
+        #requests sent over the websocket which haven't been answered yet in the
+        #form: req_id: (method_name, request_json)
+        self.in_flight = {}
+        self.resume_token = None
+        self.use_tokens = use_tokens or token is not None
+        self.token = token
+        self.observer = observer
+        #unknown for a token passed in, it is replaced when refused
+        self.token_expires = None
+        self.ws = None
+        self.closing = False
 
         logger.debug("Using login: {}, password: {}".format(login,pw))
         self.login_details = BasicAuth(login=login,password=pw)
+        if start:
+            self.start()
+
+    def start(self):
+        '''start connecting and sending requests if not already started'''
+        if self._task is None:
+            self._task = self.spawn(self.issue_requests())
+        return self._task
+
+    def spawn(self, coro):
+        '''run coro in a task belonging to the client, which shutdown
+        cancels'''
+        task = asyncio.ensure_future(coro, loop=self.event_loop)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        await self.shutdown()
+
+    def new_connector(self):
+        '''a connector which verifies the server as configured. Its
+        connections are kept alive so logging in, getting access and the
+        websocket upgrade can share one TLS handshake.'''
+        return aiohttp.TCPConnector(ssl_context=self.ssl_context,
+                fingerprint=self.fingerprint, loop=self.event_loop)
 
     async def shutdown(self):
-        '''run all tasks to completion'''
-        me = asyncio.Task.current_task()
-        for task in asyncio.Task.all_tasks():
-            if task == me:
-                continue
+        '''cancel the client's tasks and wait for them to finish. Other tasks
+        on the loop are left alone.'''
+        tasks = list(self._tasks)
+        for task in tasks:
             task.cancel()
-            await asyncio.wait([task])
+        if tasks:
+            await asyncio.wait(tasks, loop=self.event_loop)
 
-    def make_url(self, path='', use_ws=False):
+    async def close(self):
+        '''close the websocket normally so the server frees the resource
+        straight away instead of holding it for a resumption'''
+        self.closing = True
+        if self.ws is not None:
+            await self.ws.close()
+
+    def make_url(self, path='', use_ws=False, host_addr=None, port=None):
+        if host_addr is None:
+            host_addr = self.host_addr
+        if port is None:
+            port = self.port
         if self.secure:
             protocol = 'https'
             ws = 'wss'
@@ -78,76 +225,301 @@ class AioRPCClient():
             ws = 'ws'
         if use_ws:
             protocol = ws
-        url =  '{}://{}:{}/{}'.format(protocol, self.host_addr, self.port, path)
+        url =  '{}://{}:{}/{}'.format(protocol, host_addr, port, path)
         logging.debug("url: {}".format(url))
         return url
 
+    async def login(self, session):
+        '''log in with the client's credentials
 
-    async def issue_requests(self):
-        async with aiohttp.ClientSession(
+        Returns:
+            bool: True if the server accepted the credentials'''
+        async with session.get(
+            self.make_url('login'),
+            auth=self.login_details) as resp:
+            r = await resp.text()
+            return r == 'logged in'
+
+    async def get_access(self, session):
+        '''ask the server for exclusive access to the object being served,
+        retrying while it is busy.
+
+        Returns:
+            bool: True if the resource was granted'''
+        for i in range(self.retry_attempts):
+            async with session.get(self.make_url('get_access')) as resp:
+                r = await resp.text()
+                if r == 'Resource granted':
+                    logger.debug("resource was granted. continuing")
+                    self.resume_token = resp.headers.get(RESUME_TOKEN_HEADER)
+                    return True
+                else:
+                    logger.debug("Resource is busy, perhaps try again in a while?")
+                    await asyncio.sleep(self.retry_wait_time, loop=self.event_loop)
+        return False
+
+    async def fetch_token(self, session):
+        '''exchange the client's credentials for a bearer token'''
+        async with session.get(
+            self.make_url('token'),
+            auth=self.login_details) as resp:
+            if resp.status != 200:
+                raise aiohttp.ClientError('login error: {}'.format(resp.status))
+            r = await resp.json()
+        self.token = r['token']
+        self.token_expires = r['expires']
+
+    def token_expired(self):
+        if self.token is None:
+            return True
+        #leave time for the upgrade to reach the server
+        return self.token_expires is not None and \
+                time.time() >= self.token_expires - self.timeout
+
+    async def connect(self, session):
+        '''upgrade to a websocket, presenting the resume token so that the
+        lease is reclaimed if this is a reconnection'''
+        if self.secure:
+            proto = 'wss'
+        else:
+            proto = 'ws'
+
+        headers = {}
+        if self.resume_token is not None:
+            headers[RESUME_TOKEN_HEADER] = self.resume_token
+        if self.shared_memory:
+            headers[SHARED_MEMORY_HEADER] = '1'
+        if self.observer:
+            headers[OBSERVER_HEADER] = '1'
+
+        logger.debug("connecting via {}...".format(proto))
+        if self.use_tokens:
+            return await self.connect_with_token(session, proto, headers)
+        return await session.ws_connect(
+                self.make_url(proto, True),
+                timeout=self.timeout,
+                headers=headers,
+                protocols=(DEFLATE_PROTOCOL,) if self.compressor else ())
+
+    async def connect_with_token(self, session, proto, headers):
+        '''upgrade to a websocket with a bearer token, which logs in and takes
+        the lease in the same request. Retries while the resource is busy.'''
+        for i in range(self.retry_attempts):
+            if self.token_expired():
+                await self.fetch_token(session)
+            headers['Authorization'] = 'Bearer {}'.format(self.token)
+            try:
+                return await session.ws_connect(
+                        self.make_url(proto, True),
+                        timeout=self.timeout,
+                        headers=headers,
+                        protocols=(DEFLATE_PROTOCOL,) if self.compressor else ())
+            except aiohttp.WSServerHandshakeError as e:
+                if e.code == 401:
+                    logger.debug("token refused, fetching a new one")
+                    self.token = None
+                elif e.code == 503:
+                    logger.debug("Resource is busy, perhaps try again in a while?")
+                    await asyncio.sleep(self.retry_wait_time, loop=self.event_loop)
+                else:
+                    raise
+        raise aiohttp.ClientError('Resource is still busy')
+
+    def _request_done(self, id_num, future):
+        self.in_flight.pop(id_num, None)
+
+    def send(self, ws, request_json):
+        if ws.protocol == DEFLATE_PROTOCOL:
+            self.compressor.send(ws, request_json)
+        else:
+            ws.send_str(request_json)
+
+    async def send_requests(self, ws):
+        '''forward requests from the queue to the websocket'''
+        future_dict = self.json_client.future_dict
+        while True:
+            id_num, method_name, request_json = await self.q.get()
+            future = future_dict.get(id_num)
+            if future is None or future.done():
+                continue
+            self.in_flight[id_num] = (method_name, request_json)
+            future.add_done_callback(partial(self._request_done, id_num))
+            self.send(ws, request_json)
+
+    async def serve(self, ws):
+        '''send requests and process their responses until the websocket
+        closes. Requests left unanswered by a previous connection are sent
+        first.'''
+        for method_name, request_json in list(self.in_flight.values()):
+            logger.debug("resending: {}".format(request_json))
+            self.send(ws, request_json)
+
+        sender = self.spawn(self.send_requests(ws))
+        if self.json_client.subscriptions:
+            self.spawn(self.client_obj._rewatch())
+        try:
+            async for msg in ws:
+                if msg.tp == aiohttp.MsgType.text or (
+                        msg.tp == aiohttp.MsgType.binary and
+                        self.compressor is not None):
+                    try:
+                        data = self.read_message(msg)
+                    except JsonRPCError as e:
+                        logger.error(e)
+                        self.fail_in_flight(keep_idempotent=False, exception=e)
+                        continue
+                    try:
+                        await self.json_client.process_incoming(data)
+                    except JsonRPCError as e:
+                        logger.error(e)
+                elif msg.tp == aiohttp.MsgType.error:
+                    break
+        finally:
+            sender.cancel()
+            await asyncio.wait([sender], loop=self.event_loop)
+            await ws.close()
+
+    def read_message(self, msg):
+        '''the text of a message from the server
+
+        Raises:
+            ParseError: if a binary message can't be inflated
+            ServerOverloadedError: if the message is longer than
+            max_message_size'''
+        data = msg.data
+        max_size = self.max_message_size
+        if max_size is not None and len(data) > max_size:
+            raise ServerOverloadedError(
+                    'message longer than {}'.format(max_size))
+        if msg.tp == aiohttp.MsgType.binary:
+            data = self.compressor.decompress(data, max_size)
+        return data
+
+    def fail_in_flight(self, keep_idempotent=True, exception=None):
+        '''fail the futures of requests which were sent but not answered.
+
+        Args:
+            keep_idempotent (bool): leave requests for idempotent methods
+            pending so that they can be sent again
+            exception (JsonRPCError): what the calls fail with,
+            ConnectionLostError if None
+        '''
+        future_dict = self.json_client.future_dict
+        for id_num, (method_name, request_json) in list(self.in_flight.items()):
+            if keep_idempotent and method_name in self.idempotent_methods:
+                continue
+            self.in_flight.pop(id_num)
+            future = future_dict.pop(id_num, None)
+            if future is not None and not future.done():
+                future.set_exception(exception if exception is not None else
+                    ConnectionLostError('connection dropped while calling {}'
+                        .format(method_name)))
+
+    async def acquire(self):
+        '''open a session, log in and get exclusive access to the object being
+        served. Observers only log in.
+
+        Returns:
+            aiohttp.ClientSession: a session holding the lease or None if
+            access wasn't granted'''
+        session = aiohttp.ClientSession(
                     cookie_jar=self.jar,
                     connector=self.conn,
-                    loop=self.event_loop) as session:
-            #async with session.get(self.make_url()) as resp:
-            #    #logger.debug(resp.status)
-            #    logger.debug(await resp.text())
-            async with session.get(
-                self.make_url('login'),
-                auth=self.login_details) as resp:
-                r = await resp.text()
-                #print(r)
-                if r != 'logged in':
-                    print("login error! shutting down..")
-                    await self.shutdown()
-                    return
-
-            for i in range(self.retry_attempts):
-                async with session.get(self.make_url('get_access')) as resp:
-                    r = await resp.text()
-                    if r == 'Resource granted':
-                        logger.debug("resource was granted. continuing")
-                        break
-                    else:
-                        logger.debug("Resource is busy, perhaps try again in a while?")
-                        await asyncio.sleep(self.retry_wait_time)
+                    loop=self.event_loop)
+        if self.use_tokens:
+            #access is taken when connecting
+            return session
+        try:
+            if not await self.login(session):
+                print("login error! shutting down..")
+            elif self.observer or await self.get_access(session):
+                return session
             else:
                 logger.debug("Resource is still busy... giving up!")
-                for task in asyncio.Task.all_tasks(loop=self.event_loop):
-                    if task == asyncio.Task.current_task(loop=self.event_loop):
-                        logger.debug("skipping current task..")
-                        continue
-                    logger.debug("killing task: {}".format(task))
-                    task.cancel()
-                #self.event_loop.stop()
-                logger.debug("returning..")
-                return
-            if self.secure:
-                proto = 'wss'
-            else:
-                proto = 'ws'
+        except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as e:
+            logger.debug("failed to reach the server: {}".format(e))
+        await session.close()
+        return None
 
-            logger.debug("connecting via {}...".format(proto))
-            async with session.ws_connect(
-                    self.make_url(proto, True),
-                    timeout=self.timeout) as ws:
+    async def reacquire(self, session):
+        '''get access again after the lease was lost
 
-                while True:
-                    request_json = await self.q.get()
-                    ws.send_str(request_json)
+        Returns:
+            aiohttp.ClientSession: a session holding the lease or None if
+            access wasn't granted'''
+        if self.use_tokens or self.observer or await self.get_access(session):
+            return session
+        logger.debug("Resource is still busy... giving up!")
+        await session.close()
+        return None
 
-                    msg = await ws.receive()
-                    if msg.tp == aiohttp.MsgType.text:
-                        r = await self.json_client.process_incoming(msg.data)
-                    elif msg.tp == aiohttp.MsgType.closed:
-                        break
-                    elif msg.tp == aiohttp.MsgType.error:
+    async def issue_requests(self):
+        '''connect and send requests until closed or giving up. Calls waiting
+        when it returns fail with ConnectionLostError.'''
+        session = None
+        wait_time = self.reconnect_wait_time
+        attempts = 0
+        try:
+            session = await self.acquire()
+            while session is not None and not self.closing:
+                try:
+                    self.ws = await self.connect(session)
+                except (aiohttp.ClientError, aiohttp.WSServerHandshakeError,
+                        OSError, asyncio.TimeoutError) as e:
+                    logger.debug("failed to connect: {}".format(e))
+                else:
+                    wait_time = self.reconnect_wait_time
+                    attempts = 0
+                    try:
+                        await self.serve(self.ws)
+                    finally:
+                        close_code = self.ws.close_code
+                        self.ws = None
+                    if self.closing:
                         break
+                    self.fail_in_flight(keep_idempotent=True)
+                    if close_code == CLOSE_NOT_GRANTED:
+                        logger.debug("lease was lost, requesting access again")
+                        session = await self.reacquire(session)
+                        if session is None:
+                            break
+                        continue
+                    logger.debug("connection dropped with code: {}".format(close_code))
+
+                attempts += 1
+                if attempts > self.reconnect_attempts:
+                    logger.debug("giving up reconnecting..")
+                    break
+                logger.debug("reconnecting in {} secs..".format(wait_time))
+                await asyncio.sleep(wait_time, loop=self.event_loop)
+                wait_time = min(wait_time*2, self.reconnect_max_wait_time)
+        finally:
+            if session is not None:
+                await session.close()
+
+            self.fail_in_flight(keep_idempotent=False)
+            #nothing will send what's left in the queue now
+            while not self.q.empty():
+                id_num, method_name, request_json = self.q.get_nowait()
+                future = self.json_client.future_dict.pop(id_num, None)
+                if future is not None and not future.done():
+                    future.set_exception(ConnectionLostError(
+                        'not connected when calling {}'.format(method_name)))
 
     def run(self, coro):
-        #self.event_loop.run_forever()
+        '''run coro(client_obj) to completion, stopping it early if the
+        client gives up on the server'''
         loop = self.event_loop
-        task = asyncio.ensure_future(coro(self.client_obj), loop=loop)
-        loop.run_until_complete(task)
+        task = self.spawn(coro(self.client_obj))
+        issuer = self.start()
+        loop.run_until_complete(asyncio.wait([task, issuer],
+            return_when=asyncio.FIRST_COMPLETED, loop=loop))
+        if not task.done():
+            logger.debug("client stopped, cancelling {}".format(task))
+            task.cancel()
+        loop.run_until_complete(self.close())
         loop.run_until_complete(self.shutdown())
         loop.stop()
-
+        if not task.cancelled():
+            #raise anything coro raised
+            task.result()
@@ -0,0 +1,214 @@
+import aiohttp
+import asyncio
+from .AioRPCClient import AioRPCClient
+from .constants import RESUME_TOKEN_HEADER
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class EndpointStats():
+    '''Health and latency record of a single server'''
+
+    def __init__(self, *, smoothing=0.3, cooldown=5):
+        '''
+        Args:
+            smoothing (float): weight given to the newest latency sample
+            cooldown (float): the time in seconds an endpoint is avoided after
+            a failure. This doubles with every consecutive failure.
+        '''
+        self.smoothing = smoothing
+        self.cooldown = cooldown
+        self.latency = None
+        self.failures = 0
+        self.last_failure = None
+        self.grants = 0
+        self.busy = 0
+
+    def record_latency(self, latency):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+        self.failures = 0
+
+    def record_failure(self, now):
+        self.failures += 1
+        self.last_failure = now
+
+    def healthy(self, now):
+        if not self.failures:
+            return True
+        backoff = self.cooldown * 2**(self.failures-1)
+        return now - self.last_failure >= backoff
+
+
+class AioRPCMultiClient(AioRPCClient):
+    '''RPC client which takes whichever of several interchangeable servers is
+    free. Access is requested from all of them at once, the first grant is
+    kept and any other grants are released straight away.'''
+
+    def __init__(self, *, endpoints, stagger=0.02, stats=None, **kwargs):
+        '''
+        Args:
+            endpoints (iterable): (host_addr, port) pairs of the servers to use
+            stagger (float): the delay in seconds between starting on one
+            endpoint and the next. Endpoints are ordered by health and latency
+            so the fastest ones get a head start, and endpoints which haven't
+            started by the time access is granted are left alone.
+            stats (dict): (host_addr, port): EndpointStats records. Pass the
+            same dict to other clients to share what has been learnt about the
+            servers.
+
+        kwargs are passed on to AioRPCClient. host_addr and port are set to
+        the endpoint which granted access.
+        '''
+        endpoints = [tuple(e) for e in endpoints]
+        if not endpoints:
+            raise ValueError("Need at least one endpoint")
+        host_addr, port = endpoints[0]
+        if kwargs.get('use_tokens') or kwargs.get('token') is not None:
+            #each server signs its own tokens
+            raise ValueError("AioRPCMultiClient does not support use_tokens")
+        super().__init__(host_addr=host_addr, port=port, **kwargs)
+        self.endpoints = endpoints
+        self.stagger = stagger
+        if stats is None:
+            stats = {}
+        self.stats = stats
+        for endpoint in endpoints:
+            stats.setdefault(endpoint, EndpointStats())
+
+    def ranked_endpoints(self):
+        '''endpoints in the order they should be tried: healthy ones first,
+        fastest first'''
+        now = self.event_loop.time()
+        def key(endpoint):
+            stats = self.stats[endpoint]
+            latency = stats.latency if stats.latency is not None else 0
+            return (not stats.healthy(now), latency)
+        return sorted(self.endpoints, key=key)
+
+    def new_session(self):
+        #each endpoint gets its own cookie jar as cookies ignore the port
+        return aiohttp.ClientSession(
+                cookie_jar=aiohttp.CookieJar(unsafe=True, loop=self.event_loop),
+                connector=self.new_connector(),
+                loop=self.event_loop)
+
+    async def try_endpoint(self, endpoint, delay, won):
+        '''log in and request access from a single endpoint
+
+        Args:
+            endpoint (tuple): (host_addr, port) of the server
+            delay (float): time to wait before starting
+            won (asyncio.Event): set once another endpoint granted access
+
+        Returns:
+            tuple: (endpoint, session, resume_token) if access was granted,
+            otherwise None
+        '''
+        if delay:
+            try:
+                await asyncio.wait_for(won.wait(), delay, loop=self.event_loop)
+            except asyncio.TimeoutError:
+                pass
+        if won.is_set():
+            return None
+
+        host_addr, port = endpoint
+        stats = self.stats[endpoint]
+        session = self.new_session()
+        start = self.event_loop.time()
+        try:
+            async with session.get(
+                    self.make_url('login', host_addr=host_addr, port=port),
+                    auth=self.login_details) as resp:
+                r = await resp.text()
+            if r != 'logged in':
+                logger.debug("login error at {}:{}".format(host_addr, port))
+                stats.record_failure(self.event_loop.time())
+            else:
+                async with session.get(
+                        self.make_url('get_access', host_addr=host_addr, port=port)) as resp:
+                    r = await resp.text()
+                    token = resp.headers.get(RESUME_TOKEN_HEADER)
+                stats.record_latency(self.event_loop.time() - start)
+                if r == 'Resource granted':
+                    stats.grants += 1
+                    return endpoint, session, token
+                stats.busy += 1
+        except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as e:
+            logger.debug("failed to reach {}:{}: {}".format(host_addr, port, e))
+            stats.record_failure(self.event_loop.time())
+        await session.close()
+        return None
+
+    async def release(self, endpoint, session):
+        '''hand back a lease which isn't needed'''
+        host_addr, port = endpoint
+        try:
+            async with session.get(
+                    self.make_url('release', host_addr=host_addr, port=port)) as resp:
+                await resp.text()
+        except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as e:
+            logger.debug("failed to release {}:{}: {}".format(host_addr, port, e))
+        finally:
+            await session.close()
+
+    async def release_late_grants(self, attempts):
+        '''release whatever the attempts still running get granted'''
+        for attempt in asyncio.as_completed(attempts, loop=self.event_loop):
+            result = await attempt
+            if result is not None:
+                endpoint, session, token = result
+                await self.release(endpoint, session)
+
+    async def race(self):
+        '''request access from every endpoint and keep the first grant
+
+        Returns:
+            tuple: (endpoint, session, resume_token) or None if no endpoint
+            granted access'''
+        won = asyncio.Event(loop=self.event_loop)
+        pending = {
+            self.spawn(self.try_endpoint(endpoint, i*self.stagger, won))
+            for i, endpoint in enumerate(self.ranked_endpoints())}
+        winner = None
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending,
+                        return_when=asyncio.FIRST_COMPLETED, loop=self.event_loop)
+                for attempt in done:
+                    result = attempt.result()
+                    if result is None:
+                        continue
+                    if winner is None:
+                        winner = result
+                        won.set()
+                    else:
+                        endpoint, session, token = result
+                        self.spawn(self.release(endpoint, session))
+        finally:
+            if pending:
+                won.set()
+                self.spawn(self.release_late_grants(pending))
+        return winner
+
+    async def acquire(self):
+        for i in range(self.retry_attempts):
+            winner = await self.race()
+            if winner is not None:
+                (self.host_addr, self.port), session, self.resume_token = winner
+                logger.debug("resource granted by {}:{}".format(self.host_addr, self.port))
+                return session
+            logger.debug("All resources are busy, perhaps try again in a while?")
+            await asyncio.sleep(self.retry_wait_time, loop=self.event_loop)
+        logger.debug("Resources are still busy... giving up!")
+        return None
+
+    async def reacquire(self, session):
+        #the lease is gone, so take whichever server is free now
+        await session.close()
+        return await self.acquire()
@@ -7,9 +7,27 @@ from aiohttp_session import setup, get_session, SimpleCookieStorage
 from .AioJsonSrv import AioJsonSrv
 from .Wrapper import Wrapper
 from .ObjectWrapper import ObjectWrapper
-import ssl
+from .Metrics import Metrics
+from .Tracing import Tracer
+from .Compressor import Compressor
+from .Recorder import Recorder
+from .TokenBucket import TokenBucket
+from .RateLimiter import RateLimiter
+from .Watches import Watches, Subscriber
+from .streaming import send_fragmented
+from . import SharedBuffers
+from .tls import server_context
+from .tokens import derive_key, sign_token, verify_token
+from .Exceptions import ParseError, ServerOverloadedError, InternalError
+from .constants import (RESUME_TOKEN_HEADER, CLOSE_NOT_GRANTED, CLOSE_TOO_BIG,
+        CLOSE_INTERNAL_ERROR, DEFLATE_PROTOCOL, SHARED_MEMORY_HEADER, OBSERVER_HEADER)
 import logging
 import uuid
+from functools import partial
+from itertools import chain
+import os
+import ipaddress
+import json
 
 logger = logging.getLogger(__name__)
 
@@ -23,10 +41,49 @@ class AioRPCServ():
             obj=None,
             timeout=5,
             watchdog_timeout=5,
+            resume_grace=10,
+            tracing=False,
+            trace_buffer=1000,
+            attach_traces=False,
+            compression=True,
+            compression_threshold=1024,
+            compression_level=6,
+            shared_memory=False,
+            shared_memory_threshold=1<<20,
+            acquire_hook=None,
+            release_hook=None,
+            lazy=False,
+            idle_timeout=None,
+            teardown_hook=None,
+            single_flight=(),
+            shared_methods=(),
+            shared_workers=4,
+            inline_threshold=None,
+            inline_after=20,
+            read_only=(),
+            observer_rate=10,
+            observer_burst=20,
+            max_observers=1000,
+            record=None,
+            http_rpc=False,
+            stream_results=False,
+            stream_chunk_size=1<<16,
+            max_message_size=None,
+            max_in_flight=None,
+            user_rate=None,
+            user_burst=20,
+            connection_rate=None,
+            connection_burst=20,
+            min_watch_interval=0.1,
+            max_watches=100,
+            max_watch_idle=600,
             host_addr='0.0.0.0',
             port=8080,
             secure=True,
             cert='cert.pem',
+            ssl_context=None,
+            secret_key=None,
+            token_ttl=300,
             credentials
 
             ):
@@ -37,50 +94,267 @@ class AioRPCServ():
             method being served doesn't complete
             watchdog_timeout (int): the time in seconds after which the server 
             frees up the object being served to another client
+            resume_grace (int): the time in seconds the lease is held for a
+            client whose connection dropped, so that it can reconnect and carry
+            on where it left off
+            tracing (bool): time each stage of requests which carry a trace
+            id. The most recent traces can be read at '/traces'.
+            trace_buffer (int): the number of traces to keep
+            attach_traces (bool): add the timing breakdown to the response of
+            each traced request
+            compression (bool): allow clients to negotiate deflating messages
+            compression_threshold (int): the length in characters below which
+            messages are sent uncompressed
+            compression_level (int): zlib compression level, 1 to 9
+            shared_memory (bool): hand buffers in results to clients on the
+            same host through shared memory rather than the websocket. Needs
+            python 3.8 or later.
+            shared_memory_threshold (int): the size in bytes from which
+            buffers go through shared memory
+            acquire_hook (str): name of a method of the served object to call
+            whenever a client is granted the lease, e.g. to power up a device
+            release_hook (str): name of a method to call when a lease ends
+            lazy (bool): instantiate class_to_instantiate on the first granted
+            lease rather than straight away
+            idle_timeout (float): drop the instance of class_to_instantiate
+            once no lease has been held for this many seconds. It is
+            instantiated again on demand.
+            teardown_hook (str): name of a method to call on the instance
+            before it is dropped. It isn't exposed. lazy, idle_timeout and
+            teardown_hook can't be used with obj.
+            single_flight (iterable): names of methods for which identical
+            calls made while one is in flight share its result rather than
+            each running on the object
+            shared_methods (iterable): names of thread safe methods which may
+            run in parallel with each other, but never alongside the others
+            shared_workers (int): threads to run shared methods on
+            inline_threshold (float): seconds. Methods which have finished
+            within this inline_after times in a row are called straight from
+            the event loop while nothing else is queued for the object, until
+            a call overruns.
+            inline_after (int): see inline_threshold
+            read_only (iterable): names of methods which observers may call.
+            Observers are authenticated clients which connect without the
+            lease, alongside the client holding it. None are allowed if
+            empty.
+            observer_rate (float): calls per second each observer may make.
+            Calls beyond this are held back.
+            observer_burst (int): calls an observer may make at once before
+            being held to observer_rate
+            max_observers (int): the most observers connected at a time
+            record (str): path of a file to append the requests of every
+            session to, with their timings, for benchmarks/replay.py
+            http_rpc (bool): answer single or batch JSON-RPC bodies POSTed to
+            '/rpc'. Each is authenticated on its own, with basic auth or a
+            bearer token, and holds the lease only while it is processed.
+            stream_results (bool): encode list and dict results a slice at a
+            time as they are sent. Results longer than stream_chunk_size go
+            out as the fragments of one websocket message, or in chunks over
+            HTTP, so a large result isn't copied whole into memory.
+            stream_chunk_size (int): the length in characters of each fragment
+            max_message_size (int): the longest message accepted, in
+            characters or bytes, also once inflated. A websocket sending a
+            longer one is closed with code 1009 and a longer POST gets a 413.
+            max_in_flight (int): the most calls a connection may have waiting
+            for their response, or POSTs to '/rpc' waiting their turn. Calls
+            beyond this fail straight away with ServerOverloadedError.
+            user_rate (float): calls per second each login may make across its
+            connections. Calls beyond this fail straight away with
+            ServerOverloadedError.
+            user_burst (int): calls a login may make at once before being held
+            to user_rate
+            connection_rate (float): HTTP requests, e.g. logins and websocket
+            upgrades, per second allowed from each address. Requests beyond
+            this get a 429 before any other work is done.
+            connection_burst (int): requests an address may make at once
+            before being held to connection_rate
+            min_watch_interval (float): the shortest interval in seconds at
+            which clients may have a watched method called. Observers are
+            also held to their observer_rate.
+            max_watches (int): the most methods a connection may watch at once
+            max_watch_idle (float): the time in seconds a lease holder which is
+            watching keeps the lease without sending anything. Its watches
+            count as activity up to then, so it needn't call just to keep the
+            lease. 0 lets the lease time out after watchdog_timeout as usual.
             obj (object): The object to serve. Can use this or the class to
             instantiate
             host_addr (str): the address to serve on
             port (int): the port number to serve on
             cert (file_path): the path to the ssl certificate to use
+            ssl_context (ssl.SSLContext): used instead of building one from
+            cert
+            secret_key (bytes): signs session cookies and bearer tokens. A
+            random key is used if None, so cookies and tokens don't outlive the
+            server.
+            token_ttl (int): the time in seconds a bearer token from '/token'
+            stays valid
         '''
 
         event_loop = asyncio.get_event_loop()
+        self.metrics = Metrics()
 
         if class_to_instantiate is not None:
             obj = Wrapper(cls=class_to_instantiate, cls_args=None, loop=event_loop,
-                    timeout = timeout)
-        if obj is None:
+                    timeout = timeout, metrics=self.metrics,
+                    acquire_hook=acquire_hook, release_hook=release_hook,
+                    lazy=lazy, idle_timeout=idle_timeout,
+                    teardown_hook=teardown_hook, single_flight=single_flight,
+                    shared_methods=shared_methods, shared_workers=shared_workers,
+                    inline_threshold=inline_threshold, inline_after=inline_after)
+        elif obj is None:
             raise Exception("Need a value for either class_to_instantiate or obj")
+        elif lazy or idle_timeout is not None or teardown_hook is not None:
+            #an object passed in can't be dropped and made again
+            raise Exception("lazy, idle_timeout and teardown_hook need "
+                    "class_to_instantiate rather than obj")
         else:
-            obj = ObjectWrapper(obj=obj, loop=event_loop, timeout= timeout)
-        self.json_srv = AioJsonSrv(obj=obj)
+            obj = ObjectWrapper(obj=obj, loop=event_loop, timeout= timeout,
+                    metrics=self.metrics, acquire_hook=acquire_hook,
+                    release_hook=release_hook, single_flight=single_flight,
+                    shared_methods=shared_methods, shared_workers=shared_workers,
+                    inline_threshold=inline_threshold, inline_after=inline_after)
+        self.tracer = Tracer(trace_buffer) if tracing else None
+        if compression:
+            self.compressor = Compressor(threshold=compression_threshold,
+                    level=compression_level, metrics=self.metrics)
+        else:
+            self.compressor = None
+        if shared_memory and not SharedBuffers.available():
+            logger.warning("shared memory needs python 3.8 or later, not using it")
+            shared_memory = False
+        if shared_memory:
+            self.shared_buffers = SharedBuffers.SharedBuffers(
+                    threshold=shared_memory_threshold)
+        else:
+            self.shared_buffers = None
+        self.recorder = Recorder(record) if record is not None else None
+        #shared by the lease holder and observers so that they share polls
+        self.watches = Watches(obj=obj, loop=event_loop, metrics=self.metrics,
+                max_watches=max_watches)
+        self.json_srv = AioJsonSrv(obj=obj, metrics=self.metrics,
+                tracer=self.tracer, attach_traces=attach_traces,
+                shared_buffers=self.shared_buffers, stream=stream_results,
+                watches=self.watches, min_watch_interval=min_watch_interval)
+        self.read_only = frozenset(read_only)
+        self.observer_srv = AioJsonSrv(obj=obj, metrics=self.metrics,
+                tracer=self.tracer, attach_traces=attach_traces,
+                methods=self.read_only, stream=stream_results,
+                watches=self.watches,
+                min_watch_interval=max(min_watch_interval, 1/observer_rate))
+        self.stream_chunk_size = stream_chunk_size
+        self.observer_rate = observer_rate
+        self.observer_burst = observer_burst
+        self.max_observers = max_observers
+        self.observers = 0
+        self.max_message_size = max_message_size
+        self.max_in_flight = max_in_flight
+        self.user_limiter = RateLimiter(user_rate, user_burst) \
+                if user_rate is not None else None
+        self.connection_limiter = RateLimiter(connection_rate, connection_burst) \
+                if connection_rate is not None else None
 
         self.host_addr = host_addr
         self.port = port
         self.secure = secure
         self.cert = cert
+        if secure and ssl_context is None:
+            #built once so that the TLS session cache and ticket keys are
+            #shared by every connection
+            ssl_context = server_context(cert)
+        self.ssl_context = ssl_context
         self.watchdog_timeout = watchdog_timeout
+        self.resume_grace = resume_grace
+        self.max_watch_idle = max_watch_idle
         self.credentials = credentials
+        if secret_key is None:
+            secret_key = os.urandom(32)
+        self.cookie_key = derive_key(secret_key, 'cookie')
+        self.token_key = derive_key(secret_key, 'token')
+        self.token_ttl = token_ttl
 
 
         self.event_loop = event_loop
         self.locked = False
+        self.lease_start = None
         self.granted_sessions = {}
-        asyncio.ensure_future(self.watch_dog(), loop=event_loop)
+        self.http_rpc = http_rpc
+        #POSTs to '/rpc' wait for each other rather than being turned away
+        self.http_lock = asyncio.Lock(loop=event_loop)
+        self.http_waiting = 0
+        #Subscriber: websocket of each connection of the lease holder
+        self.holder_watchers = {}
+        self.watch_dog_task = asyncio.ensure_future(self.watch_dog(),
+                loop=event_loop)
         self.end_time=None
+        #when the watchdog was last kicked, i.e. the holder was last active
+        self.kicked = None
+
+    def kick_the_dog(self, timeout=None):
+        if timeout is None:
+            timeout = self.watchdog_timeout
+        self.kicked = self.event_loop.time()
+        self.end_time = self.kicked+timeout
 
-    def kick_the_dog(self):
-        self.end_time = self.event_loop.time()+self.watchdog_timeout
+    def holder_watching(self):
+        '''Returns:
+            bool: whether a connection of the lease holder has watches and
+            was active within max_watch_idle'''
+        return any(subscriber.subscriptions
+                for subscriber in self.holder_watchers) and \
+            self.event_loop.time() < self.kicked + self.max_watch_idle
+
+    def grant_lease(self, token=None):
+        '''lock the resource for a client
+
+        Args:
+            token (str): the lease to reinstate. A new one is made if None.
+
+        Returns:
+            str: the lease token'''
+        if token is None:
+            token = uuid.uuid4().hex
+        self.locked = token
+        self.lease_start = self.event_loop.time()
+        self.metrics.lease_grants.inc()
+        self.json_srv.obj.lease_granted()
+        return token
+
+    def release_lease(self, reason):
+        '''free up the resource for other clients
+
+        Args:
+            reason (str): why the lease ended, for metrics'''
+        if self.locked and self.lease_start is not None:
+            self.metrics.lease_releases.inc(reason)
+            self.metrics.lease_hold.observe(self.event_loop.time() - self.lease_start)
+        if self.locked:
+            self.json_srv.obj.lease_ended()
+        self.locked = False
+        self.lease_start = None
+        self.end_time = None
+        if self.shared_buffers is not None:
+            #nobody is left to release them
+            self.shared_buffers.release_all()
+        for subscriber, ws in list(self.holder_watchers.items()):
+            if subscriber.subscriptions:
+                #the object mustn't be polled for a client without the lease.
+                #Closing, which ws_handler finishes, tells it to get access
+                #again and watch again.
+                self.watches.drop(subscriber)
+                asyncio.ensure_future(ws.close(code=CLOSE_NOT_GRANTED,
+                    message='lease ended while watching'.encode('utf-8')),
+                    loop=self.event_loop)
 
     async def get_access(self, request):
         session = await get_session(request)
         if self.locked:
             logger.debug("resource is already locked...")
+            self.metrics.lease_denials.inc()
             session['resource_granted']= 'False'
             message = 'Sorry resource is busy, try again in a while...'
         else:
             logger.debug("locking device..")
-            self.locked = uuid.uuid4().hex
+            self.grant_lease()
             session['authenticated'] = self.locked
             message = 'Resource granted'
             session['resource_granted'] = self.locked
@@ -88,6 +362,21 @@ class AioRPCServ():
             logger.debug("event_loop.time: {}".format(self.event_loop.time()))
             self.kick_the_dog()
             logger.debug("end_time: {}".format(self.end_time))
+            return web.Response(body=message.encode('utf-8'),
+                    headers={RESUME_TOKEN_HEADER: self.locked})
+        return web.Response(body=message.encode('utf-8'))
+
+    async def release(self, request):
+        '''give up the lease early, e.g. a client which was granted more than
+        one resource only keeps one of them'''
+        session = await get_session(request)
+        granted = session.get('resource_granted', None)
+        if self.locked and granted == self.locked:
+            logger.debug("lease released by client..")
+            self.release_lease('released')
+            message = 'Resource released'
+        else:
+            message = 'Resource not held'
         return web.Response(body=message.encode('utf-8'))
 
     async def watch_dog(self):
@@ -95,13 +384,13 @@ class AioRPCServ():
         while(True):
             #logger.debug("woof:end_time: {}".format(self.end_time))
             if self.end_time is not None:
-                if self.event_loop.time() >= self.end_time:
+                if self.event_loop.time() >= self.end_time and \
+                        not self.holder_watching():
                     logger.debug("event_loop.time(): {}".format(self.event_loop.time()))
                     logger.debug("end_time: {}".format(self.end_time))
                     #release the lock
                     logger.debug("releasing the lock due to timeout..")
-                    self.locked = False
-                    self.end_time = None
+                    self.release_lease('timeout')
             #logger.debug(self.locked)
             await asyncio.sleep(1)
 
@@ -118,14 +407,67 @@ class AioRPCServ():
 
         return web.Response(body=message.encode('utf-8'))
 
+    @staticmethod
+    def is_local(request):
+        '''whether the request came from this host'''
+        peername = request.transport.get_extra_info('peername')
+        if not peername:
+            #a unix socket
+            return True
+        try:
+            return ipaddress.ip_address(peername[0]).is_loopback
+        except ValueError:
+            return False
+
+    def bearer_lease(self, request):
+        '''check a bearer token on the websocket upgrade and take the lease for
+        it if the resource is free. The lease is named after the token so
+        presenting it again resumes the lease.
+
+        Returns:
+            tuple: (lease, error response). One of them is None.'''
+        auth = request.headers.get('AUTHORIZATION', '')
+        claims = verify_token(self.token_key, auth[len('Bearer '):])
+        if claims is None:
+            return None, web.Response(status=401,
+                    body='invalid or expired token'.encode('utf-8'))
+        lease = claims['jti']
+        if self.locked and self.locked != lease:
+            logger.debug("resource is already locked...")
+            self.metrics.lease_denials.inc()
+            return None, web.Response(status=503,
+                    body='Sorry resource is busy, try again in a while...'.encode('utf-8'))
+        if not self.locked:
+            logger.debug("locking device for {}..".format(claims['sub']))
+            self.grant_lease(lease)
+            self.kick_the_dog()
+        return lease, None
+
     async def ws_handler(self, request):
+        if request.headers.get(OBSERVER_HEADER):
+            return await self.observer_handler(request)
 
-        session = await get_session(request)
-        ws = web.WebSocketResponse()
+        if request.headers.get('AUTHORIZATION', '').startswith('Bearer '):
+            #the token alone decides access, no session to decrypt
+            granted, denied = self.bearer_lease(request)
+            if denied is not None:
+                return denied
+        else:
+            session = await get_session(request)
+            granted = session.get('resource_granted', None)
+        ws = web.WebSocketResponse(
+                protocols=(DEFLATE_PROTOCOL,) if self.compressor else ())
         await ws.prepare(request)
+        if ws.protocol == DEFLATE_PROTOCOL:
+            compressor = self.compressor
+        else:
+            compressor = None
 
 
-        granted = session.get('resource_granted', None)
+        if granted is None or granted != self.locked:
+            #a client reconnecting after a dropped connection may present its
+            #lease directly
+            granted = request.headers.get(RESUME_TOKEN_HEADER, granted)
         logger.debug("granted: {} type(granted): {}".format(granted, type(granted)))
 
         _granted = False
@@ -136,45 +478,483 @@ class AioRPCServ():
 
 
         if not _granted:
-            await ws.close()
+            await ws.close(code=CLOSE_NOT_GRANTED,
+                    message='Resource not granted'.encode('utf-8'))
             logger.debug("not granted...returning")
-            return
-            #await ws.close(code=999, message='Resource busy'.encode('utf-8'))
-            #await ws.close(code=999, message='Resource busy'.encode('utf-8'))
-
+            return ws
 
+        if self.shared_buffers is not None:
+            self.json_srv.export_buffers = bool(
+                    request.headers.get(SHARED_MEMORY_HEADER)) and \
+                    self.is_local(request)
 
+        metrics = self.metrics
+        record = self.recorder.session() if self.recorder is not None else None
+        #each request is answered from its own task so that calls the client
+        #pipelines reach the object together. They are still handed to the
+        #single executor worker in the order they arrived.
+        pending = set()
+        #held while a response is sent in fragments, which nothing may come
+        #between
+        send_lock = asyncio.Lock(loop=self.event_loop)
+        subscriber = Subscriber(partial(self.push, ws, compressor, send_lock))
+        self.holder_watchers[subscriber] = ws
+        bucket = await self.user_bucket(request)
         async for msg in ws:
             self.kick_the_dog()
-            logger.debug("received msg: {}".format(msg.data))
+            logger.debug("received msg: %s", msg.data)
             if self.locked == False:
                 logger.debug('Timed Out waiting for client..')
                 logger.debug('Attempting to reacquire lock')
-                self.locked = granted
+                self.grant_lease(granted)
             elif self.locked != granted:
                 logger.debug("somebody else now using the resource...goodbye")
-                ws.close(code=999, message ='somebody else is now using resource due to timeout')
-                return ws
-            if msg.tp == aiohttp.MsgType.text:
+                await ws.close(code=CLOSE_NOT_GRANTED,
+                    message='somebody else is now using resource due to timeout'.encode('utf-8'))
+                break
+            if msg.tp == aiohttp.MsgType.text or (
+                    msg.tp == aiohttp.MsgType.binary and compressor is not None):
                 #if msg.data == 'close':
                 #    await ws.close()
                 #else:
-                self.end_time = None #don't cause a timeout because of slowness on server side
-                result_json, error = await self.json_srv.process_incoming(msg.data)
-                ws.send_str(result_json)
+                try:
+                    data = self.read_message(msg, compressor)
+                except ServerOverloadedError as e:
+                    await ws.close(code=CLOSE_TOO_BIG,
+                            message=e.args[0].encode('utf-8'))
+                    break
+                except ParseError as p:
+                    with (await send_lock):
+                        self.send(ws, self.json_srv.response_error(p),
+                                compressor)
+                    continue
+                error = self.overloaded(pending, bucket)
+                if error is not None:
+                    with (await send_lock):
+                        self.send(ws, self.json_srv.response_error(error,
+                            id_num=self.request_id(data)), compressor)
+                    continue
+                if record is not None:
+                    record(data)
+                task = asyncio.ensure_future(
+                        self.respond(ws, data, compressor, send_lock,
+                            session=subscriber),
+                        loop=self.event_loop)
+                pending.add(task)
+                task.add_done_callback(partial(self.request_done, pending))
             elif msg.tp == aiohttp.MsgType.error:
                 logger.debug('ws connection closed with exception %s' % ws.exception())
-            self.kick_the_dog()
+            if pending:
+                self.end_time = None #don't cause a timeout because of slowness on server side
+            else:
+                self.kick_the_dog()
 
-        logger.debug("Unlocking device..")
-        self.locked = False
-        self.end_time = None
+        if not ws.closed and self.locked != granted:
+            #stopped by release_lease. Closed here as aiohttp closes with
+            #1000 once the handler returns.
+            await ws.close(code=CLOSE_NOT_GRANTED,
+                    message='lease ended while watching'.encode('utf-8'))
+        if pending:
+            await asyncio.wait(pending, loop=self.event_loop)
+        self.holder_watchers.pop(subscriber, None)
+        self.watches.drop(subscriber)
+        if record is not None:
+            self.recorder.flush()
+        if self.locked == granted:
+            if ws.close_code == 1000:
+                logger.debug("Unlocking device..")
+                self.release_lease('closed')
+            else:
+                logger.debug("connection lost, holding the lease for {} secs".format(
+                    self.resume_grace))
+                self.kick_the_dog(self.resume_grace)
         logger.debug('websocket connection closed')
 
         return ws
 
-    async def authenticate(self, request):
+    async def observer_denied(self, request):
+        '''Returns:
+            web.Response: the refusal if the request may not observe, else
+            None'''
+        if not self.read_only:
+            return web.Response(status=403,
+                    body='observers are not allowed'.encode('utf-8'))
+        auth = request.headers.get('AUTHORIZATION', '')
+        if auth.startswith('Bearer '):
+            authenticated = verify_token(self.token_key,
+                    auth[len('Bearer '):]) is not None
+        else:
+            session = await get_session(request)
+            authenticated = session.get('authenticated', '').startswith('True:')
+        if not authenticated:
+            return web.Response(status=401,
+                    body='log in to observe'.encode('utf-8'))
+        if self.observers >= self.max_observers:
+            return web.Response(status=503,
+                    body='too many observers, try again in a while...'.encode('utf-8'))
+        return None
+
+    async def observer_handler(self, request):
+        '''serve a read only observer. It doesn't take or need the lease and
+        can only call the read_only methods, at its own limited rate. Nothing
+        is kept for an observer between calls beyond its websocket and rate
+        limit, so many idle observers are cheap.'''
+        denied = await self.observer_denied(request)
+        if denied is not None:
+            return denied
+        ws = web.WebSocketResponse(
+                protocols=(DEFLATE_PROTOCOL,) if self.compressor else ())
+        await ws.prepare(request)
+        compressor = self.compressor if ws.protocol == DEFLATE_PROTOCOL else None
+
+        metrics = self.metrics
+        bucket = TokenBucket(self.observer_rate, self.observer_burst)
+        pending = set()
+        send_lock = asyncio.Lock(loop=self.event_loop)
+        subscriber = Subscriber(partial(self.push, ws, compressor, send_lock))
+        user_bucket = await self.user_bucket(request)
+        self.observers += 1
+        metrics.observers.inc()
+        try:
+            async for msg in ws:
+                if msg.tp == aiohttp.MsgType.text or (
+                        msg.tp == aiohttp.MsgType.binary and compressor is not None):
+                    try:
+                        data = self.read_message(msg, compressor)
+                    except ServerOverloadedError as e:
+                        await ws.close(code=CLOSE_TOO_BIG,
+                                message=e.args[0].encode('utf-8'))
+                        break
+                    except ParseError as p:
+                        with (await send_lock):
+                            self.send(ws,
+                                    self.observer_srv.response_error(p),
+                                    compressor)
+                        continue
+                    error = self.overloaded(pending, user_bucket)
+                    if error is not None:
+                        with (await send_lock):
+                            self.send(ws, self.observer_srv.response_error(
+                                error, id_num=self.request_id(data)), compressor)
+                        continue
+                    delay = bucket.take()
+                    if delay:
+                        #reading no further holds the observer back
+                        await asyncio.sleep(delay, loop=self.event_loop)
+                    task = asyncio.ensure_future(
+                            self.respond(ws, data, compressor, send_lock,
+                                self.observer_srv, subscriber),
+                            loop=self.event_loop)
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                elif msg.tp == aiohttp.MsgType.error:
+                    logger.debug('observer connection closed with exception %s' %
+                            ws.exception())
+            if pending:
+                await asyncio.wait(pending, loop=self.event_loop)
+        finally:
+            self.watches.drop(subscriber)
+            self.observers -= 1
+            metrics.observers.dec()
+        return ws
+
+    def read_message(self, msg, compressor):
+        '''the text of a request which arrived over a websocket
+
+        Raises:
+            ParseError: if a binary message can't be inflated
+            ServerOverloadedError: if the message is longer than
+            max_message_size'''
+        data = msg.data
+        self.metrics.received_bytes.inc(amount=len(data))
+        max_size = self.max_message_size
+        try:
+            if max_size is not None and len(data) > max_size:
+                raise ServerOverloadedError(
+                        'message longer than {}'.format(max_size))
+            if msg.tp == aiohttp.MsgType.binary:
+                data = compressor.decompress(data, max_size)
+        except ServerOverloadedError:
+            self.metrics.rejected.inc('size')
+            raise
+        return data
+
+    def overloaded(self, pending, bucket):
+        '''check whether a connection may make another call
+
+        Args:
+            pending (set): the connection's calls in flight
+            bucket (TokenBucket): the rate limit of the connection's user, if
+            any
+
+        Returns:
+            ServerOverloadedError: why the call is turned away, or None'''
+        if self.max_in_flight is not None and len(pending) >= self.max_in_flight:
+            self.metrics.rejected.inc('in_flight')
+            return ServerOverloadedError('too many calls in flight')
+        if bucket is not None and not bucket.try_take():
+            self.metrics.rejected.inc('rate')
+            return ServerOverloadedError('too many calls, slow down')
+        return None
+
+    @staticmethod
+    def request_id(data):
+        '''the id of a request to answer it with when it is turned away'''
+        try:
+            id_num = json.loads(data).get('id')
+        except (ValueError, AttributeError):
+            return 'null'
+        return id_num if type(id_num) == int else 'null'
+
+    async def user_of(self, request):
+        '''Returns:
+            str: the login a request was made with, from a bearer token, basic
+            auth or the session'''
+        auth = request.headers.get('AUTHORIZATION', '')
+        if auth.startswith('Bearer '):
+            claims = verify_token(self.token_key, auth[len('Bearer '):])
+            return claims['sub'] if claims is not None else None
+        login = self.check_credentials(request)
+        if login is not None:
+            return login
         session = await get_session(request)
+        return session.get('login')
+
+    async def user_bucket(self, request):
+        '''Returns:
+            TokenBucket: the rate limit of the user making request, or None if
+            users aren't limited'''
+        if self.user_limiter is None:
+            return None
+        return self.user_limiter.bucket(await self.user_of(request))
+
+    async def admission_middleware(self, app, handler):
+        '''turn away requests from addresses making too many, before anything
+        else is done for them'''
+        async def middleware(request):
+            peername = request.transport.get_extra_info('peername')
+            address = peername[0] if peername else None
+            if not self.connection_limiter.allow(address):
+                self.metrics.rejected.inc('connection')
+                return web.Response(status=429,
+                        body='too many requests, slow down'.encode('utf-8'))
+            return await handler(request)
+        return middleware
+
+    async def respond(self, ws, data, compressor, send_lock, json_srv=None,
+            session=None):
+        '''process a request and send back the response, if any
+
+        Args:
+            send_lock (asyncio.Lock): held while sending on ws
+            json_srv (AioJsonSrv): processes the request, the lease holder's
+            if None
+            session (Subscriber): where notifications for watches made by
+            the request go'''
+        result_json, trace = await self.process(data, json_srv, session)
+        if result_json is not None and not ws.closed:
+            with (await send_lock):
+                if type(result_json) == str:
+                    self.send(ws, result_json, compressor)
+                elif not ws.closed:
+                    await self.send_streamed(ws, result_json, compressor)
+        if trace is not None:
+            trace.mark('send')
+            self.tracer.finish(trace)
+
+    async def process(self, data, json_srv=None, session=None):
+        '''Returns:
+            tuple: (response json or None, Trace or None). The caller marks
+            sending the response and finishes the trace.'''
+        if json_srv is None:
+            json_srv = self.json_srv
+        metrics = self.metrics
+        metrics.in_flight.inc()
+        try:
+            if self.tracer is None:
+                result_json, error = await json_srv.process_incoming(data,
+                        session)
+                return result_json, None
+            result_json, error, trace = \
+                await json_srv.process_incoming_traced(data, session)
+            return result_json, trace
+        finally:
+            metrics.in_flight.dec()
+
+    async def http_rpc_handler(self, request):
+        '''answer a single or batch JSON-RPC request POSTed to '/rpc'. The
+        lease is taken for the body and given up straight after, so one shot
+        callers skip logging in, get_access and the websocket. The connection
+        is kept alive for the next POST.'''
+        auth = request.headers.get('AUTHORIZATION', '')
+        if auth.startswith('Bearer '):
+            authenticated = verify_token(self.token_key,
+                    auth[len('Bearer '):]) is not None
+        else:
+            authenticated = self.check_credentials(request) is not None
+        if not authenticated:
+            return web.Response(status=401, body='login error'.encode('utf-8'))
+        max_size = self.max_message_size
+        if max_size is not None and (request.content_length or 0) > max_size:
+            self.metrics.rejected.inc('size')
+            return web.Response(status=413, body='body too large'.encode('utf-8'))
+        #read before taking the lease so a slow upload doesn't hold it
+        data = await request.text()
+        self.metrics.received_bytes.inc(amount=len(data))
+        if max_size is not None and len(data) > max_size:
+            self.metrics.rejected.inc('size')
+            return web.Response(status=413, body='body too large'.encode('utf-8'))
+        error = None
+        if self.max_in_flight is not None and \
+                self.http_waiting >= self.max_in_flight:
+            self.metrics.rejected.inc('in_flight')
+            error = ServerOverloadedError('too many calls waiting')
+        elif self.user_limiter is not None and \
+                not self.user_limiter.allow(await self.user_of(request)):
+            self.metrics.rejected.inc('rate')
+            error = ServerOverloadedError('too many calls, slow down')
+        if error is not None:
+            return web.Response(status=429,
+                    text=self.json_srv.response_error(error,
+                        id_num=self.request_id(data)),
+                    content_type='application/json')
+        self.http_waiting += 1
+        try:
+            await self.http_lock.acquire()
+        finally:
+            self.http_waiting -= 1
+        try:
+            if self.locked:
+                logger.debug("resource is already locked...")
+                self.metrics.lease_denials.inc()
+                return web.Response(status=503,
+                        body='Sorry resource is busy, try again in a while...'.encode('utf-8'))
+            if self.recorder is not None:
+                self.recorder.session()(data)
+            lease = self.grant_lease()
+            self.json_srv.export_buffers = False
+            try:
+                result_json, trace = await self.process(data)
+            finally:
+                if self.locked == lease:
+                    self.release_lease('http')
+        finally:
+            self.http_lock.release()
+        if trace is not None:
+            self.tracer.finish(trace)
+        if result_json is None:
+            #only notifications
+            return web.Response(status=204)
+        rest = None
+        if type(result_json) != str:
+            result_json, rest = self.encode_start(result_json)
+        if rest is None:
+            self.metrics.sent_bytes.inc(amount=len(result_json))
+            return web.Response(text=result_json,
+                    content_type='application/json')
+        resp = web.StreamResponse()
+        resp.content_type = 'application/json'
+        resp.enable_chunked_encoding()
+        await resp.prepare(request)
+        try:
+            for piece in chain((result_json,), rest):
+                data = piece.encode('utf-8')
+                self.metrics.sent_bytes.inc(amount=len(data))
+                resp.write(data)
+                await resp.drain()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            #drop the connection so the body is seen to be cut short
+            logger.error("failed sending the response to a POST: {}".format(e))
+            request.transport.close()
+            return resp
+        await resp.write_eof()
+        return resp
+
+    def request_done(self, pending, task):
+        '''restart the watchdog once the last request of a connection is
+        answered'''
+        pending.discard(task)
+        if not pending and self.end_time is None and self.locked:
+            self.kick_the_dog()
+
+    async def send_streamed(self, ws, response, compressor):
+        '''send a Messages.Response, encoding it as it goes. It is sent as
+        the fragments of one message if it is longer than a fragment.'''
+        first, rest = self.encode_start(response)
+        if rest is None:
+            self.send(ws, first, compressor)
+            return
+        pieces = chain((first,), rest)
+        try:
+            if compressor is None:
+                sent = await send_fragmented(ws,
+                        (piece.encode('utf-8') for piece in pieces))
+            else:
+                sent = await send_fragmented(ws,
+                        compressor.compress_pieces(pieces), binary=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            #the message can't be finished, and nothing else can be sent
+            #while it is unfinished
+            logger.error("failed sending the response to {}: {}".format(
+                response.id, e))
+            await ws.close(code=CLOSE_INTERNAL_ERROR,
+                    message='failed sending a response'.encode('utf-8'))
+            return
+        self.metrics.sent_bytes.inc(amount=sent)
+
+    def encode_start(self, response):
+        '''encode a Messages.Response up to its second fragment, so that a
+        result which can't be encoded is usually found before anything is
+        sent and can still be answered with an error
+
+        Returns:
+            tuple: (the first fragment, an iterator over the others or None if
+            there are none). The first is an error response if encoding
+            failed.'''
+        pieces = response.iterencode(self.stream_chunk_size)
+        try:
+            first = next(pieces, '')
+            second = next(pieces, None)
+        except Exception as e:
+            error = InternalError(e.__str__())
+            self.metrics.errors.inc(error.code)
+            return self.json_srv.response_error(error, id_num=response.id), None
+        if second is None:
+            return first, None
+        return first, chain((second,), pieces)
+
+    def push(self, ws, compressor, send_lock, message):
+        '''send a notification on ws, after any message going out in
+        fragments'''
+        if ws.closed:
+            return
+        if send_lock.locked():
+            asyncio.ensure_future(self.push_locked(ws, compressor, send_lock,
+                message), loop=self.event_loop)
+        else:
+            self.send(ws, message, compressor)
+
+    async def push_locked(self, ws, compressor, send_lock, message):
+        with (await send_lock):
+            if not ws.closed:
+                self.send(ws, message, compressor)
+
+    def send(self, ws, result_json, compressor):
+        if compressor is None:
+            ws.send_str(result_json)
+            sent = len(result_json)
+        else:
+            sent = compressor.send(ws, result_json)
+        self.metrics.sent_bytes.inc(amount=sent)
+
+    def check_credentials(self, request):
+        '''Returns:
+            str: the login given by the request's basic auth if the password
+            matches, otherwise None'''
         auth_request = request.headers.get('AUTHORIZATION', None)
         logger.debug('authentication: {}'.format(auth_request))
         if auth_request is not None:
@@ -182,18 +962,67 @@ class AioRPCServ():
                 creds = BasicAuth.decode(auth_request)
                 if creds.password == self.credentials.get(creds.login, ''):
                     logger.debug('Authenticated user: {}'.format(creds.login))
-                    session['authenticated'] = 'True:{}'.format(creds.login)
-                    return web.Response(body='logged in'.encode('utf-8'))
+                    return creds.login
             except ValueError as e:
                 pass
+        return None
+
+    async def authenticate(self, request):
+        session = await get_session(request)
+        login = self.check_credentials(request)
+        if login is not None:
+            session['authenticated'] = 'True:{}'.format(login)
+            session['login'] = login
+            return web.Response(body='logged in'.encode('utf-8'))
         return web.Response(body='login error'.encode('utf-8'))
 
+    async def token_handler(self, request):
+        '''exchange basic auth credentials for a bearer token which logs in
+        and takes the lease in the websocket upgrade'''
+        login = self.check_credentials(request)
+        if login is None:
+            return web.Response(status=401, body='login error'.encode('utf-8'))
+        token, claims = sign_token(self.token_key, login, self.token_ttl)
+        return web.json_response({'token': token, 'expires': claims['exp']})
 
-    def run(self):
+
+    async def metrics_handler(self, request):
+        return web.Response(body=self.metrics.render().encode('utf-8'),
+                headers={'Content-Type': self.metrics.content_type})
+
+    async def traces_handler(self, request):
+        '''the breakdown of the trace given by the id query parameter, or the
+        most recent traces, up to limit'''
+        if self.tracer is None:
+            return web.json_response([])
+        trace_id = request.GET.get('id')
+        if trace_id is not None:
+            trace = self.tracer.find(trace_id)
+            return web.json_response([trace] if trace is not None else [])
+        limit = request.GET.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                limit = -1
+            if limit < 0:
+                return web.Response(status=400,
+                        body='limit must be a non-negative integer'.encode('utf-8'))
+        return web.json_response(self.tracer.recent(limit))
+
+    async def close_recorder(self, app):
+        self.recorder.close()
+
+    def make_app(self):
+        '''Returns:
+            web.Application: the server's routes, ready to be run'''
         event_loop = self.event_loop
-        app = web.Application(loop=event_loop)
+        middlewares = []
+        if self.connection_limiter is not None:
+            middlewares.append(self.admission_middleware)
+        app = web.Application(loop=event_loop, middlewares=middlewares)
         #setup(app, SimpleCookieStorage())
-        setup(app, EncryptedCookieStorage(b'Thirty  two  length  bytes  key.'))
+        setup(app, EncryptedCookieStorage(self.cookie_key))
         app.router.add_route('GET', '/', self.root_handler)
         if self.secure:
             path = '/wss'
@@ -201,11 +1030,22 @@ class AioRPCServ():
             path = '/ws'
         app.router.add_route('GET', path, self.ws_handler)
         app.router.add_route('GET', '/get_access', self.get_access)
+        app.router.add_route('GET', '/release', self.release)
         app.router.add_route('GET', '/login', self.authenticate)
+        app.router.add_route('GET', '/token', self.token_handler)
+        app.router.add_route('GET', '/metrics', self.metrics_handler)
+        app.router.add_route('GET', '/traces', self.traces_handler)
+        if self.http_rpc:
+            app.router.add_route('POST', '/rpc', self.http_rpc_handler)
+        if self.recorder is not None:
+            app.on_cleanup.append(self.close_recorder)
+        return app
+
+    def run(self):
+        app = self.make_app()
         if self.secure:
             print("Using ssl cert: {}".format(self.cert))
-            sslcontext = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
-            sslcontext.load_cert_chain(self.cert)
-            web.run_app(app, host=self.host_addr, port=self.port, ssl_context=sslcontext)
+            web.run_app(app, host=self.host_addr, port=self.port,
+                    ssl_context=self.ssl_context)
         else:
             web.run_app(app, host=self.host_addr, port=self.port)
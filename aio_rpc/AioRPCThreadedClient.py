@@ -5,13 +5,15 @@ from .ClientObj import ClientObj
 from .Exceptions import NotFoundError
 from .AioRPCClient import AioRPCClient
 from functools import partial
+from collections import deque
+from concurrent.futures import Future
 import threading
 import signal
 from time import sleep
 #signal.signal(signal.SIGINT, signal.SIG_DFL)
 import logging
-#logger = logging.getLogger(__name__)
-logger = logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+#logger = logging.basicConfig(level=logging.DEBUG)
 
 def worker_thread(loop):
     asyncio.set_event_loop(loop)
@@ -20,17 +22,10 @@ def worker_thread(loop):
     #print("closing loop...")
     #loop.close()
 
-async def cancel_tasks(loop):
-    #print("stopping client")
-
-    for task in asyncio.Task.all_tasks(loop=loop):
-        if task == asyncio.Task.current_task(loop=loop):
-            continue
-        #print("killing task: {}".format(task))
-        task.cancel()
-        await asyncio.wait([task]) #wait for it to finish canceling
-    loop.stop()
-    #print("finished stopping client")
+async def stop_client(client):
+    '''cancel the client's tasks then stop its loop'''
+    await client.shutdown()
+    client.event_loop.stop()
 
 class AioRPCThreadedClient():
     '''instantiate RPC client in another thread'''
@@ -39,7 +34,12 @@ class AioRPCThreadedClient():
         host_addr='0.0.0.0',
         port=8080,
         timeout=2,
+        call_timeout=None,
         secure=True,
+        fingerprint=None,
+        cafile=None,
+        observer=False,
+        event_loop=None,
         login,
         pw
             ):
@@ -49,26 +49,54 @@ class AioRPCThreadedClient():
             port (int): the port number to connect to
             timeout (int):the time after which the client gives up connecting to
             the server
+            call_timeout (float): the default time to wait for the response to
+            a call. None waits forever.
             secure (bool): To connect via https or http
+            fingerprint (bytes or str): sha256 fingerprint the server's
+            certificate must match
+            cafile (file_path): certificates to verify the server against
+            observer (bool): connect as a read only observer, without the
+            lease
+            event_loop (asyncio event loop): a loop which isn't running, e.g.
+            from uvloop, to run in the client thread. A new one is made by
+            default and closed with the client.
         '''
         self.host_addr = host_addr
         self.port = port
         self.timeout = timeout
+        self.call_timeout = call_timeout
         self.secure = secure
+        self.fingerprint = fingerprint
+        self.cafile = cafile
+        self.observer = observer
         self.login = login
         self.pw = pw
+        self._owns_loop = event_loop is None
+        if event_loop is None:
+            event_loop = asyncio.new_event_loop()
+
+        #calls submitted from other threads waiting to be started on the loop
+        self._pending = deque()
+        self._pending_lock = threading.Lock()
+        self._wakeup_scheduled = False
+
         print('using secure: {}'.format(self.secure))
-        self._start_client()
+        self._start_client(event_loop)
 
-    def _start_client(self):
+    def _start_client(self, event_loop):
         client = AioRPCClient(
                 host_addr= self.host_addr,
                 port     = self.port,
                 timeout  = self.timeout,
                 secure   = self.secure,
+                fingerprint = self.fingerprint,
+                cafile   = self.cafile,
+                observer = self.observer,
                 login    = self.login,
-                pw       = self.pw
+                pw       = self.pw,
+                event_loop = event_loop
                 )
+        self._client = client
         self._event_loop = client.event_loop
         #if self.event_loop.is_running():
         #    self.event_loop.stop()
@@ -83,7 +111,7 @@ class AioRPCThreadedClient():
 
     def _stop_client(self):
         l = self._event_loop
-        future = asyncio.run_coroutine_threadsafe(cancel_tasks(l), l)
+        future = asyncio.run_coroutine_threadsafe(stop_client(self._client), l)
         #wait until loop has stopped
         for i in range(10):
             if not l.is_running():
@@ -94,11 +122,93 @@ class AioRPCThreadedClient():
         future.cancel()
         #print("finished _stop_client...")
 
+    def close(self):
+        '''close the connection normally, freeing the server for other
+        clients straight away, and stop the client thread'''
+        l = self._event_loop
+        future = asyncio.run_coroutine_threadsafe(self._client.close(), l)
+        try:
+            future.result(self.timeout)
+        except Exception as e:
+            logger.debug("failed to close the connection: {}".format(e))
+        self._stop_client()
+        self._thread.join(self.timeout)
+        if self._owns_loop and not self._thread.is_alive():
+            l.close()
+
+    def submit(self, method, args=(), kwargs=None, timeout=None):
+        '''call a method without waiting for its result
+
+        Args:
+            method (str): the name of the method to call
+            args (iterable): positional arguments for the method
+            kwargs (dict): keyword arguments for the method
+            timeout (float): the time to wait for the response. Defaults to
+            call_timeout.
+
+        Returns:
+            concurrent.futures.Future: resolves to the method's result
+        '''
+        if timeout is None:
+            timeout = self.call_timeout
+        future = Future()
+        self._pending.append((method, tuple(args), kwargs or {}, timeout, future))
+        #only the first call since the loop last drained the queue needs to
+        #wake it up
+        with self._pending_lock:
+            wakeup = not self._wakeup_scheduled
+            self._wakeup_scheduled = True
+        if wakeup:
+            self._event_loop.call_soon_threadsafe(self._start_pending)
+        return future
+
+    def map(self, method, *iterables, timeout=None):
+        '''call a method once for every set of arguments taken from iterables,
+        in the manner of the builtin map. All of the calls are submitted
+        before waiting for the first result.
+
+        Args:
+            method (str): the name of the method to call
+            iterables: supply the positional arguments of each call
+            timeout (float): the time to wait for each response. Defaults to
+            call_timeout.
+
+        Returns:
+            generator: the results in the order of the arguments
+        '''
+        futures = [self.submit(method, args, timeout=timeout)
+                for args in zip(*iterables)]
+
+        def result_iterator():
+            try:
+                for future in futures:
+                    yield future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+        return result_iterator()
+
+    def _start_pending(self):
+        '''runs on the event loop; start every call submitted since the last
+        wakeup'''
+        with self._pending_lock:
+            self._wakeup_scheduled = False
+        pending = self._pending
+        while pending:
+            method, args, kwargs, timeout, future = pending.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            self._client.spawn(self._call(method, args, kwargs, timeout, future))
+
+    async def _call(self, method, args, kwargs, timeout, future):
+        try:
+            result = await self._client_obj._call(method, args, kwargs, timeout)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
 
     def _caller(self, method, *args, **kwargs):
         '''this function is effectively being called by user'''
 
-        m = getattr(self._client_obj, method)(*args, *kwargs)
-        future = asyncio.run_coroutine_threadsafe(m, self._event_loop)
-        return future.result()
-
+        return self.submit(method, args, kwargs).result()
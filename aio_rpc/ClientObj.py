@@ -1,34 +1,171 @@
 from .AioJsonClient import AioJsonClient
-from asyncio import Future
-from functools import partial
+from .Exceptions import InvalidParamsError
+from .MethodStub import MethodStub
+from .discovery import DISCOVER_METHOD, RELEASE_METHOD, signature_from_description
+from .scripts import SCRIPT_METHOD
+from .watching import WATCH_METHOD
+from .Subscription import Subscription
+from asyncio import Future, wait_for
+from itertools import count
+from uuid import uuid4
 class ClientObj():
     '''Proxy object for object being served. User will attempt attribute access
     on this object'''
 
-    def __init__(self, event_loop, q, json_client):
-        '''safe event_loop and queue objects'''
+    def __init__(self, event_loop, q, json_client, timeout=None, trace=False):
+        '''safe event_loop and queue objects
+
+        Args:
+            timeout (float): the time to wait for a response before raising
+            asyncio.TimeoutError. None waits forever.
+            trace (bool): give every request a trace id so a server with
+            tracing enabled records its timing
+        '''
         self._event_loop = event_loop
         self._q = q
         self._json_client = json_client
         self._future_dict = json_client.future_dict
+        self._timeout = timeout
+        self._trace = trace
+        #method name: MethodStub, built on first use
+        self._stubs = {}
+        #descriptions of the remote methods once discovered
+        self._methods = None
+        self._subscription_ids = count()
 
 
     def __getattr__(self, item):
-        #return self._funcs[item] #implicitly raise an KeyError if not found
+        if item.startswith('__'):
+            raise AttributeError(item)
+        stub = self._stubs.get(item)
+        if stub is None:
+            if self._methods is None:
+                stub = MethodStub(self, item)
+            else:
+                stub = MethodStub(self, item, exists=False)
+            self._stubs[item] = stub
+        return stub
 
-        p = partial(self._caller, item)
+    async def _discover(self):
+        '''fetch the served object's methods with rpc.discover and replace the
+        stubs with ones which check arguments locally
 
-        return p
+        Returns:
+            dict: the description of the methods, which can be passed to
+            aio_rpc.discovery.generate_stub
+        '''
+        description = await self._call(DISCOVER_METHOD, (), {}, self._timeout)
+        self._methods = description['methods']
+        self._stubs = {
+            name: MethodStub(self, name,
+                signature=signature_from_description(desc), doc=desc['doc'])
+            for name, desc in self._methods.items()}
+        return description
 
 
     async def _caller(self, __method, *args, **kwargs):
         '''this function is effectively being called by user'''
-        request_json, id_num = self._json_client.request(
-                __method,
-                positional_params=args,
-                keyword_params = kwargs)
-        #issue it for dispatch
-        self._q.put_nowait(request_json)
+        return await self._call(__method, args, kwargs, self._timeout)
+
+    async def _release(self, *buffers):
+        '''unmap SharedBuffers received in results and let the server free
+        them'''
+        for b in buffers:
+            b.close()
+        return await self._call(RELEASE_METHOD, ([b.name for b in buffers],),
+                {}, self._timeout)
+
+    async def _script(self, *calls):
+        '''make several calls on the server in one round trip, one after
+        another
+
+        Args:
+            calls: (method name, params) pairs where params is a list of
+            positional or a dict of keyword arguments. Arguments may refer to
+            the results of earlier calls with aio_rpc.scripts.ref.
+
+        Returns:
+            list: the result of each call
+
+        Raises:
+            ScriptError: if a call failed. Its index and results attributes
+            give the failed call and the results of those before it.
+        '''
+        return await self._call(SCRIPT_METHOD,
+                ([{'method': m, 'params': p} for m,p in calls],), {},
+                self._timeout)
+
+    async def _watch(self, method, params=None, interval=1, callback=None):
+        '''have the server call a method every interval seconds and send the
+        result whenever it changes. Clients watching the same method with the
+        same arguments share the calls.
+
+        Args:
+            method (str): the name of the method to watch
+            params (list or dict): positional or keyword arguments to call it
+            with
+            interval (float): the time between calls in seconds. The server
+            may call less often.
+            callback (callable): called with the Subscription on each change
+
+        Returns:
+            Subscription: holds the latest result, which it is sent first
+        '''
+        subscription = Subscription(self, next(self._subscription_ids),
+                method, params, interval, callback)
+        await self._subscribe(subscription)
+        return subscription
+
+    async def _subscribe(self, subscription):
+        subscriptions = self._json_client.subscriptions
+        #registered first as the first result may arrive with the response
+        subscriptions[subscription.id] = subscription
+        try:
+            await self._call(WATCH_METHOD, (subscription.id, subscription.method,
+                subscription.params, subscription.interval), {}, self._timeout)
+        except BaseException:
+            #kept to try again on the next connection if it was watched
+            if not subscription.watching:
+                subscriptions.pop(subscription.id, None)
+            raise
+        subscription.watching = True
+
+    async def _rewatch(self):
+        '''watch again after reconnecting, as the server ends the watches of
+        a connection when it closes'''
+        for subscription in list(self._json_client.subscriptions.values()):
+            #others are still on their way
+            if not subscription.watching:
+                continue
+            try:
+                await self._subscribe(subscription)
+            except Exception as e:
+                subscription._update(error=e)
+
+    async def _call(self, method, args, kwargs, timeout=None, template=None):
+        '''issue a request and wait for its response
+
+        Args:
+            method (str): the name of the method to call
+            args (iterable): positional arguments
+            kwargs (dict): keyword arguments
+            timeout (float): the time to wait for the response. None waits
+            forever.
+            template (function): builds the request in place of
+            json_client.request, see JsonRPCABC.request_template
+        '''
+        if args and kwargs:
+            raise InvalidParamsError(
+                'positional and keyword arguments cannot be mixed in JSON-RPC')
+        trace_id = uuid4().hex if self._trace else None
+        if template is not None:
+            request_json, id_num = template(args, kwargs, trace_id)
+        else:
+            request_json, id_num = self._json_client.request(
+                    method,
+                    positional_params=args,
+                    keyword_params = kwargs,
+                    trace_id = trace_id)
 
         #now create a future to wait on
         f = Future(loop=self._event_loop)
@@ -36,9 +173,13 @@ class ClientObj():
         #store it in the request_dict to AioJsonClient can set its result.
         self._future_dict[id_num] = f
 
-        #now await for the result
-        #print("Now awaiting for result..")
-        #TODO add a timeout here
-        return await f
+        try:
+            #issue it for dispatch
+            await self._q.put((id_num, method, request_json))
 
+            #now await for the result
+            return await wait_for(f, timeout, loop=self._event_loop)
+        finally:
+            #a response arriving after a timeout has nothing to go to
+            self._future_dict.pop(id_num, None)
 
@@ -0,0 +1,103 @@
+import zlib
+from time import perf_counter
+from .Exceptions import ParseError, ServerOverloadedError
+
+
+class Compressor():
+    '''Deflates messages above a size threshold. Compressed messages go out as
+    binary frames while smaller ones stay as text frames, so the receiver can
+    tell them apart without any extra framing.'''
+
+    def __init__(self, *, threshold=1024, level=6, metrics=None,
+            max_size=1<<26):
+        '''
+        Args:
+            threshold (int): messages shorter than this are sent uncompressed
+            level (int): zlib compression level, 1 (fastest) to 9 (smallest)
+            metrics (Metrics): records the sizes before and after compression
+            and the time taken
+            max_size (int): the most bytes a received message may inflate to,
+            unless decompress is given a limit. None is unlimited.
+        '''
+        self.threshold = threshold
+        self.level = level
+        self.metrics = metrics
+        self.max_size = max_size
+
+    def send(self, ws, message:str):
+        '''send message over ws, compressed if it is long enough and
+        compression actually makes it smaller
+
+        Returns:
+            int: the number of bytes sent'''
+        if len(message) >= self.threshold:
+            data = message.encode('utf-8')
+            start = perf_counter()
+            compressed = zlib.compress(data, self.level)
+            if self.metrics is not None:
+                self.metrics.compression_duration.observe(
+                        perf_counter() - start, 'compress')
+            if len(compressed) < len(data):
+                if self.metrics is not None:
+                    self.metrics.compression_raw_bytes.inc('sent', amount=len(data))
+                    self.metrics.compressed_bytes.inc('sent', amount=len(compressed))
+                ws.send_bytes(compressed)
+                return len(compressed)
+        ws.send_str(message)
+        return len(message)
+
+    def compress_pieces(self, pieces):
+        '''deflate a message given as a sequence of strings into a sequence of
+        bytes which zlib.decompress takes once joined, without holding the
+        whole message'''
+        compressor = zlib.compressobj(self.level)
+        raw = 0
+        compressed = 0
+        duration = 0
+        for piece in pieces:
+            data = piece.encode('utf-8')
+            raw += len(data)
+            start = perf_counter()
+            out = compressor.compress(data)
+            duration += perf_counter() - start
+            if out:
+                compressed += len(out)
+                yield out
+        out = compressor.flush()
+        compressed += len(out)
+        if self.metrics is not None:
+            self.metrics.compression_duration.observe(duration, 'compress')
+            self.metrics.compression_raw_bytes.inc('sent', amount=raw)
+            self.metrics.compressed_bytes.inc('sent', amount=compressed)
+        yield out
+
+    def decompress(self, data:bytes, max_size=None) -> str:
+        '''
+        Args:
+            max_size (int): the most bytes data may inflate to, the
+            compressor's max_size if None
+
+        Raises:
+            ParseError: if data isn't a deflated utf-8 string
+            ServerOverloadedError: if data inflates to more than max_size'''
+        if max_size is None:
+            max_size = self.max_size
+        start = perf_counter()
+        try:
+            decompressor = zlib.decompressobj()
+            #a max_length of 0 is unlimited
+            message = decompressor.decompress(data, max_size or 0)
+            if decompressor.unconsumed_tail:
+                raise ServerOverloadedError(
+                        'message inflates to more than {} bytes'.format(max_size))
+            if not decompressor.eof:
+                raise zlib.error('incomplete or truncated stream')
+            message = message.decode('utf-8')
+        except (zlib.error, UnicodeDecodeError) as e:
+            raise ParseError(e.__str__())
+        if self.metrics is not None:
+            self.metrics.compression_duration.observe(
+                    perf_counter() - start, 'decompress')
+            self.metrics.compression_raw_bytes.inc('received', amount=len(message))
+            self.metrics.compressed_bytes.inc('received', amount=len(data))
+        return message
@@ -53,6 +53,38 @@ class UnimplementedError(JsonRPCError):
     code    = -32000
     error   = 'Unimplemented error'
 
+class ConnectionLostError(JsonRPCError):
+    'The connection was lost before a response was received.'
+    code    = -32001
+    error   = 'Connection lost'
+
+class ScriptError(JsonRPCError):
+    'A call in the script failed. The calls after it were not made.'
+    code    = -32002
+    error   = 'Script error'
+
+    def __init__(self, *args, index=None, results=(), cause=None):
+        super().__init__(*args)
+        #the position of the failed call and the results of those before it
+        self.index = index
+        self.results = list(results)
+        self.cause = cause
+
+    def to_json_rpc_dict(self):
+        d = super().to_json_rpc_dict()
+        d['data']['index'] = self.index
+        d['data']['results'] = self.results
+        if self.cause is not None:
+            d['data']['cause'] = {
+                    'code'    : self.cause.code,
+                    'message' : self.cause.error}
+        return d
+
+class ServerOverloadedError(JsonRPCError):
+    'The server turned the request away to protect its other work. Try again later.'
+    code    = -32003
+    error   = 'Server overloaded'
+
 exceptions_from_codes = {
         JsonRPCError.code : JsonRPCError,
         ParseError.code : ParseError,
@@ -60,4 +92,7 @@ exceptions_from_codes = {
         NotFoundError.code       : NotFoundError,
         InvalidParamsError.code  : InvalidParamsError,
         InternalError.code       : InternalError,
-        UnimplementedError.code  : UnimplementedError }
+        UnimplementedError.code  : UnimplementedError,
+        ConnectionLostError.code : ConnectionLostError,
+        ScriptError.code         : ScriptError,
+        ServerOverloadedError.code : ServerOverloadedError }
@@ -1,3 +1,4 @@
+import asyncio
 import json
 from .Exceptions import (
         JsonRPCError,
@@ -7,8 +8,10 @@ from .Exceptions import (
         InvalidParamsError,
         InternalError,
         UnimplementedError,
+        ScriptError,
         exceptions_from_codes)
 from .custom_json import from_json,to_json
+from .Messages import Request, Notification, Response, Error, parse
 
 class JsonRPCABC():
     '''Abstract Base Class defining generic functions relating to JSON-RPC 2.0.
@@ -17,50 +20,68 @@ class JsonRPCABC():
 
 
     _id = 0
+    #decodes the objects to_json encoded
+    object_hook = staticmethod(from_json)
 
     def request(self, method_name:str, *, id_num=None, positional_params=None,
-            keyword_params:dict=None, notification=False):
+            keyword_params:dict=None, notification=False, trace_id=None):
         '''create a json request object out of the specified arguments
-        provided.'''
-
-        request_dict = {
-                'jsonrpc' : '2.0',
-                'method'  : method_name}
-
-        id_to_use = None
-        if not notification:
-            if id_num is not None:
-                id_to_use = id_num
-            else:
-                id_to_use = self._id
-                self._id += 1
-            request_dict['id'] = id_to_use
+        provided. A trace_id asks a server with tracing enabled to record
+        where the time goes while handling the request.'''
 
         #grab the first non empty argument and default to None otherwise
         params_to_use = next(
             (_ for _ in (positional_params, keyword_params) if _), None)
 
-        if params_to_use:
-            request_dict['params'] = params_to_use
+        if notification:
+            return Notification(method_name, params_to_use).to_json(), None
+
+        if id_num is not None:
+            id_to_use = id_num
+        else:
+            id_to_use = self._id
+            self._id += 1
+        return Request(method_name, params_to_use, id_to_use,
+                trace_id).to_json(), id_to_use
+
+    def request_template(self, method_name:str):
+        '''prepare the parts of a request to method_name which are the same
+        for every call, for clients calling the same method repeatedly
 
-        return json.dumps(request_dict, default=to_json), id_to_use
+        Returns:
+            function: make_request(positional_params=None, keyword_params=None,
+            trace_id=None) which returns the same (json, id) as request'''
+        head = '{{"jsonrpc": "2.0", "method": {}'.format(json.dumps(method_name))
+        dumps = json.dumps
+
+        def make_request(positional_params=None, keyword_params=None,
+                trace_id=None):
+            id_to_use = self._id
+            self._id += 1
+            parts = [head]
+            params_to_use = positional_params or keyword_params
+            if params_to_use:
+                parts.append(', "params": ')
+                parts.append(dumps(params_to_use, default=to_json))
+            if trace_id is not None:
+                parts.append(', "trace": ')
+                parts.append(dumps(trace_id))
+            parts.append(', "id": {}}}'.format(id_to_use))
+            return ''.join(parts), id_to_use
+        return make_request
 
     @staticmethod
-    def response_result(id_num:int, result):
+    def response_result(id_num:int, result, trace=None):
         '''create an result response object based on the given arguments
         Args:
             id_num (int): the id of the response
             result : some form of object that is parsable into json format
+            trace (dict): a timing breakdown to attach to the response
 
         Returns:
             str: A json formatted string'''
 
-        response_dict = {
-                'jsonrpc' : '2.0',
-                'result'  : result,
-                'id'      : id_num
-                        }
-        return json.dumps(response_dict, default=to_json)
+        return Response(id_num, result, trace).to_json()
 
     @staticmethod
     def response_error(exception, id_num='null'):
@@ -72,12 +93,7 @@ class JsonRPCABC():
         Returns:
             str: A json formatted string'''
 
-        response_dict = {
-                'jsonrpc' : '2.0',
-                'error'   : exception.to_json_rpc_dict(),
-                'id'      : id_num
-                        }
-        return json.dumps(response_dict, default=to_json)
+        return Error(id_num, exception.to_json_rpc_dict()).to_json()
 
     async def process_request(self, request):
         '''Received JSON indicates a request object. A server would need to
@@ -87,7 +103,7 @@ class JsonRPCABC():
         function when implementing a client.
 
         Args:
-            request (dict): a dictionary containing the request to service
+            request (Request): the request to service
 
         Returns:
             response_object: the pre-jsonified response
@@ -99,7 +115,7 @@ class JsonRPCABC():
         '''Process a notification object. Similar to a request but don't respond
         with anything
         Args:
-            notification (a json object):the decoded notification from the
+            notification (Notification): the decoded notification from the
             client
         '''
 
@@ -112,7 +128,7 @@ class JsonRPCABC():
 
         raise UnimplementedError()
 
-    def process_error(self, json_dict:dict):
+    def process_error(self, error):
         raise UnimplementedError()
 
     def exception_from_json_dict(self, json_dict:dict)->Exception:
@@ -129,66 +145,89 @@ class JsonRPCABC():
             exc = exceptions_from_codes[code](details)
         else:
             exc = JsonRPCError(details)
+        if isinstance(exc, ScriptError) and data is not None:
+            exc.index = data.get('index')
+            exc.results = data.get('results', [])
         return exc
 
-    async def process_incoming(self, json_obj:str) -> str:
+    def decode(self, json_obj:str):
+        '''decode an incoming string
+
+        Raises:
+            ParseError: if the string isn't valid json'''
+        try:
+            return json.loads(json_obj, object_hook=self.object_hook)
+        except ValueError as e:
+            raise ParseError(e.__str__())
+
+    async def process_incoming(self, json_obj:str, session=None) -> str:
         '''Process an incoming (either to a client or server) string. This
         function is always expected to return some form of string which can be
-        sent to the sender in a jsonified string.'''
+        sent to the sender in a jsonified string.
+
+        Args:
+            session: the connection json_obj arrived on, handed to requests
+            as Request.session'''
 
         try:
-            result = json.loads(json_obj, object_hook=from_json)
-        except ValueError as e:
-            p = ParseError(e.__str__())
+            result = self.decode(json_obj)
+        except ParseError as p:
             return self.response_error(p), p
 
-        #now parse it for legitimacy
+        return await self.process_message(result, session)
+
+    async def process_message(self, result, session=None):
+        '''Process a decoded incoming message'''
+
         if type(result) == list:
             if len(result) == 0:
                 i = InvalidRequestError('Sent an empty batch')
                 return self.response_error(i), i
-            else:
-                #process a batch
-                raise UnimplementedError('Fixme - handle a batch!')
-
-        if ('jsonrpc','2.0') not in result.items():
-            i = InvalidRequestError('Missing or invalid rpc spec information')
-            return self.response_error(i), i
-
-        if 'method' in result:
-            method_arg = result['method']
-            #it's a request
-            if 'id' not in result: #it's a notification
-                return await self.process_notification(result)
-            id_num = result['id']
-            if type(id_num) != int:
-                i = InvalidRequestError( 'id in request must be an integer')
-                return self.response_error(i), i
-            if type(method_arg) == int:
-                i = InvalidRequestError( 'method cannot be a number')
-                return self.response_error(i, id_num=id_num), i
-            if type(method_arg) != str:
-                i = InvalidRequestError( 'method name has to be a string')
-                return self.response_error(i, id_num=id_num), i
-            if len(method_arg) == 0:
-                i = InvalidRequestError( 'method cannot be empty')
-                return self.response_error(i, id_num=id_num), i
-            if method_arg[:1].isdigit():
-                i = InvalidRequestError( 'method cannot start with a number')
-                return self.response_error(i, id_num=id_num), i
-            else:
-                return await self.process_request(result)
-        elif 'result' in result:
-            if 'id' not in result:
-                i = InvalidRequestError('Missing ID in result')
-                return self.response_error(i), i
-            if 'error' in result:
-                i = InvalidRequestError(
-                        'Result contains a result and an error field')
-                return self.response_error(i), i
+            response, errors = await self.process_batch(result, session)
+            return response, errors[0] if errors else None
 
-            return self.process_response(result)
-        elif 'error' in result:
-            return self.process_error(result)
+        return await self.dispatch(parse(result, session))
 
+    async def process_batch(self, messages, session=None):
+        '''process the messages of a batch together. Requests are started
+        in the order they appear, though their responses may finish in any
+        order.
 
+        Returns:
+            tuple: (a json array of the responses, or None if there are none
+            e.g. for a batch of notifications, list of the exceptions)'''
+        results = await asyncio.gather(
+                *[self.dispatch(parse(m, session)) for m in messages])
+        responses = []
+        errors = []
+        for r,e in results:
+            if r is not None and type(r) != str:
+                #a streamed response is encoded whole as part of a batch
+                try:
+                    r = r.to_json()
+                except Exception as ex:
+                    e = InternalError(ex.__str__())
+                    r = self.response_error(e, id_num=r.id)
+            if r is not None:
+                responses.append(r)
+            if e is not None:
+                errors.append(e)
+        if not responses:
+            return None, errors
+        return '[{}]'.format(', '.join(responses)), errors
+
+    async def dispatch(self, message):
+        '''hand a message returned by Messages.parse to the method for its
+        type'''
+        kind = type(message)
+        if kind is Request:
+            return await self.process_request(message)
+        if kind is Notification:
+            return await self.process_notification(message)
+        if kind is Response:
+            return self.process_response(message)
+        if kind is Error:
+            return self.process_error(message)
+        #the message is invalid
+        return self.response_error(message.error, id_num=message.id), \
+                message.error
@@ -0,0 +1,182 @@
+'''Typed JSON-RPC 2.0 messages. parse checks a decoded message in a single
+pass and returns one of the classes below, which are then passed around in
+place of the raw dicts. Each encodes itself with to_json.'''
+import json
+from itertools import chain
+from .Exceptions import InvalidRequestError
+from .custom_json import to_json
+from .streaming import iterencode
+
+_MISSING = object()
+
+
+class Request():
+    __slots__ = ('method', 'params', 'id', 'trace', 'session')
+
+    def __init__(self, method, params=None, id=None, trace=None,
+            session=None):
+        '''
+        Args:
+            params (list or dict): None if there are none
+            trace: the trace id sent with the request. A server replaces it
+            with a Tracing.Trace while the request is handled.
+            session: the connection the request arrived on, for built-in
+            methods which send to it later, e.g. a Watches.Subscriber. It
+            isn't part of the json.
+        '''
+        self.method = method
+        self.params = params
+        self.id = id
+        self.trace = trace
+        self.session = session
+
+    def to_json(self):
+        d = {
+                'jsonrpc' : '2.0',
+                'method'  : self.method,
+                'id'      : self.id}
+        if self.params:
+            d['params'] = self.params
+        if self.trace is not None:
+            d['trace'] = self.trace
+        return json.dumps(d, default=to_json)
+
+
+class Notification():
+    '''A request which isn't answered'''
+    __slots__ = ('method', 'params')
+
+    def __init__(self, method, params=None):
+        self.method = method
+        self.params = params
+
+    def to_json(self):
+        d = {
+                'jsonrpc' : '2.0',
+                'method'  : self.method}
+        if self.params:
+            d['params'] = self.params
+        return json.dumps(d, default=to_json)
+
+
+class Response():
+    __slots__ = ('id', 'result', 'trace')
+
+    def __init__(self, id, result, trace=None):
+        '''
+        Args:
+            trace (dict): a timing breakdown attached by the server
+        '''
+        self.id = id
+        self.result = result
+        self.trace = trace
+
+    def to_json(self):
+        d = {
+                'jsonrpc' : '2.0',
+                'result'  : self.result,
+                'id'      : self.id}
+        if self.trace is not None:
+            d['trace'] = self.trace
+        return json.dumps(d, default=to_json)
+
+    def iterencode(self, size=1<<16, items=1000):
+        '''yield to_json() in pieces of at least size characters, bar the
+        last, encoding the result a slice at a time. See
+        streaming.iterencode.'''
+        pieces = []
+        length = 0
+        parts = iterencode(self.result, items)
+        tail = ', "id": {}'.format(json.dumps(self.id))
+        if self.trace is not None:
+            tail += ', "trace": {}'.format(json.dumps(self.trace, default=to_json))
+        for piece in chain(('{"jsonrpc": "2.0", "result": ',), parts,
+                (tail, '}')):
+            pieces.append(piece)
+            length += len(piece)
+            if length >= size:
+                yield ''.join(pieces)
+                pieces = []
+                length = 0
+        if pieces:
+            yield ''.join(pieces)
+
+
+class Error():
+    '''An error response'''
+    __slots__ = ('id', 'error')
+
+    def __init__(self, id, error):
+        '''
+        Args:
+            error (dict): as made by JsonRPCError.to_json_rpc_dict
+        '''
+        self.id = id
+        self.error = error
+
+    def to_json(self):
+        return json.dumps({
+                'jsonrpc' : '2.0',
+                'error'   : self.error,
+                'id'      : self.id}, default=to_json)
+
+
+class Invalid():
+    '''A message which doesn't follow the specification, to be answered with
+    the error'''
+    __slots__ = ('id', 'error')
+
+    def __init__(self, error, id='null'):
+        '''
+        Args:
+            error (InvalidRequestError): why the message is invalid
+            id: the id of the request if it could be read
+        '''
+        self.error = error
+        self.id = id
+
+
+def _invalid(message, id_num='null'):
+    return Invalid(InvalidRequestError(message), id_num)
+
+
+def parse(obj, session=None):
+    '''check a single decoded message
+
+    Args:
+        session: set as the session of a Request
+
+    Returns:
+        Request, Notification, Response, Error or Invalid'''
+    if type(obj) != dict or obj.get('jsonrpc') != '2.0':
+        return _invalid('Missing or invalid rpc spec information')
+
+    method = obj.get('method', _MISSING)
+    if method is not _MISSING:
+        id_num = obj.get('id', _MISSING)
+        if id_num is _MISSING:
+            return Notification(method, obj.get('params'))
+        if type(id_num) != int:
+            return _invalid('id in request must be an integer')
+        if type(method) != str:
+            if type(method) == int:
+                return _invalid('method cannot be a number', id_num)
+            return _invalid('method name has to be a string', id_num)
+        if not method:
+            return _invalid('method cannot be empty', id_num)
+        if method[0].isdigit():
+            return _invalid('method cannot start with a number', id_num)
+        params = obj.get('params')
+        if params is not None and type(params) not in (list, dict):
+            return _invalid('params must be an array or an object', id_num)
+        return Request(method, params, id_num, obj.get('trace'), session)
+
+    if 'result' in obj:
+        if 'id' not in obj:
+            return _invalid('Missing ID in result')
+        if 'error' in obj:
+            return _invalid('Result contains a result and an error field')
+        return Response(obj['id'], obj['result'], obj.get('trace'))
+    if 'error' in obj:
+        return Error(obj.get('id'), obj['error'])
+    return _invalid('Not a request, result or error')
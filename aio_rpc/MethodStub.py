@@ -0,0 +1,39 @@
+from .Exceptions import InvalidParamsError, NotFoundError
+
+
+class MethodStub():
+    '''Stands in for one remote method on a ClientObj. If the method's
+    signature is known from discovery, calls are checked locally before
+    anything is sent.'''
+
+    def __init__(self, client_obj, name, *, signature=None, doc=None,
+            exists=True):
+        '''
+        Args:
+            client_obj (ClientObj): issues the calls
+            name (str): the name of the remote method
+            signature (inspect.Signature): checked against each call's
+            arguments
+            doc (str): the remote method's docstring
+            exists (bool): False if discovery showed the server has no such
+            method, so calling it fails straight away
+        '''
+        self._client_obj = client_obj
+        self._exists = exists
+        self._template = client_obj._json_client.request_template(name)
+        self.__name__ = name
+        self.__signature__ = signature
+        self.__doc__ = doc
+
+    async def __call__(self, *args, **kwargs):
+        if not self._exists:
+            raise NotFoundError(
+                    "server has no method '{}'".format(self.__name__))
+        if self.__signature__ is not None:
+            try:
+                self.__signature__.bind(*args, **kwargs)
+            except TypeError as e:
+                raise InvalidParamsError(e.__str__())
+        client_obj = self._client_obj
+        return await client_obj._call(self.__name__, args, kwargs,
+                client_obj._timeout, template=self._template)
@@ -0,0 +1,212 @@
+from bisect import bisect_left
+import threading
+
+#seconds, suited to calls which range from a quick getter to a slow instrument
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+        0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(n, str(v).replace('\\', '\\\\')
+        .replace('"', '\\"').replace('\n', '\\n'))
+        for n,v in zip(names, values)) + '}'
+
+
+class Counter():
+    '''A count which only goes up. Values are kept per combination of label
+    values. inc is guarded by a lock as counters may be updated from executor
+    threads.'''
+
+    kind = 'counter'
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        #unlabelled counters are shown from zero
+        self.values = {} if labels else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        values = self.values
+        with self._lock:
+            values[label_values] = values.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self.values.items())
+        for label_values, value in items:
+            yield '{}{} {}'.format(
+                    self.name, format_labels(self.labels, label_values), value)
+
+
+class Gauge():
+    '''A value which can go up and down. If a function is set, it is called
+    to read the value at collection time instead.
+
+    inc and dec are guarded by a lock as gauges may be updated from executor
+    threads.'''
+
+    kind = 'gauge'
+
+    def __init__(self, name, doc):
+        self.name = name
+        self.doc = doc
+        self.value = 0
+        self.func = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set_function(self, func):
+        self.func = func
+
+    def render(self):
+        value = self.value if self.func is None else self.func()
+        yield '{} {}'.format(self.name, value)
+
+
+class Histogram():
+    '''Counts observations into buckets. Only the bucket an observation
+    falls into is incremented; the cumulative counts are worked out when
+    rendering. observe is guarded by a lock as e.g. executor waits are
+    observed from executor threads.'''
+
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            h = self.values.get(label_values)
+            if h is None:
+                #[bucket counts with one extra for +Inf, sum of observations]
+                h = self.values[label_values] = [[0]*(len(self.buckets)+1), 0.0]
+            h[0][bucket] += 1
+            h[1] += value
+
+    def render(self):
+        names = self.labels + ('le',)
+        with self._lock:
+            items = [(label_values, (list(counts), total))
+                    for label_values, (counts, total) in sorted(self.values.items())]
+        for label_values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '{}_bucket{} {}'.format(self.name,
+                        format_labels(names, label_values + (bound,)), cumulative)
+            labels = format_labels(self.labels, label_values)
+            yield '{}_sum{} {}'.format(self.name, labels, total)
+            yield '{}_count{} {}'.format(self.name, labels, cumulative)
+
+
+class Metrics():
+    '''Counters kept by the server, rendered in the Prometheus text format.
+    Recording is a dictionary update so it can be left on.'''
+
+    content_type = 'text/plain; version=0.0.4'
+
+    def __init__(self):
+        self.calls = Counter('aio_rpc_calls_total',
+                'Calls made to each method', ('method',))
+        self.errors = Counter('aio_rpc_errors_total',
+                'Error responses by JSON-RPC error code', ('code',))
+        self.call_duration = Histogram('aio_rpc_call_duration_seconds',
+                'Time taken to complete a call to each method', ('method',))
+        self.executor_depth = Gauge('aio_rpc_executor_queue_depth',
+                'Calls waiting for an executor worker')
+        self.executor_wait = Histogram('aio_rpc_executor_wait_seconds',
+                'Time calls spent waiting for an executor worker')
+        self.lease_grants = Counter('aio_rpc_lease_grants_total',
+                'Leases granted')
+        self.lease_denials = Counter('aio_rpc_lease_denials_total',
+                'Requests for the lease refused because it was held')
+        self.lease_releases = Counter('aio_rpc_lease_releases_total',
+                'Leases ended by reason', ('reason',))
+        self.lease_hold = Histogram('aio_rpc_lease_hold_seconds',
+                'Time each lease was held',
+                buckets=(0.1, 1, 5, 10, 30, 60, 300, 900, 3600))
+        self.in_flight = Gauge('aio_rpc_in_flight_requests',
+                'Requests being processed')
+        self.received_bytes = Counter('aio_rpc_received_bytes_total',
+                'Size of messages received')
+        self.sent_bytes = Counter('aio_rpc_sent_bytes_total',
+                'Size of messages sent')
+        self.compression_raw_bytes = Counter(
+                'aio_rpc_compression_raw_bytes_total',
+                'Size of compressed messages before compression',
+                ('direction',))
+        self.compressed_bytes = Counter('aio_rpc_compressed_bytes_total',
+                'Size of compressed messages after compression',
+                ('direction',))
+        self.compression_duration = Histogram(
+                'aio_rpc_compression_duration_seconds',
+                'Time taken to compress or decompress a message',
+                ('operation',))
+
+        self.single_flight_calls = Counter('aio_rpc_single_flight_calls_total',
+                'Calls to single flight methods which ran or joined an '
+                'identical call in flight', ('method', 'outcome'))
+
+        self.observers = Gauge('aio_rpc_observers',
+                'Connected read only observer sessions')
+
+        self.inline_run = Histogram('aio_rpc_inline_run_seconds',
+                'Time fast methods ran inline, blocking the event loop',
+                ('method',), buckets=(0.000001, 0.000005, 0.00001, 0.00005,
+                    0.0001, 0.0005, 0.001, 0.005, 0.01))
+        self.inline_demotions = Counter('aio_rpc_inline_demotions_total',
+                'Times a method running inline overran and went back to the '
+                'executor', ('method',))
+        self.rejected = Counter('aio_rpc_rejected_total',
+                'Requests turned away by admission control by reason',
+                ('reason',))
+
+        self.watches = Gauge('aio_rpc_watches',
+                'Methods being watched for changes by clients')
+        self.watch_polls = Counter('aio_rpc_watch_polls_total',
+                'Calls made to check watched methods for changes', ('method',))
+        self.watch_notifications = Counter(
+                'aio_rpc_watch_notifications_total',
+                'Changed results of watched methods sent to watchers',
+                ('method',))
+
+        self.collectors = [self.calls, self.errors, self.call_duration,
+                self.executor_depth, self.executor_wait, self.lease_grants,
+                self.lease_denials, self.lease_releases, self.lease_hold,
+                self.in_flight, self.received_bytes, self.sent_bytes,
+                self.compression_raw_bytes, self.compressed_bytes,
+                self.compression_duration, self.single_flight_calls,
+                self.observers, self.inline_run, self.inline_demotions,
+                self.rejected, self.watches, self.watch_polls,
+                self.watch_notifications]
+
+    def add(self, collector):
+        '''register an additional Counter, Gauge or Histogram'''
+        self.collectors.append(collector)
+        return collector
+
+    def render(self):
+        lines = []
+        for c in self.collectors:
+            lines.append('# HELP {} {}'.format(c.name, c.doc))
+            lines.append('# TYPE {} {}'.format(c.name, c.kind))
+            lines.extend(c.render())
+        lines.append('')
+        return '\n'.join(lines)
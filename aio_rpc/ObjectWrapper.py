@@ -1,5 +1,6 @@
 import asyncio
 import time
+from time import perf_counter
 from inspect import getmembers, signature,ismethod
 from aiohttp import web
 from aiohttp_session import get_session, setup
@@ -7,7 +8,12 @@ from aiohttp_session.cookie_storage import EncryptedCookieStorage
 from concurrent.futures import ThreadPoolExecutor
 #from concurrent.futures import ProcessPoolExecutor
 import logging
+import json
 from functools import partial
+from .custom_json import to_json
+from .ReadWriteGate import ReadWriteGate
+from .Exceptions import InvalidParamsError, InternalError
+from .scripts import resolve
 
 #import signal
 # This restores the default Ctrl+C signal handler, which just kills the process
@@ -15,7 +21,7 @@ from functools import partial
 
 logger = logging.getLogger(__name__)
 
-def func_caller(func, loop, timeout):
+def func_caller(func, loop, timeout, metrics=None, executor=None, submit=None):
     '''Wrap function to be called with an executor call. This is to isolate
     blocking function calls which could potentially slow the event loop.
 
@@ -23,19 +29,187 @@ def func_caller(func, loop, timeout):
         func (method): The function to call from the executor
         loop (asyncio event loop): pass in the asyncio event loop
         timeout (int): A timeout after which an an execption will be raised
+        metrics (Metrics): records the time calls wait for the executor
+        executor (Executor): to run func on. The loop's default executor if
+        None.
+        submit (callable): submit(func, executor) runs func on the executor
+        and returns an asyncio future, in place of loop.run_in_executor
 
     Returns:
         method (ObjectWrapper method): a wrapped method which gets executed using
-        ObjectWrapper executor
+        ObjectWrapper executor. Its traced attribute takes a Trace as the first
+        argument to record the executor stages in.
     '''
 
+    executor_wait = None if metrics is None else metrics.executor_wait
+    if submit is None:
+        run_in_executor = partial(loop.run_in_executor, executor)
+    else:
+        run_in_executor = partial(submit, executor=executor)
+
+    def timed(timing, *args, **kwargs):
+        started = perf_counter()
+        if executor_wait is not None:
+            executor_wait.observe(started - timing[0])
+        timing.append(started)
+        result = func(*args, **kwargs)
+        timing.append(perf_counter())
+        return result
+
+    async def traced(trace, *args, **kwargs):
+        '''call func, recording the time spent waiting for the executor
+        and running on it in trace'''
+        timing = [perf_counter()]
+        p = partial(timed, timing, *args, **kwargs)
+        future = run_in_executor(p)
+        result = await asyncio.wait_for(future, timeout, loop=loop)
+        if trace is not None:
+            submitted, started, finished = timing
+            trace.mark('executor_wait', started)
+            trace.mark('run', finished)
+            trace.mark('return')
+        return result
+
     async def new_func(*args, **kwargs):
+        if executor_wait is not None:
+            return await traced(None, *args, **kwargs)
         p = partial(func,*args, **kwargs)
-        future = loop.run_in_executor(None, p)
+        future = run_in_executor(p)
         #logger.info("Calling function:{}".format(wrapped.__name__))
         return await asyncio.wait_for(future, timeout, loop=loop)
         #return await asyncio.wait(future, loop=loop)
         #return await future
+    new_func.traced = traced
+    return new_func
+
+
+def single_flight_caller(call, loop, name, metrics=None):
+    '''Wrap a method made by func_caller so that a call made while an
+    identical one (same arguments) is still queued or running waits for that
+    one's result rather than running again.
+
+    Args:
+        call (method): made by func_caller
+        loop (asyncio event loop): pass in the asyncio event loop
+        name (str): the method name, to label metrics with
+        metrics (Metrics): counts the calls which ran and which joined
+
+    Returns:
+        method: with the same traced attribute as call
+    '''
+    in_flight = {}
+    counter = None if metrics is None else metrics.single_flight_calls
+
+    def key_of(args, kwargs):
+        try:
+            return json.dumps([args, kwargs], sort_keys=True, default=to_json)
+        except TypeError:
+            #arguments which can't be compared run on their own
+            return None
+
+    def forget(key, future):
+        if in_flight.get(key) is future:
+            del in_flight[key]
+
+    def share(key, start):
+        future = in_flight.get(key) if key is not None else None
+        joined = future is not None
+        if not joined:
+            future = asyncio.ensure_future(start(), loop=loop)
+            if key is not None:
+                in_flight[key] = future
+                future.add_done_callback(partial(forget, key))
+        if counter is not None:
+            counter.inc(name, 'joined' if joined else 'ran')
+        #a caller giving up mustn't cancel the call for the others
+        return asyncio.shield(future, loop=loop), joined
+
+    async def traced(trace, *args, **kwargs):
+        shared, joined = share(key_of(args, kwargs),
+                partial(call.traced, trace, *args, **kwargs))
+        result = await shared
+        if joined and trace is not None:
+            trace.mark('joined')
+        return result
+
+    async def new_func(*args, **kwargs):
+        shared, joined = share(key_of(args, kwargs),
+                partial(call, *args, **kwargs))
+        return await shared
+    new_func.traced = traced
+    return new_func
+
+
+def adaptive_caller(func, loop, timeout, name, *, threshold, after, idle,
+        metrics=None, executor=None, submit=None):
+    '''Wrap function like func_caller, but once it has run faster than
+    threshold after times in a row, call it inline on the loop, which saves
+    the thread handoff, whenever the executor has nothing queued or running.
+    It goes back to the executor as soon as a run takes threshold or longer.
+
+    Args:
+        name (str): the method name, to label metrics with
+        threshold (float): seconds within which a run counts as fast
+        after (int): fast runs in a row needed before running inline
+        idle (callable): returns True when the method may run on the loop,
+        e.g. nothing is queued or running on the object's executors, so
+        running inline keeps calls in order and doesn't overlap them
+
+    Returns:
+        method: as from func_caller. Its stats attribute holds the count of
+        fast runs in a row and whether the method runs inline. The stats are
+        only updated on the loop.
+    '''
+    stats = {'fast': 0, 'inline': False}
+    inline_run = None if metrics is None else metrics.inline_run
+    demotions = None if metrics is None else metrics.inline_demotions
+
+    def record(elapsed):
+        if elapsed < threshold:
+            stats['fast'] += 1
+            if stats['fast'] >= after:
+                stats['inline'] = True
+        else:
+            if stats['inline'] and demotions is not None:
+                demotions.inc(name)
+            stats['fast'] = 0
+            stats['inline'] = False
+
+    def measured(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            #recorded before the caller resumes, as the result is also handed
+            #over with call_soon_threadsafe
+            loop.call_soon_threadsafe(record, perf_counter() - start)
+
+    offloaded = func_caller(measured, loop, timeout, metrics, executor, submit)
+
+    def run_inline(args, kwargs):
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = perf_counter() - start
+            record(elapsed)
+            if inline_run is not None:
+                inline_run.observe(elapsed, name)
+
+    async def traced(trace, *args, **kwargs):
+        if stats['inline'] and idle():
+            result = run_inline(args, kwargs)
+            if trace is not None:
+                trace.mark('run')
+            return result
+        return await offloaded.traced(trace, *args, **kwargs)
+
+    async def new_func(*args, **kwargs):
+        if stats['inline'] and idle():
+            return run_inline(args, kwargs)
+        return await offloaded(*args, **kwargs)
+    new_func.traced = traced
+    new_func.stats = stats
     return new_func
 
 
@@ -49,7 +223,11 @@ class ObjectWrapper():
     functions '''
 
     def __init__(self, *, obj, loop, whitelist=None, blacklist=None,
-            executor=ThreadPoolExecutor, timeout=5):
+            executor=ThreadPoolExecutor, timeout=5, metrics=None,
+            acquire_hook=None, release_hook=None, teardown_hook=None,
+            single_flight=(),
+            shared_methods=(), shared_workers=4, inline_threshold=None,
+            inline_after=20):
         '''Initialize what methods are exposed. Also intialize an executor to
         run the object's methods in. THis is because they could be blocking and
         calling these directly would drastically affect the reactivity of the
@@ -68,6 +246,28 @@ class ObjectWrapper():
             to return
             executor (ProcessPoolExecutor or ThreadPoolExecutor): The executor
             upon which to execute the objects functions.
+            metrics (Metrics): records executor queue depth and wait times
+            acquire_hook (str): name of a method of obj to call, on the
+            executor, each time a client is granted the lease. It isn't
+            exposed.
+            release_hook (str): name of a method of obj to call when a lease
+            ends. It isn't exposed.
+            teardown_hook (str): name of a method which Wrapper calls before
+            dropping an idle instance. It isn't exposed.
+            single_flight (iterable): methods for which a call made while an
+            identical one is in flight shares its result instead of running
+            again, e.g. status reads polled from several places
+            shared_methods (iterable): thread safe methods, e.g. reads of
+            cached state, which may run at the same time as each other on a
+            pool of their own. The other methods stay exclusive: they run one
+            at a time and never alongside a shared one.
+            shared_workers (int): the size of the pool for shared methods
+            inline_threshold (float): seconds. Exclusive methods which keep
+            finishing within this are called straight from the event loop
+            while the executor is idle. Every call goes through the executor
+            if None.
+            inline_after (int): the runs in a row within inline_threshold
+            before a method is called inline
 
         Whitelist and blacklist of mutually exclusive. Only use one of
         these!
@@ -82,31 +282,183 @@ class ObjectWrapper():
 
         self._obj = obj
         self._loop = loop
+        self._timeout = timeout
+        #jobs queued or running on the executors, only counted when methods
+        #may run inline
+        self._count_jobs = inline_threshold is not None
+        self._outstanding = 0
 
-        self.__add_executor(loop, executor=executor)
-
-        obj_methods = getmembers(obj, ismethod)
+        self._executor = self.__add_executor(loop, executor=executor)
+        if metrics is not None:
+            metrics.executor_depth.set_function(self._executor_depth)
+        if shared_methods:
+            self._shared_executor = executor(max_workers=shared_workers)
+            self._gate = ReadWriteGate()
+        else:
+            #a single worker needs no gate
+            self._shared_executor = None
+            self._gate = None
 
         self._funcs = {}
+        #the methods themselves, for scripts which run on the executor
+        self._raw_funcs = {}
         self._func_sigs = {}
+        self._func_docs = {}
+        self._acquire_hook = acquire_hook
+        self._release_hook = release_hook
+        hooks = (acquire_hook, release_hook, teardown_hook)
 
-        if whitelist is not None:
-            for func_name,func in obj_methods:
-                if func_name in whitelist:
-                    self._funcs[func_name] = func_caller(func, loop, timeout)
-                    self._func_sigs[func_name] = signature(func)
-        elif blacklist is not None:
-            for func_name,func in obj_methods:
-                if func_name in blacklist or func_name[0] == '_':
-                    continue
-                self._funcs[func_name] = func_caller(func, loop, timeout)
-                self._func_sigs[func_name] = signature(func)
-        else:
-            for func_name,func in obj_methods:
-                if func_name[0] == '_':
+        for func_name, func, sig, doc in self._exposed_methods(obj):
+            if func_name in hooks:
+                #hooks are only run by the server around a lease
+                continue
+            if whitelist is not None:
+                if func_name not in whitelist:
                     continue
-                self._funcs[func_name] = func_caller(func, loop, timeout)
-                self._func_sigs[func_name] = signature(func)
+            elif func_name[0] == '_' or (blacklist is not None and
+                    func_name in blacklist):
+                continue
+            self._raw_funcs[func_name] = func
+            func_executor = None
+            if func_name in shared_methods:
+                func = partial(self._gate.run_shared, func)
+                func_executor = self._shared_executor
+            elif self._gate is not None:
+                func = partial(self._gate.run_exclusive, func)
+            submit = self._submit if self._count_jobs else None
+            if inline_threshold is not None and func_name not in shared_methods:
+                caller = adaptive_caller(func, loop, timeout, func_name,
+                        threshold=inline_threshold, after=inline_after,
+                        idle=self._can_run_inline, metrics=metrics,
+                        executor=func_executor, submit=submit)
+            else:
+                caller = func_caller(func, loop, timeout, metrics,
+                        func_executor, submit)
+            if func_name in single_flight:
+                caller = single_flight_caller(caller, loop, func_name, metrics)
+            self._funcs[func_name] = caller
+            self._func_sigs[func_name] = sig
+            self._func_docs[func_name] = doc
+
+    def _exposed_methods(self, obj):
+        '''Returns:
+            iterable: (name, callable, signature, docstring) of each method
+            which may be exposed'''
+        for func_name, func in getmembers(obj, ismethod):
+            yield func_name, func, signature(func), func.__doc__
+
+    async def run_script(self, calls):
+        '''Make calls one after another in a single executor job rather
+        than one job each. A call's arguments may refer to the results of the
+        calls before it, see scripts.ref. Stops at the first call which
+        fails.
+
+        Args:
+            calls (list): of (method name, args, kwargs)
+
+        Returns:
+            tuple: (results, failure). failure is None if every call was made,
+            otherwise (index, JsonRPCError) of the call which failed and
+            results only holds those made before it.'''
+        job = partial(self._run_script, calls)
+        if self._gate is not None:
+            job = partial(self._gate.run_exclusive, job)
+        future = self._submit(job)
+        timeout = self._timeout
+        if timeout is not None:
+            timeout *= max(len(calls), 1)
+        return await asyncio.wait_for(future, timeout, loop=self._loop)
+
+    def _run_script(self, calls):
+        results = []
+        for index, (func_name, args, kwargs) in enumerate(calls):
+            try:
+                args = resolve(args, results)
+                kwargs = resolve(kwargs, results)
+                self._func_sigs[func_name].bind(*args, **kwargs)
+            except (LookupError, TypeError) as e:
+                return results, (index, InvalidParamsError(e.__str__()))
+            try:
+                results.append(self._raw_funcs[func_name](*args, **kwargs))
+            except Exception as e:
+                return results, (index, InternalError(e.__str__()))
+        return results, None
+
+    def lease_granted(self):
+        '''Queue the acquire hook on the executor. As the executor has a
+        single worker, it runs before any call made under the new lease.
+        Shared calls made after it wait for it at the gate.
+
+        Returns:
+            asyncio.Future: done once the hook has run'''
+        return self._run_on_executor(self._on_lease_granted)
+
+    def lease_ended(self):
+        '''Queue the release hook on the executor, behind any calls still
+        pending from the ended lease.
+
+        Returns:
+            asyncio.Future: done once the hook has run'''
+        return self._run_on_executor(self._on_lease_ended)
+
+    def _on_lease_granted(self):
+        self._run_hook(self._obj, self._acquire_hook)
+
+    def _on_lease_ended(self):
+        self._run_hook(self._obj, self._release_hook)
+
+    @staticmethod
+    def _run_hook(obj, hook):
+        if obj is not None and hook is not None:
+            getattr(obj, hook)()
+
+    def _run_on_executor(self, func):
+        if self._gate is not None:
+            #shared calls don't queue on the single worker, so hold them
+            #off from now rather than from when the job starts
+            func = partial(self._gate.reserve(), func)
+        future = self._submit(func)
+        future.add_done_callback(self._log_hook_error)
+        if self._gate is not None:
+            #the job must run to give up its place at the gate, which
+            #cancelling it before it started would prevent
+            return asyncio.shield(future, loop=self._loop)
+        return future
+
+    def _submit(self, func, executor=None):
+        '''run func on executor, the single worker if None
+
+        Returns:
+            asyncio.Future: for the result'''
+        if executor is None:
+            executor = self._executor
+        if not self._count_jobs:
+            return self._loop.run_in_executor(executor, func)
+        #a job counts until it has finished, or was cancelled before it
+        #started, even if whoever awaited it has given up
+        self._outstanding += 1
+        job = executor.submit(func)
+        job.add_done_callback(self._job_done)
+        return asyncio.wrap_future(job, loop=self._loop)
+
+    def _job_done(self, job):
+        self._loop.call_soon_threadsafe(self._job_finished)
+
+    def _job_finished(self):
+        self._outstanding -= 1
+
+    def _executor_idle(self):
+        return self._outstanding == 0
+
+    def _can_run_inline(self):
+        '''whether a fast method may run on the loop rather than the
+        executor'''
+        return self._executor_idle()
+
+    @staticmethod
+    def _log_hook_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("lease hook failed: {!r}".format(future.exception()))
 
     def __add_executor(self, loop, executor=ThreadPoolExecutor):
         '''Create an Executor. Default is to create a ProcessPoolExecutor.
@@ -119,6 +471,14 @@ class ObjectWrapper():
 
         ex = executor(max_workers=1)
         loop.set_default_executor(ex)
+        return ex
+
+    def _executor_depth(self):
+        '''the number of calls waiting for the executor'''
+        ex = self._executor
+        if hasattr(ex, '_work_queue'):
+            return ex._work_queue.qsize()
+        return len(getattr(ex, '_pending_work_items', ()))
 
     def __getattr__(self, item):
         #return self._funcs[item] #implicitly raise an KeyError if not found
@@ -0,0 +1,43 @@
+import time
+from .TokenBucket import TokenBucket
+
+class RateLimiter():
+    '''A TokenBucket for each key, e.g. each user or address. Buckets which
+    have filled up again are dropped once there are more than max_keys, as a
+    new bucket would start out the same.'''
+
+    def __init__(self, rate, burst, *, max_keys=10000, clock=time.monotonic):
+        '''
+        Args:
+            rate (float): requests per second allowed for each key
+            burst (int): requests allowed at once for each key
+            max_keys (int): the number of buckets above which full ones are
+            dropped
+            clock (callable): returns the time in seconds
+        '''
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets = {}
+
+    def bucket(self, key):
+        '''the bucket for key, shared by everything using the same key'''
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self.prune()
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst,
+                    clock=self._clock)
+        return bucket
+
+    def allow(self, key):
+        '''Returns:
+            bool: whether a request for key may go ahead'''
+        return self.bucket(key).try_take()
+
+    def prune(self):
+        for key, bucket in list(self._buckets.items()):
+            bucket.refill()
+            if bucket.tokens >= bucket.burst:
+                del self._buckets[key]
@@ -0,0 +1,57 @@
+import threading
+
+class ReadWriteGate():
+    '''Lets any number of shared calls run at once, or a single exclusive call
+    on its own. New shared calls wait while an exclusive call is waiting so a
+    steady stream of reads can't hold off writes.
+
+    Calls are made on executor threads so the gate blocks rather than
+    awaits.'''
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def run_shared(self, func, *args, **kwargs):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def run_exclusive(self, func, *args, **kwargs):
+        return self.reserve()(func, *args, **kwargs)
+
+    def reserve(self):
+        '''count an exclusive call as waiting from now, e.g. before it is
+        queued on its executor, so shared calls made after it wait for it.
+
+        Returns:
+            callable: runs the exclusive call as run_exclusive does. It must
+            be called once, or shared calls wait forever.'''
+        with self._cond:
+            self._writers_waiting += 1
+        return self._run_reserved
+
+    def _run_reserved(self, func, *args, **kwargs):
+        with self._cond:
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
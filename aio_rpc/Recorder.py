@@ -0,0 +1,72 @@
+import json
+import time
+import uuid
+
+class Recorder():
+    '''Appends the requests coming in over each websocket session to a file so
+    the traffic can be replayed with benchmarks/replay.py. Each line is a JSON
+    object:
+
+        {"s": session, "t": seconds since the session began, "m": request}
+
+    where request is the JSON-RPC message as received.'''
+
+    def __init__(self, path, *, clock=time.monotonic):
+        '''
+        Args:
+            path (str): the file to append to. It is created if need be.
+            clock (callable): returns the time in seconds
+        '''
+        self.path = path
+        self._clock = clock
+        self._file = open(path, 'a', encoding='utf-8')
+        #sessions stay distinct when several runs append to the same file
+        self._run = uuid.uuid4().hex[:12]
+        self._sessions = 0
+        self.recorded = 0
+
+    def session(self):
+        '''start recording a session
+
+        Returns:
+            callable: takes each incoming message of the session'''
+        self._sessions += 1
+        session = '{}.{}'.format(self._run, self._sessions)
+        start = self._clock()
+
+        def record(message):
+            self._file.write(json.dumps({
+                'm' : message,
+                's' : session,
+                't' : round(self._clock() - start, 6)},
+                separators=(',', ':')))
+            self._file.write('\n')
+            self.recorded += 1
+        return record
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def load(path):
+    '''read a capture back
+
+    Returns:
+        list: of (session, [(t, message), ...]) in the order the sessions
+        began'''
+    sessions = {}
+    order = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if entry['s'] not in sessions:
+                sessions[entry['s']] = []
+                order.append(entry['s'])
+            sessions[entry['s']].append((entry['t'], entry['m']))
+    return [(s, sessions[s]) for s in order]
@@ -0,0 +1,111 @@
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    #python < 3.8
+    shared_memory = None
+
+#__class__ of the json object standing in for a buffer in shared memory
+SHM_CLASS = 'shm'
+
+
+def available():
+    return shared_memory is not None
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        #before python 3.13 attaching registers the segment with the resource
+        #tracker, which would unlink it when this process exits even though
+        #the server owns it
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except (ImportError, AttributeError):
+            pass
+        return shm
+
+
+class SharedBuffer():
+    '''A buffer received through shared memory. buf is a memoryview straight
+    onto the segment, valid until close is called. Hand it back to the server
+    with ClientObj._release once done with it.'''
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self._shm = _attach(name)
+        self.buf = self._shm.buf[:size]
+
+    def __len__(self):
+        return self.size
+
+    def tobytes(self):
+        return self.buf.tobytes()
+
+    def close(self):
+        '''unmap the segment. Any views taken of buf must be released first.'''
+        if self._shm is not None:
+            self.buf.release()
+            self._shm.close()
+            self._shm = None
+
+
+class SharedBuffers():
+    '''Places large buffers in a result into shared memory segments so that
+    only a handle goes over the websocket. Segments are kept until the client
+    releases them or its lease ends.'''
+
+    def __init__(self, *, threshold=1<<20):
+        '''
+        Args:
+            threshold (int): buffers smaller than this many bytes are sent in
+            the message as usual
+        '''
+        if shared_memory is None:
+            raise RuntimeError('shared memory needs python 3.8 or later')
+        self.threshold = threshold
+        self.segments = {}
+
+    def export(self, result):
+        '''Returns:
+            result with each large bytes, bytearray or memoryview, also inside
+            lists, tuples and dict values, replaced by a handle'''
+        if isinstance(result, (bytes, bytearray, memoryview)):
+            data = memoryview(result).cast('B')
+            if data.nbytes >= self.threshold:
+                return self._export_buffer(data)
+            return result
+        if isinstance(result, (list, tuple)):
+            return [self.export(r) for r in result]
+        if isinstance(result, dict):
+            return {k: self.export(v) for k,v in result.items()}
+        return result
+
+    def _export_buffer(self, data):
+        shm = shared_memory.SharedMemory(create=True, size=data.nbytes)
+        shm.buf[:data.nbytes] = data
+        self.segments[shm.name] = shm
+        return {
+                '__class__' : SHM_CLASS,
+                'name'      : shm.name,
+                'size'      : data.nbytes}
+
+    def release(self, names):
+        '''free the segments the client is done with
+
+        Returns:
+            int: the number of segments freed'''
+        released = 0
+        for name in names:
+            shm = self.segments.pop(name, None)
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+                released += 1
+        return released
+
+    def release_all(self):
+        return self.release(list(self.segments))
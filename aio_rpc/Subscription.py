@@ -0,0 +1,73 @@
+from asyncio import Future, shield
+from .watching import UNWATCH_METHOD
+
+
+class Subscription():
+    '''The result of a method watched on the server, see ClientObj._watch.
+    It is updated by the notifications the server sends when the result
+    changes.'''
+
+    def __init__(self, client_obj, id, method, params=None, interval=1,
+            callback=None):
+        '''
+        Args:
+            client_obj (ClientObj): made the watch
+            id: the subscription id the server sends with each notification
+            params (list or dict): the arguments method is called with
+            interval (float): seconds between calls on the server
+            callback (callable): called with the subscription after each
+            change
+        '''
+        self._client_obj = client_obj
+        self.id = id
+        self.method = method
+        self.params = params
+        self.interval = interval
+        self.callback = callback
+        #the latest result, None until one arrives
+        self.value = None
+        #the exception if the latest call failed
+        self.error = None
+        self.closed = False
+        #whether the server took the watch, over this or the last connection
+        self.watching = False
+        self._waiter = None
+
+    def _update(self, value=None, error=None):
+        '''take in a changed result or error sent by the server'''
+        self.value = value
+        self.error = error
+        waiter = self._waiter
+        self._waiter = None
+        if waiter is not None and not waiter.done():
+            if error is not None:
+                waiter.set_exception(error)
+            else:
+                waiter.set_result(value)
+        if self.callback is not None:
+            self.callback(self)
+
+    async def changed(self):
+        '''wait for the next change
+
+        Returns:
+            the new result
+
+        Raises:
+            JsonRPCError: if calling the method failed'''
+        if self._waiter is None:
+            self._waiter = Future(loop=self._client_obj._event_loop)
+        #several coroutines may wait for the same change
+        return await shield(self._waiter)
+
+    async def close(self):
+        '''stop watching'''
+        if self.closed:
+            return
+        self.closed = True
+        client_obj = self._client_obj
+        client_obj._json_client.subscriptions.pop(self.id, None)
+        if self._waiter is not None:
+            self._waiter.cancel()
+        await client_obj._call(UNWATCH_METHOD, (self.id,), {},
+                client_obj._timeout)
@@ -0,0 +1,50 @@
+import time
+
+class TokenBucket():
+    '''Rate limit of burst calls at once refilling at rate calls per second.
+    Tokens are topped up when one is taken, so an idle bucket costs
+    nothing.'''
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', '_clock')
+
+    def __init__(self, rate, burst, *, clock=time.monotonic):
+        '''
+        Args:
+            rate (float): tokens added per second
+            burst (int): the most tokens held
+            clock (callable): returns the time in seconds
+        '''
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._clock = clock
+        self.updated = clock()
+
+    def refill(self):
+        now = self._clock()
+        self.tokens = min(self.burst,
+                self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        '''take a token only if one is available
+
+        Returns:
+            bool: whether a token was taken'''
+        self.refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def take(self):
+        '''take a token, borrowing from the future if there are none left
+
+        Returns:
+            float: the seconds to wait before acting on the token, 0 if one
+            was available'''
+        self.refill()
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
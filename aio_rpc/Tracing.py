@@ -0,0 +1,66 @@
+from collections import deque
+from itertools import islice
+from time import perf_counter
+
+
+class Trace():
+    '''Timestamps taken as a single request passes through the server. Each
+    stage lasts from the end of the previous stage to its own mark.'''
+
+    __slots__ = ('id', 'method', 'start', 'marks')
+
+    def __init__(self, trace_id, start=None):
+        self.id = trace_id
+        self.method = None
+        self.start = perf_counter() if start is None else start
+        self.marks = []
+
+    def mark(self, stage, now=None):
+        '''record the end of a stage
+
+        Args:
+            stage (str): the name of the stage which just finished
+            now (float): perf_counter value at which it finished, defaults to
+            now. Used for stages timed in another thread.
+        '''
+        self.marks.append((stage, perf_counter() if now is None else now))
+
+    def to_dict(self):
+        stages = {}
+        last = self.start
+        for stage, t in self.marks:
+            stages[stage] = t - last
+            last = t
+        return {
+                'id'     : self.id,
+                'method' : self.method,
+                'stages' : stages,
+                'total'  : last - self.start}
+
+
+class Tracer():
+    '''Keeps the most recent finished traces in a ring buffer'''
+
+    def __init__(self, size=1000):
+        '''
+        Args:
+            size (int): the number of traces to keep
+        '''
+        self.traces = deque(maxlen=size)
+
+    def finish(self, trace):
+        self.traces.append(trace)
+
+    def find(self, trace_id):
+        '''Returns:
+            dict: the breakdown of the trace with the given id or None'''
+        for trace in reversed(self.traces):
+            if trace.id == trace_id:
+                return trace.to_dict()
+        return None
+
+    def recent(self, limit=None):
+        '''Returns:
+            list: breakdowns of up to limit traces, newest first'''
+        traces = islice(reversed(self.traces), limit)
+        return [t.to_dict() for t in traces]
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+from functools import partial
+from .custom_json import to_json
+from .Exceptions import (
+        JsonRPCError,
+        InternalError,
+        ServerOverloadedError)
+from .watching import CHANGED_METHOD
+
+logger = logging.getLogger(__name__)
+
+_dumps = partial(json.dumps, default=to_json)
+
+
+class Subscriber():
+    '''Where the notifications for the watches of one connection go'''
+    __slots__ = ('push', 'subscriptions')
+
+    def __init__(self, push):
+        '''
+        Args:
+            push (callable): push(message) sends the json of a notification
+            to the connection
+        '''
+        self.push = push
+        #subscription id: Poll
+        self.subscriptions = {}
+
+
+class Poll():
+    '''A method called repeatedly with the same arguments on behalf of
+    everyone watching it'''
+    __slots__ = ('key', 'method', 'args', 'kwargs', 'watchers', 'interval',
+            'last', 'task', 'wake')
+
+    def __init__(self, key, method, args, kwargs):
+        self.key = key
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        #(Subscriber, subscription id): interval asked for
+        self.watchers = {}
+        self.interval = None
+        #the last result sent as its params entry, '"result": ...' or
+        #'"error": ...'
+        self.last = None
+        self.task = None
+        #set to call again sooner if the interval became shorter
+        self.wake = None
+
+
+class Watches():
+    '''Polls the methods which clients watch on the object's executor, and
+    pushes a notification to the watchers only when the result changed. All
+    watchers of the same method and arguments share one poll, run at the
+    shortest interval any of them asked for. Each changed result is encoded
+    once for all of them.'''
+
+    def __init__(self, *, obj, loop, metrics=None, max_watches=100):
+        '''
+        Args:
+            obj (ObjectWrapper): the object whose methods are watched
+            loop (asyncio event loop): runs the polls
+            metrics (Metrics): counts watches, polls and notifications
+            max_watches (int): the most watches a connection may have
+        '''
+        self.obj = obj
+        self.loop = loop
+        self.metrics = metrics
+        self.max_watches = max_watches
+        #json of [method, args, kwargs]: Poll
+        self._polls = {}
+
+    def watch(self, subscriber, subscription, method, args, kwargs, interval):
+        '''start sending subscriber the result of method whenever it changes,
+        checking every interval seconds. The current result is sent first.
+
+        Args:
+            subscription: the id, chosen by the client, sent with each
+            notification. A watch the subscriber already has with the id is
+            replaced, so a repeated watch does no harm.
+            interval (float): the time between calls in seconds
+
+        Raises:
+            ServerOverloadedError: if the subscriber has max_watches'''
+        self.unwatch(subscriber, subscription)
+        if len(subscriber.subscriptions) >= self.max_watches:
+            if self.metrics is not None:
+                self.metrics.rejected.inc('watches')
+            raise ServerOverloadedError('too many watches')
+        key = _dumps([method, args, kwargs], sort_keys=True)
+        poll = self._polls.get(key)
+        if poll is None:
+            poll = self._polls[key] = Poll(key, method, args, kwargs)
+        poll.watchers[subscriber, subscription] = interval
+        if poll.interval is None or interval < poll.interval:
+            poll.interval = interval
+            if poll.wake is not None and not poll.wake.done():
+                poll.wake.set_result(None)
+        subscriber.subscriptions[subscription] = poll
+        if self.metrics is not None:
+            self.metrics.watches.inc()
+        if poll.task is None:
+            poll.task = asyncio.ensure_future(self._run(poll), loop=self.loop)
+        elif poll.last is not None:
+            #catch up with the others rather than wait for the next change,
+            #after the response to the watch
+            self.loop.call_soon(self._send, poll, subscriber, subscription)
+
+    def unwatch(self, subscriber, subscription):
+        '''Returns:
+            bool: whether the subscriber was watching with that id'''
+        poll = subscriber.subscriptions.pop(subscription, None)
+        if poll is None:
+            return False
+        del poll.watchers[subscriber, subscription]
+        if self.metrics is not None:
+            self.metrics.watches.dec()
+        if poll.watchers:
+            poll.interval = min(poll.watchers.values())
+        else:
+            del self._polls[poll.key]
+            poll.task.cancel()
+        return True
+
+    def drop(self, subscriber):
+        '''end every watch of a subscriber, e.g. once its connection closed'''
+        for subscription in list(subscriber.subscriptions):
+            self.unwatch(subscriber, subscription)
+
+    def __len__(self):
+        '''the number of polls running'''
+        return len(self._polls)
+
+    async def _run(self, poll):
+        call = getattr(self.obj, poll.method)
+        metrics = self.metrics
+        while True:
+            try:
+                result = await call(*poll.args, **poll.kwargs)
+                encoded = '"result": ' + _dumps(result)
+            except asyncio.CancelledError:
+                raise
+            except JsonRPCError as e:
+                encoded = '"error": ' + _dumps(e.to_json_rpc_dict())
+            except Exception as e:
+                encoded = '"error": ' + _dumps(
+                        InternalError(e.__str__()).to_json_rpc_dict())
+            if metrics is not None:
+                metrics.watch_polls.inc(poll.method)
+            if encoded != poll.last:
+                poll.last = encoded
+                for subscriber, subscription in list(poll.watchers):
+                    self._send(poll, subscriber, subscription)
+            await self._sleep(poll)
+
+    async def _sleep(self, poll):
+        '''wait until interval after the last call, also if the interval
+        changes meanwhile'''
+        loop = self.loop
+        called = loop.time()
+        while True:
+            remaining = called + poll.interval - loop.time()
+            if remaining <= 0:
+                return
+            poll.wake = loop.create_future()
+            await asyncio.wait([poll.wake], timeout=remaining, loop=loop)
+
+    def _send(self, poll, subscriber, subscription):
+        if (subscriber, subscription) not in poll.watchers:
+            return
+        subscriber.push('{{"jsonrpc": "2.0", "method": "{}", "params": '
+                '{{"subscription": {}, {}}}}}'.format(CHANGED_METHOD,
+                    _dumps(subscription), poll.last))
+        if self.metrics is not None:
+            self.metrics.watch_notifications.inc(poll.method)
@@ -1,3 +1,6 @@
+from inspect import getmembers, getattr_static, isfunction, ismethod, signature
+from functools import partial
+import threading
 from .ObjectWrapper import ObjectWrapper
 
 class Wrapper(ObjectWrapper):
@@ -10,13 +13,97 @@ class Wrapper(ObjectWrapper):
         class which will then be served.
 
         cls_args (dict): keyword arguments for the callable
+        lazy (bool): only instantiate cls when a client is first granted the
+        lease, or when a method is first called. cls must be a class, as the
+        exposed methods are read from it.
+        idle_timeout (float): seconds after a lease ends without a new one
+        being granted after which the instance is dropped. It is made again
+        on demand. Implies lazy.
+        teardown_hook (str): name of a method to call on the instance before
+        it is dropped
         kwargs (dict): cls keyword argumnets
     '''
 
-    def __init__(self, cls, *, cls_args=None, **kwargs):
+    def __init__(self, cls, *, cls_args=None, lazy=False, idle_timeout=None,
+            teardown_hook=None, **kwargs):
         if cls_args==None:
             cls_args = {}
 
-        cls_obj = cls(**cls_args)
-        super().__init__(obj=cls_obj, **kwargs)
+        self._cls = cls
+        self._cls_args = cls_args
+        self._lazy = lazy or idle_timeout is not None
+        self._idle_timeout = idle_timeout
+        self._idle_handle = None
+        self._teardown_hook = teardown_hook
+        #shared methods may need the instance from several threads at once
+        self._instance_lock = threading.Lock()
+        if self._lazy:
+            #the instance is only ever made and dropped on the executor
+            super().__init__(obj=None, teardown_hook=teardown_hook, **kwargs)
+        else:
+            cls_obj = cls(**cls_args)
+            super().__init__(obj=cls_obj, teardown_hook=teardown_hook,
+                    **kwargs)
 
+    def _exposed_methods(self, obj):
+        if not self._lazy:
+            yield from super()._exposed_methods(obj)
+            return
+        cls = self._cls
+        for func_name, func in getmembers(cls, lambda m: isfunction(m) or ismethod(m)):
+            if isinstance(getattr_static(cls, func_name), staticmethod):
+                #they aren't methods of an instance, so aren't exposed eagerly
+                continue
+            sig = signature(func)
+            if isfunction(func):
+                #drop self as the method is bound once there is an instance
+                sig = sig.replace(parameters=list(sig.parameters.values())[1:])
+            yield (func_name, partial(self._call_method, func_name), sig,
+                    func.__doc__)
+
+    def _instance(self):
+        obj = self._obj
+        if obj is None:
+            with self._instance_lock:
+                obj = self._obj
+                if obj is None:
+                    obj = self._obj = self._cls(**self._cls_args)
+        return obj
+
+    def _call_method(self, func_name, *args, **kwargs):
+        return getattr(self._instance(), func_name)(*args, **kwargs)
+
+    def lease_granted(self):
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        return super().lease_granted()
+
+    def lease_ended(self):
+        future = super().lease_ended()
+        if self._idle_timeout is not None:
+            if self._idle_handle is not None:
+                self._idle_handle.cancel()
+            self._idle_handle = self._loop.call_later(self._idle_timeout,
+                    self._idle)
+        return future
+
+    def _can_run_inline(self):
+        #the instance is only made on the executor, and is gone once torn down
+        return self._obj is not None and super()._can_run_inline()
+
+    def _on_lease_granted(self):
+        if self._lazy:
+            self._instance()
+        super()._on_lease_granted()
+
+    def _idle(self):
+        self._idle_handle = None
+        self._run_on_executor(self._teardown)
+
+    def _teardown(self):
+        obj = self._obj
+        if obj is None:
+            return
+        self._obj = None
+        self._run_hook(obj, self._teardown_hook)
@@ -0,0 +1,23 @@
+'''Values shared between AioRPCServ and AioRPCClient'''
+
+#header used by a client to reclaim its lease after a dropped connection
+RESUME_TOKEN_HEADER = 'X-Resume-Token'
+
+#websocket close code sent when the connecting session does not hold the lease
+CLOSE_NOT_GRANTED = 4001
+
+#websocket close code sent for a message longer than the server accepts
+CLOSE_TOO_BIG = 1009
+
+#websocket close code sent when a response failed part way through being sent
+CLOSE_INTERNAL_ERROR = 1011
+
+#websocket subprotocol agreeing that large messages are sent deflated in binary
+#frames
+DEFLATE_PROTOCOL = 'aio-rpc.deflate'
+
+#header sent by a client which accepts results in shared memory
+SHARED_MEMORY_HEADER = 'X-Shared-Memory'
+
+#header asking to connect as a read only observer rather than take the lease
+OBSERVER_HEADER = 'X-Observer'
@@ -1,10 +1,69 @@
+from base64 import b64encode, b64decode
+try:
+    import numpy
+except ImportError:
+    #arrays just aren't supported. Nothing else depends on numpy.
+    numpy = None
+
 def from_json(json_object):
     if '__class__' in json_object:
         if json_object['__class__'] == 'bytes':
-            return bytes(json_object['__value__'])
+            value = json_object.get('__value__')
+            if type(value) != list:
+                raise ValueError('malformed bytes')
+            #ValueError for values out of range, TypeError for non integers
+            try:
+                return bytes(value)
+            except TypeError as e:
+                raise ValueError('malformed bytes: {}'.format(e))
+        if json_object['__class__'] == 'ndarray':
+            return ndarray_from_json(json_object)
     return json_object
+def from_json_shared(json_object):
+    '''from_json for clients which accept buffers in shared memory'''
+    if json_object.get('__class__') == 'shm':
+        from .SharedBuffers import SharedBuffer
+        name = json_object.get('name')
+        size = json_object.get('size')
+        if type(name) != str or type(size) != int:
+            raise ValueError('malformed shared buffer')
+        return SharedBuffer(name, size)
+    return from_json(json_object)
+def ndarray_from_json(json_object):
+    '''rebuild an array from its dtype, shape and base64 encoded bytes. The
+    array is a read-only view onto the decoded bytes rather than a copy.
+
+    Raises:
+        ValueError: if the fields are missing or malformed'''
+    if numpy is None:
+        raise ValueError('numpy is needed to decode an ndarray')
+    value = json_object.get('__value__')
+    dtype = json_object.get('dtype')
+    shape = json_object.get('shape')
+    if type(value) != str or type(dtype) != str or type(shape) != list or \
+            not all(type(n) == int for n in shape):
+        raise ValueError('malformed ndarray')
+    #b64decode and numpy raise ValueError for the contents, except
+    #numpy.dtype which raises TypeError for an unknown dtype
+    try:
+        dtype = numpy.dtype(dtype)
+    except TypeError as e:
+        raise ValueError('malformed ndarray: {}'.format(e))
+    return numpy.frombuffer(b64decode(value), dtype=dtype).reshape(shape)
 def to_json(python_object):
     if isinstance(python_object, (bytearray, bytes)):
         return {'__class__': 'bytes',
                 '__value__': list(python_object)}
+    if numpy is not None:
+        if isinstance(python_object, numpy.ndarray) and \
+                python_object.dtype.fields is None and \
+                not python_object.dtype.hasobject:
+            #dtype.str includes the byte order
+            return {'__class__': 'ndarray',
+                    'dtype': python_object.dtype.str,
+                    'shape': python_object.shape,
+                    '__value__': b64encode(
+                        numpy.ascontiguousarray(python_object)).decode('ascii')}
+        if isinstance(python_object, numpy.generic):
+            return python_object.item()
     raise TypeError(repr(python_object) + ' is not JSON serializable')
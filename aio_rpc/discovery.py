@@ -0,0 +1,153 @@
+'''Describing the methods of a served object so that clients can check calls
+locally and generate stub modules. The description is what the built-in
+rpc.discover method returns.'''
+import json
+from inspect import Parameter, Signature
+from keyword import iskeyword
+
+from .custom_json import to_json
+
+DISCOVER_METHOD = 'rpc.discover'
+RELEASE_METHOD = 'rpc.release'
+
+
+def _annotation_name(annotation):
+    return getattr(annotation, '__name__', str(annotation))
+
+
+def describe_parameter(param):
+    desc = {
+            'name' : param.name,
+            'kind' : param.kind.name}
+    if param.default is not Parameter.empty:
+        try:
+            json.dumps(param.default, default=to_json)
+            desc['default'] = param.default
+        except TypeError:
+            desc['default_repr'] = repr(param.default)
+    if param.annotation is not Parameter.empty:
+        desc['annotation'] = _annotation_name(param.annotation)
+    return desc
+
+
+def describe(obj_wrapper, names=None):
+    '''describe the methods exposed by an ObjectWrapper
+
+    Args:
+        names (iterable): only describe these methods if given
+
+    Returns:
+        dict: {'methods': {name: {'params': [...], 'doc': str, 'returns': str}}}
+    '''
+    methods = {}
+    for name, sig in sorted(obj_wrapper._func_sigs.items()):
+        if names is not None and name not in names:
+            continue
+        desc = {
+                'params' : [describe_parameter(p) for p in sig.parameters.values()],
+                'doc'    : obj_wrapper._func_docs[name]}
+        if sig.return_annotation is not Signature.empty:
+            desc['returns'] = _annotation_name(sig.return_annotation)
+        methods[name] = desc
+    return {'methods': methods}
+
+
+def signature_from_description(method_desc):
+    '''rebuild an inspect.Signature which binds the same arguments as the
+    served method. Defaults which couldn't be sent are stood in for by their
+    repr and annotations are left as names.'''
+    params = []
+    for p in method_desc['params']:
+        if 'default' in p:
+            default = p['default']
+        elif 'default_repr' in p:
+            default = p['default_repr']
+        else:
+            default = Parameter.empty
+        params.append(Parameter(p['name'], getattr(Parameter, p['kind']),
+            default=default, annotation=p.get('annotation', Parameter.empty)))
+    return Signature(params)
+
+
+def _format_param(p):
+    text = p['name']
+    if p['kind'] == 'VAR_POSITIONAL':
+        text = '*' + text
+    elif p['kind'] == 'VAR_KEYWORD':
+        text = '**' + text
+    #annotations are quoted as the types may not exist on the client
+    if 'annotation' in p:
+        text += ':{!r}'.format(p['annotation'])
+    if 'default' in p:
+        text += '={!r}'.format(p['default'])
+    return text
+
+
+def _format_signature(params):
+    parts = ['self']
+    keyword_only = False
+    for p in params:
+        if p['kind'] == 'KEYWORD_ONLY' and not keyword_only:
+            parts.append('*')
+            keyword_only = True
+        elif p['kind'] == 'VAR_POSITIONAL':
+            keyword_only = True
+        parts.append(_format_param(p))
+    return ', '.join(parts)
+
+
+def _format_call(name, params):
+    '''JSON-RPC params are either positional or named, so pass everything by
+    name if the method takes keyword only arguments'''
+    by_name = any(p['kind'] in ('KEYWORD_ONLY', 'VAR_KEYWORD') for p in params)
+    args = []
+    for p in params:
+        if p['kind'] == 'VAR_POSITIONAL':
+            args.append('*' + p['name'])
+        elif p['kind'] == 'VAR_KEYWORD':
+            args.append('**' + p['name'])
+        elif by_name:
+            args.append('{0}={0}'.format(p['name']))
+        else:
+            args.append(p['name'])
+    return 'self._client_obj.{}({})'.format(name, ', '.join(args))
+
+
+def generate_stub(description, class_name='RemoteObject'):
+    '''generate the source of a module with a class whose async methods mirror
+    the served object's, with their signatures and docstrings. Wrap a
+    ClientObj with it:
+
+    >>> stub = RemoteObject(client.client_obj)
+    >>> await stub.add(1, 2)
+
+    Returns:
+        str: python source'''
+    lines = [
+            "'''Stub generated from {} by aio_rpc.discovery'''".format(DISCOVER_METHOD),
+            '',
+            '',
+            'class {}():'.format(class_name),
+            '',
+            '    def __init__(self, client_obj):',
+            '        self._client_obj = client_obj']
+    for name, desc in sorted(description['methods'].items()):
+        if not name.isidentifier() or iskeyword(name):
+            continue
+        params = desc['params']
+        if any('default_repr' in p for p in params):
+            #defaults which can't be written out are left to the server, so
+            #arguments are passed through as given
+            params = [
+                    {'name': 'args', 'kind': 'VAR_POSITIONAL'},
+                    {'name': 'kwargs', 'kind': 'VAR_KEYWORD'}]
+        returns = ' -> {!r}'.format(desc['returns']) if 'returns' in desc else ''
+        lines += [
+                '',
+                '    async def {}({}){}:'.format(name, _format_signature(params),
+                    returns)]
+        if desc.get('doc'):
+            lines.append('        {!r}'.format(desc['doc']))
+        lines.append('        return await {}'.format(_format_call(name, params)))
+    lines.append('')
+    return '\n'.join(lines)
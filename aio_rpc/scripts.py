@@ -0,0 +1,48 @@
+'''Running a list of calls on the server in one round trip. The arguments of
+a call may refer to the results of the calls before it with ref, so a chain of
+dependent calls doesn't wait on the network between steps.
+
+>>> await client_obj._script(
+...         ('set_range', [10]),
+...         ('arm_trigger', []),
+...         ('read_buffer', {'channel': 1}),
+...         ('compute', [ref(2, 'samples')]))
+'''
+
+SCRIPT_METHOD = 'rpc.script'
+
+#__class__ of the json object standing in for an earlier result
+REF_CLASS = 'ref'
+
+
+def ref(index, *path):
+    '''refer to the result of the call at index in the script, or to an item
+    within it found by following path, e.g. ref(2, 'samples', 0) is
+    result[2]['samples'][0]'''
+    return {
+            '__class__' : REF_CLASS,
+            'index'     : index,
+            'path'      : list(path)}
+
+
+def resolve(value, results):
+    '''replace the references in value, also inside lists and dicts, with the
+    results they refer to
+
+    Raises:
+        LookupError: if a reference is to a call which hasn't been made or to
+        an item which doesn't exist'''
+    if isinstance(value, dict):
+        if value.get('__class__') == REF_CLASS:
+            index = value['index']
+            if not 0 <= index < len(results):
+                raise IndexError('reference to result {} when {} calls have '
+                        'been made'.format(index, len(results)))
+            result = results[index]
+            for key in value.get('path', ()):
+                result = result[key]
+            return result
+        return {k: resolve(v, results) for k,v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [resolve(v, results) for v in value]
+    return value
@@ -0,0 +1,121 @@
+'''Encoding large results a piece at a time and sending them as the fragments
+of a single websocket message, so that the whole of the json never has to be
+held in memory at once.'''
+import json
+import struct
+from functools import partial
+from itertools import islice
+from .custom_json import to_json
+
+_dumps = partial(json.dumps, default=to_json)
+_CONTAINERS = (list, tuple, dict)
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+
+
+def _large(value, items):
+    return isinstance(value, _CONTAINERS) and len(value) > items
+
+
+def _encode_values(values, items):
+    '''the json of the list values without its brackets'''
+    if not any(_large(v, items) for v in values):
+        yield _dumps(values)[1:-1]
+        return
+    for i, v in enumerate(values):
+        if i:
+            yield ', '
+        if _large(v, items):
+            yield from iterencode(v, items)
+        else:
+            yield _dumps(v)
+
+
+def _encode_entries(entries, items):
+    '''the json of the (key, value) pairs entries without the braces'''
+    if not any(_large(v, items) for k,v in entries):
+        yield _dumps(dict(entries))[1:-1]
+        return
+    for i, (k, v) in enumerate(entries):
+        if i:
+            yield ', '
+        #the key as json.dumps writes it, which converts numbers to strings
+        yield _dumps({k: 0})[1:-4]
+        yield ': '
+        if _large(v, items):
+            yield from iterencode(v, items)
+        else:
+            yield _dumps(v)
+
+
+def iterencode(obj, items=1000):
+    '''yield the json of obj in pieces which join up to json.dumps(obj,
+    default=to_json). Lists and dicts are encoded items entries at a time by
+    json.dumps, descending into any large lists and dicts within them.
+
+    Args:
+        items (int): the number of entries to encode at once
+    '''
+    if isinstance(obj, (list, tuple)):
+        yield '['
+        for i in range(0, len(obj), items):
+            if i:
+                yield ', '
+            yield from _encode_values(obj[i:i+items], items)
+        yield ']'
+    elif isinstance(obj, dict):
+        yield '{'
+        entries = iter(obj.items())
+        first = True
+        while True:
+            chunk = list(islice(entries, items))
+            if not chunk:
+                break
+            if not first:
+                yield ', '
+            first = False
+            yield from _encode_entries(chunk, items)
+        yield '}'
+    else:
+        yield _dumps(obj)
+
+
+def _frame_header(length, opcode, fin):
+    first = (0x80 if fin else 0) | opcode
+    if length < 126:
+        return struct.pack('!BB', first, length)
+    if length < (1 << 16):
+        return struct.pack('!BBH', first, 126, length)
+    return struct.pack('!BBQ', first, 127, length)
+
+
+async def send_fragmented(ws, pieces, *, binary=False):
+    '''send pieces of bytes from a server side websocket as the frames of
+    one message, waiting for each to drain so only about one piece is
+    buffered at a time. aiohttp 1.x only writes whole messages, so the frames
+    are written here. Nothing else may be sent on ws until this returns.
+
+    Returns:
+        int: the number of bytes of payload sent'''
+    writer = ws._writer.writer
+    opcode = OPCODE_BINARY if binary else OPCODE_TEXT
+    sent = 0
+    previous = None
+    for piece in pieces:
+        if not piece:
+            continue
+        if previous is not None:
+            writer.write(_frame_header(len(previous), opcode, False))
+            writer.write(previous)
+            sent += len(previous)
+            opcode = OPCODE_CONTINUATION
+            await writer.drain()
+        previous = piece
+    if previous is None:
+        previous = b''
+    writer.write(_frame_header(len(previous), opcode, True))
+    writer.write(previous)
+    await writer.drain()
+    return sent + len(previous)
@@ -0,0 +1,81 @@
+'''TLS configuration shared by AioRPCServ and AioRPCClient. Contexts are meant
+to be built once and reused for every connection.'''
+import binascii
+import hashlib
+import re
+import ssl
+
+#forward secret AEAD suites only. TLS 1.3 suites are configured separately by
+#OpenSSL and are all acceptable.
+CIPHERS = 'ECDHE+AESGCM:ECDHE+CHACHA20:DHE+AESGCM:DHE+CHACHA20'
+
+PEM_CERT_RE = re.compile(
+        '-----BEGIN CERTIFICATE-----.+?-----END CERTIFICATE-----', re.DOTALL)
+
+
+def _harden(context):
+    #TLS 1.2 or later
+    context.options |= (ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3 | ssl.OP_NO_TLSv1 |
+            ssl.OP_NO_TLSv1_1 | ssl.OP_NO_COMPRESSION)
+    context.set_ciphers(CIPHERS)
+
+
+def server_context(cert, key=None):
+    '''context for serving over https/wss. Session tickets and the session
+    cache are left enabled so that reconnecting clients can skip the full
+    handshake.
+
+    Args:
+        cert (file_path): the certificate chain, which may contain the key
+        key (file_path): the private key if it isn't in cert
+    '''
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    _harden(context)
+    context.options |= ssl.OP_CIPHER_SERVER_PREFERENCE
+    context.options &= ~ssl.OP_NO_TICKET
+    context.load_cert_chain(cert, key)
+    return context
+
+
+def client_context(cafile=None):
+    '''context for connecting to a server
+
+    Args:
+        cafile (file_path): certificates to verify the server against. If
+        None, the server's certificate isn't verified by the context, which is
+        only safe if it is pinned with a fingerprint on the connector.
+    '''
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    _harden(context)
+    if cafile is not None:
+        context.load_verify_locations(cafile)
+    else:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def cert_fingerprint(cert):
+    '''the sha256 fingerprint of the first certificate in a PEM file, as used
+    to pin a server
+
+    Args:
+        cert (file_path): the PEM file
+
+    Returns:
+        bytes: the digest of the DER encoded certificate'''
+    with open(cert) as f:
+        match = PEM_CERT_RE.search(f.read())
+    if match is None:
+        raise ValueError('no certificate found in {}'.format(cert))
+    return hashlib.sha256(ssl.PEM_cert_to_DER_cert(match.group(0))).digest()
+
+
+def parse_fingerprint(fingerprint):
+    '''accept a fingerprint as bytes or as hex, optionally colon separated as
+    printed by openssl x509 -fingerprint -sha256'''
+    if isinstance(fingerprint, str):
+        fingerprint = binascii.unhexlify(fingerprint.replace(':', ''))
+    if len(fingerprint) != hashlib.sha256().digest_size:
+        raise ValueError('expected a sha256 fingerprint')
+    return fingerprint
@@ -0,0 +1,15 @@
+'''Watching the result of a method for changes. The server calls the method
+at the requested interval and notifies the watching client with rpc.changed
+only when the result differs from the one it last sent. Watchers of the same
+method and arguments share one poll.
+
+>>> subscription = await client_obj._watch('read_status', interval=0.5)
+>>> status = await subscription.changed()
+'''
+
+WATCH_METHOD = 'rpc.watch'
+UNWATCH_METHOD = 'rpc.unwatch'
+
+#the notification sent with the new result, params {"subscription": id,
+#"result": result} or {"subscription": id, "error": error}
+CHANGED_METHOD = 'rpc.changed'
@@ -0,0 +1,423 @@
+'''Loopback benchmark of AioRPCServ serving tests/test_classes Blocking.
+
+A server is started in a subprocess for each security setting and every
+combination of client kind, payload and concurrency is run against it from a
+fresh client subprocess. Calls per second and latency percentiles are written
+out as JSON, along with the time each client took to connect and, for the
+secure server, the time of full and resumed TLS handshakes.
+
+Usage:
+    python benchmarks/loopback.py [--output results.json] [--baseline old.json]
+
+With --baseline the exit status is 1 if calls per second of any run dropped
+by more than --tolerance compared to the matching run in the baseline.
+'''
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+LOGIN = 'default'
+PW = '123456'
+
+#name: (method, args)
+PAYLOADS = {
+        'small'     : ('add', (1, 2)),
+        'list_1k'   : ('add_arrays', (list(range(1000)), list(range(1000)))),
+        'bytes_4k'  : ('add_arrays', (bytes(4096), bytes(4096))),
+        'bytes_64k' : ('add_arrays', (bytes(65536), bytes(65536))),
+        }
+CLIENTS = ('async', 'threaded')
+SECURITY = ('insecure', 'secure')
+CONCURRENCY = (1, 8, 32)
+
+
+def percentile(ordered, fraction):
+    '''nearest rank percentile of an ordered list'''
+    if not ordered:
+        return None
+    rank = max(int(round(fraction * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def latency_summary(latencies):
+    ordered = sorted(latencies)
+    return {
+            'mean' : sum(ordered) / len(ordered) if ordered else None,
+            'p50'  : percentile(ordered, 0.5),
+            'p99'  : percentile(ordered, 0.99),
+            'p999' : percentile(ordered, 0.999),
+            'max'  : ordered[-1] if ordered else None}
+
+
+def summarize(latencies, errors, elapsed, connect):
+    ordered = sorted(latencies)
+    return {
+            'connect'       : connect,
+            'calls'         : len(ordered),
+            'errors'        : errors,
+            'elapsed'       : elapsed,
+            'calls_per_sec' : len(ordered) / elapsed if elapsed else None,
+            'latency'       : latency_summary(ordered)}
+
+
+def serve(port, secure, cert):
+    from aio_rpc.AioRPCServ import AioRPCServ
+    from tests.test_classes.blocking_class import Blocking
+    srv = AioRPCServ(class_to_instantiate=Blocking, timeout=30, secure=secure,
+            cert=cert, port=port, host_addr='127.0.0.1',
+            credentials={LOGIN: PW})
+    srv.run()
+
+
+def run_async_client(port, secure, fingerprint, method, args, calls, warmup,
+        concurrency, max_time):
+    from aio_rpc.AioRPCClient import AioRPCClient
+    start = perf_counter()
+    client = AioRPCClient(host_addr='127.0.0.1', port=port, secure=secure,
+            fingerprint=fingerprint, login=LOGIN, pw=PW, retry_wait_time=0.2)
+    loop = client.event_loop
+    obj = client.client_obj
+    latencies = []
+    errors = [0]
+    remaining = [calls]
+
+    async def worker(deadline):
+        call = getattr(obj, method)
+        while remaining[0] > 0 and perf_counter() < deadline:
+            remaining[0] -= 1
+            start = perf_counter()
+            try:
+                await call(*args)
+            except Exception:
+                errors[0] += 1
+            else:
+                latencies.append(perf_counter() - start)
+
+    async def main():
+        call = getattr(obj, method)
+        #the first call waits for logging in, access and the websocket
+        await obj.add(1, 2)
+        connect = perf_counter() - start
+        for i in range(warmup):
+            await call(*args)
+        started = perf_counter()
+        await asyncio.gather(
+                *[worker(started + max_time) for i in range(concurrency)],
+                loop=loop)
+        return perf_counter() - started, connect
+
+    try:
+        elapsed, connect = loop.run_until_complete(main())
+    finally:
+        loop.run_until_complete(client.close())
+        loop.run_until_complete(client.shutdown())
+    return summarize(latencies, errors[0], elapsed, connect)
+
+
+def run_threaded_client(port, secure, fingerprint, method, args, calls, warmup,
+        concurrency, max_time):
+    from aio_rpc.AioRPCThreadedClient import AioRPCThreadedClient
+    start = perf_counter()
+    client = AioRPCThreadedClient(host_addr='127.0.0.1', port=port,
+            secure=secure, fingerprint=fingerprint, login=LOGIN, pw=PW)
+    call = getattr(client, method)
+    latencies = []
+    errors = [0]
+    remaining = [calls]
+    lock = threading.Lock()
+
+    def worker(deadline):
+        while perf_counter() < deadline:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            start = perf_counter()
+            try:
+                call(*args)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+            else:
+                latency = perf_counter() - start
+                with lock:
+                    latencies.append(latency)
+
+    try:
+        client.add(1, 2)
+        connect = perf_counter() - start
+        for i in range(warmup):
+            call(*args)
+        started = perf_counter()
+        threads = [threading.Thread(target=worker, args=(started + max_time,))
+                for i in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = perf_counter() - started
+    finally:
+        client.close()
+    return summarize(latencies, errors[0], elapsed, connect)
+
+
+def make_cert(directory):
+    '''create a self signed certificate for the secure runs
+
+    Returns:
+        str: the path to the certificate or None if openssl isn't available'''
+    cert = os.path.join(directory, 'cert.pem')
+    try:
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048',
+            '-out', cert, '-keyout', cert, '-nodes', '-days', '1',
+            '-subj', '/CN=localhost'], check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return cert
+
+
+def measure_handshakes(port, count=50):
+    '''time TLS handshakes with the server, both full and resuming the
+    session of the previous connection
+
+    Returns:
+        dict: latency summaries of each kind of handshake and the fraction of
+        resumptions the server accepted'''
+    from aio_rpc.tls import client_context
+    context = client_context()
+    request = 'GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'
+    full, resumed = [], []
+    reused = 0
+    session = None
+    for i in range(count * 2):
+        resume = i % 2 == 1
+        sock = socket.create_connection(('127.0.0.1', port))
+        start = perf_counter()
+        tls_sock = context.wrap_socket(sock, server_hostname='localhost',
+                session=session if resume else None)
+        elapsed = perf_counter() - start
+        if resume:
+            resumed.append(elapsed)
+            reused += tls_sock.session_reused
+        else:
+            full.append(elapsed)
+        #TLS 1.3 session tickets arrive after the handshake, so read the
+        #response before keeping the session
+        tls_sock.sendall(request.encode('ascii'))
+        while tls_sock.recv(4096):
+            pass
+        if not resume:
+            session = tls_sock.session
+        tls_sock.close()
+    return {
+            'full'          : latency_summary(full),
+            'resumed'       : latency_summary(resumed),
+            'resumed_ratio' : reused / count}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), 0.5):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def start_server(port, secure, cert):
+    cmd = [sys.executable, os.path.abspath(__file__), '--serve', str(port)]
+    if secure:
+        cmd += ['--secure', '--cert', cert]
+    proc = subprocess.Popen(cmd, cwd=ROOT,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not wait_for_port(port):
+        proc.kill()
+        raise RuntimeError('server on port {} did not start'.format(port))
+    return proc
+
+
+def run_client(port, secure, cert, kind, payload, concurrency, opts):
+    '''run a single benchmark in a fresh client process so each starts with
+    its own event loop'''
+    cmd = [sys.executable, os.path.abspath(__file__), '--client', kind,
+            '--port', str(port), '--payload', payload,
+            '--concurrency', str(concurrency), '--calls', str(opts.calls),
+            '--warmup', str(opts.warmup), '--max-time', str(opts.max_time)]
+    if secure:
+        cmd += ['--secure', '--cert', cert]
+    proc = subprocess.run(cmd, cwd=ROOT, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True,
+            timeout=opts.max_time + 60)
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode or not lines:
+        return {'error': 'client exited with {}'.format(proc.returncode)}
+    #the result is the last line, the clients may print before it
+    return json.loads(lines[-1])
+
+
+def run_matrix(opts):
+    results = []
+    handshakes = None
+    with tempfile.TemporaryDirectory() as directory:
+        cert = None
+        for security in opts.security:
+            secure = security == 'secure'
+            if secure:
+                cert = make_cert(directory)
+                if cert is None:
+                    print('openssl unavailable, skipping secure runs',
+                            file=sys.stderr)
+                    continue
+            port = free_port()
+            server = start_server(port, secure, cert)
+            try:
+                if secure:
+                    handshakes = measure_handshakes(port)
+                for kind in opts.clients:
+                    for payload in opts.payloads:
+                        for concurrency in opts.concurrency:
+                            print('{} {} {} x{}'.format(security, kind, payload,
+                                concurrency), file=sys.stderr)
+                            result = {
+                                    'secure'      : secure,
+                                    'client'      : kind,
+                                    'payload'     : payload,
+                                    'concurrency' : concurrency}
+                            result.update(run_client(port, secure, cert,
+                                kind, payload, concurrency, opts))
+                            results.append(result)
+            finally:
+                server.terminate()
+                server.wait()
+    return results, handshakes
+
+
+def run_key(result):
+    return (result['secure'], result['client'], result['payload'],
+            result['concurrency'])
+
+
+def regressions(results, baseline, tolerance):
+    '''runs whose calls per second fell by more than tolerance'''
+    old = {run_key(r): r for r in baseline['results']}
+    slower = []
+    for r in results:
+        before = old.get(run_key(r))
+        if before is None or not before.get('calls_per_sec'):
+            continue
+        if not r.get('calls_per_sec') or \
+                r['calls_per_sec'] < before['calls_per_sec'] * (1 - tolerance):
+            slower.append({
+                'run'      : dict(zip(('secure', 'client', 'payload',
+                    'concurrency'), run_key(r))),
+                'baseline' : before['calls_per_sec'],
+                'current'  : r.get('calls_per_sec')})
+    return slower
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=1000,
+            help='calls per run')
+    parser.add_argument('--warmup', type=int, default=20,
+            help='calls made before timing starts')
+    parser.add_argument('--max-time', type=float, default=10,
+            help='the time in seconds after which a run stops early')
+    parser.add_argument('--payloads', nargs='+', default=list(PAYLOADS),
+            choices=list(PAYLOADS))
+    parser.add_argument('--concurrency', nargs='+', type=int,
+            default=list(CONCURRENCY))
+    parser.add_argument('--clients', nargs='+', default=list(CLIENTS),
+            choices=CLIENTS)
+    parser.add_argument('--security', nargs='+', default=list(SECURITY),
+            choices=SECURITY)
+    parser.add_argument('--output', help='file to write the results to '
+            'instead of stdout')
+    parser.add_argument('--baseline', help='results of a previous run to '
+            'compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+            help='allowed fractional drop in calls per second')
+    #used internally to run the server and clients in their own processes
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--client', choices=CLIENTS, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--payload', choices=list(PAYLOADS),
+            help=argparse.SUPPRESS)
+    parser.add_argument('--secure', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--cert', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    opts = parse_args(argv)
+
+    if opts.serve is not None:
+        serve(opts.serve, opts.secure, opts.cert)
+        return 0
+
+    if opts.client is not None:
+        from aio_rpc.tls import cert_fingerprint
+        method, args = PAYLOADS[opts.payload]
+        run = run_async_client if opts.client == 'async' else run_threaded_client
+        #pin the benchmark's own self signed certificate
+        fingerprint = cert_fingerprint(opts.cert) if opts.secure else None
+        result = run(opts.port, opts.secure, fingerprint, method, args,
+                opts.calls, opts.warmup, opts.concurrency[0], opts.max_time)
+        print(json.dumps(result))
+        return 0
+
+    import aiohttp
+    results, handshakes = run_matrix(opts)
+    report = {
+            'meta' : {
+                'python'   : platform.python_version(),
+                'aiohttp'  : aiohttp.__version__,
+                'platform' : platform.platform(),
+                'calls'    : opts.calls,
+                'warmup'   : opts.warmup,
+                'max_time' : opts.max_time},
+            'tls_handshakes' : handshakes,
+            'results' : results}
+
+    status = 0
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)
+        report['regressions'] = regressions(report['results'], baseline,
+                opts.tolerance)
+        if report['regressions']:
+            status = 1
+
+    output = json.dumps(report, indent=2)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
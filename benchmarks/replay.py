@@ -0,0 +1,149 @@
+'''Replay traffic captured by AioRPCServ(record=...) against a server.
+
+The requests of each captured session are sent through an AioRPCClient at the
+pace they arrived, scaled by --speed, or as fast as possible with --speed 0.
+Requests are not waited on before sending the next, so overlapping calls in
+the capture overlap again. Sessions are replayed one after the other over one
+connection, as the server only serves one client at a time. Latency
+percentiles and calls per second are written out as JSON.
+
+Usage:
+    python benchmarks/replay.py capture.jsonl --port 8080 [--speed 2]
+'''
+import argparse
+import asyncio
+import json
+import os
+import sys
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from loopback import summarize
+
+
+def parse_request(message):
+    '''Returns:
+        tuple: (method, args, kwargs), or None if the message isn't a single
+        request which can be sent again'''
+    try:
+        request = json.loads(message)
+    except ValueError:
+        return None
+    if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+        return None
+    params = request.get('params', [])
+    if isinstance(params, dict):
+        return request['method'], [], params
+    if isinstance(params, list):
+        return request['method'], params, {}
+    return None
+
+
+def replay(client, sessions, speed):
+    '''
+    Args:
+        client (AioRPCClient): connects to the server being loaded
+        sessions (list): as returned by aio_rpc.Recorder.load
+        speed (float): 1 replays at the captured pace, 2 twice as fast. 0
+        sends every request straight away.
+
+    Returns:
+        dict: the summary of the replayed calls'''
+    from aio_rpc.discovery import DISCOVER_METHOD
+    loop = client.event_loop
+    obj = client.client_obj
+    latencies = []
+    errors = [0]
+    skipped = [0]
+
+    async def call(method, args, kwargs):
+        start = perf_counter()
+        try:
+            await obj._call(method, args, kwargs)
+        except Exception:
+            errors[0] += 1
+        else:
+            latencies.append(perf_counter() - start)
+
+    async def run_session(entries):
+        start = perf_counter()
+        tasks = []
+        for t, message in entries:
+            request = parse_request(message)
+            if request is None:
+                skipped[0] += 1
+                continue
+            if speed:
+                delay = start + t / speed - perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay, loop=loop)
+            tasks.append(asyncio.ensure_future(call(*request), loop=loop))
+        if tasks:
+            await asyncio.wait(tasks, loop=loop)
+
+    async def main():
+        start = perf_counter()
+        #waits for logging in, access and the websocket
+        await obj._call(DISCOVER_METHOD, [], {})
+        connect = perf_counter() - start
+        started = perf_counter()
+        for session, entries in sessions:
+            await run_session(entries)
+        return perf_counter() - started, connect
+
+    elapsed, connect = loop.run_until_complete(main())
+    result = summarize(latencies, errors[0], elapsed, connect)
+    result['skipped'] = skipped[0]
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('capture', help='file written by AioRPCServ(record=...)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--secure', action='store_true')
+    parser.add_argument('--fingerprint', help='sha256 of the server '
+            'certificate to pin')
+    parser.add_argument('--login', default='default')
+    parser.add_argument('--pw', default='123456')
+    parser.add_argument('--speed', type=float, default=1,
+            help='pace relative to the capture, 0 for as fast as possible')
+    parser.add_argument('--output', help='file to write the results to '
+            'instead of stdout')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from aio_rpc.AioRPCClient import AioRPCClient
+    from aio_rpc.Recorder import load
+    opts = parse_args(argv)
+    sessions = load(opts.capture)
+    client = AioRPCClient(host_addr=opts.host, port=opts.port,
+            secure=opts.secure, fingerprint=opts.fingerprint, login=opts.login,
+            pw=opts.pw, retry_wait_time=0.2)
+    loop = client.event_loop
+    try:
+        result = replay(client, sessions, opts.speed)
+    finally:
+        loop.run_until_complete(client.close())
+        loop.run_until_complete(client.shutdown())
+    result['sessions'] = len(sessions)
+    result['requests'] = sum(len(entries) for s, entries in sessions)
+    result['captured'] = sum(entries[-1][0] for s, entries in sessions if entries)
+    result['speed'] = opts.speed
+
+    output = json.dumps(result, indent=2)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
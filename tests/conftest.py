@@ -8,6 +8,7 @@ from aio_rpc.JsonRPCABC import JsonRPCABC
 from aio_rpc.AioJsonSrv import AioJsonSrv
 from aio_rpc.AioJsonClient import AioJsonClient
 from aio_rpc.ClientObj import ClientObj
+from aio_rpc.AioRPCServ import AioRPCServ
 
 @pytest.fixture()
 def rpc(event_loop):
@@ -40,7 +41,7 @@ def client_mocked(event_loop, json_client):
     q = asyncio.Queue(maxsize=5, loop=event_loop)
     c = ClientObj(event_loop=event_loop, q=q, json_client=json_client)
     async def answerer(q, future_dict):
-        request_json = await q.get()
+        id_num, method_name, request_json = await q.get()
         request_dict = json.loads(request_json)
         id_num = request_dict['id']
         f = future_dict[id_num]
@@ -55,7 +56,7 @@ def client_srv_answerer(event_loop, json_client, srv):
     q = asyncio.Queue(maxsize=5, loop=event_loop)
     c = ClientObj(event_loop=event_loop, q=q, json_client=json_client)
     async def answerer(q, srv, client_obj, json_client):
-        request_json = await q.get()
+        id_num, method_name, request_json = await q.get()
         result_json,e = await srv.process_incoming(request_json)
         r = await json_client.process_incoming(result_json)
 
@@ -63,3 +64,26 @@ def client_srv_answerer(event_loop, json_client, srv):
 
 
     return c
+
+@pytest.fixture()
+def serve(event_loop):
+    '''start(**kwargs) serves Blocking on a free localhost port, or the
+    class_to_instantiate given, with an AioRPCServ made with kwargs. Returns
+    the server and port.'''
+    started = []
+
+    async def start(**kwargs):
+        kwargs.setdefault('class_to_instantiate', Blocking)
+        kwargs.setdefault('credentials', {'default': '123456'})
+        server = AioRPCServ(secure=False, **kwargs)
+        handler = server.make_app().make_handler()
+        tcp = await event_loop.create_server(handler, '127.0.0.1', 0)
+        started.append((server, handler, tcp))
+        return server, tcp.sockets[0].getsockname()[1]
+
+    yield start
+    for server, handler, tcp in started:
+        tcp.close()
+        event_loop.run_until_complete(handler.shutdown(1))
+        server.watch_dog_task.cancel()
+        event_loop.run_until_complete(asyncio.wait([server.watch_dog_task]))
@@ -3,8 +3,15 @@ import json
 from aio_rpc.Exceptions import (NotFoundError,
                                 InvalidParamsError,
                                 InternalError,
-                                InvalidRequestError)
+                                InvalidRequestError,
+                                ScriptError)
 from aio_rpc.JsonRPCABC import JsonRPCABC
+from aio_rpc.AioJsonSrv import AioJsonSrv
+from aio_rpc.Wrapper import Wrapper
+from aio_rpc.Tracing import Tracer, Trace
+from aio_rpc.discovery import generate_stub
+from aio_rpc.scripts import ref
+from test_classes.blocking_class import Blocking
 
 @pytest.mark.asyncio
 async def test_call(srv):
@@ -65,3 +72,174 @@ async def test_call_internal_error(srv):
 
     assert expected_result == result_json
 
+
+@pytest.mark.asyncio
+async def test_call_traced(event_loop):
+    obj = Wrapper(cls=Blocking, cls_args=None, loop=event_loop, timeout=0.1)
+    tracer = Tracer()
+    srv = AioJsonSrv(obj=obj, tracer=tracer, attach_traces=True)
+    req, id_num = srv.request('add', positional_params = [1,2], trace_id='t1')
+
+    result_json, error, trace = await srv.process_incoming_traced(req)
+    result = json.loads(result_json)
+    assert result['result'] == 3
+    assert result['trace']['id'] == 't1'
+    assert result['trace']['method'] == 'add'
+    assert set(result['trace']['stages']) == {
+            'decode', 'bind', 'executor_wait', 'run', 'return'}
+
+    trace.mark('send')
+    tracer.finish(trace)
+    assert 'send' in tracer.find('t1')['stages']
+
+    #untraced requests go through as usual
+    req, id_num = srv.request('add', positional_params = [1,2])
+    result_json, error, trace = await srv.process_incoming_traced(req)
+    assert trace is None
+    assert 'trace' not in json.loads(result_json)
+
+def test_tracer_ring_buffer():
+    tracer = Tracer(size=2)
+    for i in range(3):
+        tracer.finish(Trace(i))
+    assert [t['id'] for t in tracer.recent()] == [2, 1]
+    assert [t['id'] for t in tracer.recent(1)] == [2]
+    assert tracer.find(0) is None
+
+@pytest.mark.asyncio
+async def test_discover_stub(srv):
+    req, id_num = srv.request('rpc.discover')
+    result_json, error = await srv.process_incoming(req)
+    description = json.loads(result_json)['result']
+    assert set(description['methods']) == {
+            'add', 'add_arrays', 'block', 'block_10ms', 'raise_exception'}
+
+    namespace = {}
+    exec(generate_stub(description, 'Remote'), namespace)
+    remote = namespace['Remote'](srv.obj)
+    assert await remote.add(1,2) == 3
+    assert remote.block_10ms.__doc__ == 'basic test function to sleep for 10 ms'
+
+@pytest.mark.asyncio
+async def test_release_without_shared_memory(srv):
+    req, id_num = srv.request('rpc.release', positional_params=[['segment']])
+    result_json, error = await srv.process_incoming(req)
+    assert json.loads(result_json)['result'] == 0
+
+@pytest.mark.asyncio
+async def test_restricted_methods(wrapped_obj):
+    srv = AioJsonSrv(obj=wrapped_obj, methods=['add'])
+    req, id_num = srv.request('add', positional_params=[1, 2])
+    result_json, error = await srv.process_incoming(req)
+    assert json.loads(result_json)['result'] == 3
+
+    for method in ('block_10ms', 'rpc.release'):
+        req, id_num = srv.request(method)
+        result_json, error = await srv.process_incoming(req)
+        assert isinstance(error, NotFoundError)
+
+    req, id_num = srv.request('rpc.discover')
+    result_json, error = await srv.process_incoming(req)
+    assert list(json.loads(result_json)['result']['methods']) == ['add']
+
+@pytest.mark.asyncio
+async def test_script(srv):
+    calls = [
+            {'method': 'add', 'params': [1, 2]},
+            {'method': 'add_arrays', 'params': {'a1': [ref(0)], 'a2': [10]}},
+            {'method': 'add', 'params': [ref(1, 0), ref(0)]}]
+    req, id_num = srv.request('rpc.script', positional_params=[calls])
+    result_json, error = await srv.process_incoming(req)
+    assert error is None
+    assert json.loads(result_json)['result'] == [3, [13], 16]
+
+@pytest.mark.asyncio
+async def test_script_stops_at_error(srv, json_abc):
+    calls = [
+            {'method': 'add', 'params': [1, 2]},
+            {'method': 'raise_exception'},
+            {'method': 'add', 'params': [3, 4]}]
+    req, id_num = srv.request('rpc.script', keyword_params={'calls': calls})
+    result_json, error = await srv.process_incoming(req)
+    assert isinstance(error, ScriptError)
+    exc = json_abc.exception_from_json_dict(json.loads(result_json)['error'])
+    assert isinstance(exc, ScriptError)
+    assert exc.index == 1
+    assert exc.results == [3]
+
+    #references are checked when the call is reached
+    calls = [{'method': 'add', 'params': [ref(0), 1]}]
+    req, id_num = srv.request('rpc.script', positional_params=[calls])
+    result_json, error = await srv.process_incoming(req)
+    assert error.index == 0
+    assert json.loads(result_json)['error']['data']['cause']['code'] == \
+            InvalidParamsError.code
+
+    calls = [{'method': 'undefined', 'params': []}]
+    req, id_num = srv.request('rpc.script', positional_params=[calls])
+    result_json, error = await srv.process_incoming(req)
+    assert isinstance(error, NotFoundError)
+
+@pytest.mark.asyncio
+async def test_params_not_array_or_object(srv):
+    for params in ('"ab"', '5'):
+        result_json, error = await srv.process_incoming(
+            '{{"jsonrpc": "2.0", "method": "add", "params": {}, "id": 3}}'
+            .format(params))
+        assert isinstance(error, InvalidRequestError)
+        assert json.loads(result_json)['id'] == 3
+
+class Sets():
+    def unique(self, items):
+        return set(items)
+    def unique_list(self, items):
+        return [set(items)]
+
+@pytest.mark.asyncio
+async def test_script_unencodable(event_loop):
+    obj = Wrapper(cls=Sets, loop=event_loop, timeout=1)
+    for stream in (False, True):
+        srv = AioJsonSrv(obj=obj, stream=stream)
+        calls = [{'method': 'unique', 'params': [[1, 1, 2]]}]
+        req, id_num = srv.request('rpc.script', positional_params=[calls],
+                id_num=5)
+        result_json, error = await srv.process_incoming(req)
+        assert isinstance(error, InternalError)
+        response = json.loads(result_json)
+        assert response['id'] == 5
+        assert response['error']['code'] == InternalError.code
+
+@pytest.mark.asyncio
+async def test_streamed_batch_unencodable(event_loop):
+    obj = Wrapper(cls=Sets, loop=event_loop, timeout=1)
+    srv = AioJsonSrv(obj=obj, stream=True)
+    requests = [
+            srv.request('unique_list', positional_params=[[1]], id_num=1)[0],
+            srv.request('rpc.discover', id_num=2)[0]]
+    result_json, error = await srv.process_incoming(
+            '[{}]'.format(','.join(requests)))
+    responses = json.loads(result_json)
+    assert responses[0]['id'] == 1
+    assert responses[0]['error']['code'] == InternalError.code
+    assert responses[1]['id'] == 2
+    assert 'result' in responses[1]
+
+@pytest.mark.asyncio
+async def test_batch(srv):
+    requests = [
+            srv.request('add', positional_params=[1,2], id_num=1)[0],
+            srv.request('add', positional_params=[1], id_num=2)[0],
+            srv.request('add', positional_params=[3,4], notification=True)[0],
+            '5']
+    result_json, error = await srv.process_incoming(
+            '[{}]'.format(', '.join(requests)))
+    assert error is None
+    responses = {r['id']: r for r in json.loads(result_json)}
+    #the notification isn't answered
+    assert len(responses) == 3
+    assert responses[1]['result'] == 3
+    assert responses[2]['error']['code'] == InvalidParamsError.code
+    assert responses['null']['error']['code'] == InvalidRequestError.code
+
+    result_json, error = await srv.process_incoming('[{}]'.format(requests[2]))
+    assert result_json is None
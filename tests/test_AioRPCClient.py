@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+from aio_rpc.AioRPCClient import AioRPCClient
+from aio_rpc.Exceptions import ConnectionLostError, ServerOverloadedError
+
+@pytest.mark.asyncio
+async def test_shutdown_only_cancels_own_tasks(event_loop):
+    clients = [AioRPCClient(event_loop=event_loop, start=False, secure=False)
+            for i in range(2)]
+    other = asyncio.ensure_future(asyncio.sleep(10, loop=event_loop),
+            loop=event_loop)
+    tasks = [c.spawn(asyncio.sleep(10, loop=event_loop)) for c in clients]
+    await clients[0].shutdown()
+    assert tasks[0].cancelled()
+    assert not tasks[1].done()
+    assert not other.done()
+    assert not clients[0]._tasks
+    await clients[1].shutdown()
+    assert tasks[1].cancelled()
+    other.cancel()
+
+
+def drop(client):
+    '''cut the client's connection without a close handshake'''
+    client.ws._response.connection.close()
+    client.ws._response.close()
+
+
+@pytest.mark.asyncio
+async def test_resend_idempotent(event_loop, serve):
+    server, port = await serve(resume_grace=5)
+    async with AioRPCClient(event_loop=event_loop, port=port, secure=False,
+            start=False, idempotent_methods=['add'],
+            reconnect_wait_time=0.01) as client:
+        obj = client.client_obj
+        assert await obj.add(1, 2) == 3
+        lease = server.locked
+        #both are in flight when the connection drops
+        blocked = asyncio.ensure_future(obj.block(0.2), loop=event_loop)
+        added = asyncio.ensure_future(obj.add(2, 3), loop=event_loop)
+        await asyncio.sleep(0.05, loop=event_loop)
+        drop(client)
+        assert await added == 5
+        with pytest.raises(ConnectionLostError):
+            await blocked
+        #carried on with the same lease
+        assert await obj.add(3, 4) == 7
+        assert server.locked == lease
+        assert server.metrics.lease_grants.values[()] == 1
+
+
+@pytest.mark.asyncio
+async def test_response_too_big(event_loop, serve):
+    server, port = await serve()
+    async with AioRPCClient(event_loop=event_loop, port=port, secure=False,
+            start=False, compression=True, max_message_size=2000) as client:
+        obj = client.client_obj
+        #the deflated response is short but inflates past the limit
+        with pytest.raises(ServerOverloadedError):
+            await obj.add_arrays([1]*2000, [1]*2000)
+        assert await obj.add(1, 2) == 3
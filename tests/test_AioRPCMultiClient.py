@@ -0,0 +1,48 @@
+import asyncio
+import pytest
+from aio_rpc.AioRPCMultiClient import AioRPCMultiClient, EndpointStats
+from aio_rpc.AioRPCServ import AioRPCServ
+
+def test_latency_smoothing():
+    stats = EndpointStats(smoothing=0.5)
+    stats.record_latency(1.0)
+    assert stats.latency == 1.0
+    stats.record_latency(2.0)
+    assert stats.latency == 1.5
+
+def test_failure_cooldown():
+    stats = EndpointStats(cooldown=5)
+    assert stats.healthy(now=0)
+    stats.record_failure(now=10)
+    assert not stats.healthy(now=14)
+    assert stats.healthy(now=15)
+    stats.record_failure(now=15)
+    #cooldown doubles with consecutive failures
+    assert not stats.healthy(now=24)
+    assert stats.healthy(now=25)
+    stats.record_latency(0.1)
+    assert stats.healthy(now=25)
+
+
+@pytest.mark.asyncio
+async def test_fastest_grant_wins(event_loop, serve, monkeypatch):
+    get_access = AioRPCServ.get_access
+    async def slow_get_access(server, request):
+        if server is slow:
+            await asyncio.sleep(0.2, loop=event_loop)
+        return await get_access(server, request)
+    monkeypatch.setattr(AioRPCServ, 'get_access', slow_get_access)
+    slow, slow_port = await serve()
+    fast, fast_port = await serve()
+    endpoints = [('127.0.0.1', slow_port), ('127.0.0.1', fast_port)]
+    async with AioRPCMultiClient(event_loop=event_loop, endpoints=endpoints,
+            stagger=0, secure=False, start=False) as client:
+        assert await client.client_obj.add(1, 2) == 3
+        assert client.port == fast_port
+        assert fast.locked
+        #the slow server's grant came too late and is handed back
+        await asyncio.sleep(0.3, loop=event_loop)
+        assert slow.locked is False
+        assert slow.metrics.lease_releases.values[('released',)] == 1
+        assert client.stats[endpoints[0]].grants == 1
+        assert client.ranked_endpoints() == endpoints[::-1]
@@ -0,0 +1,296 @@
+import asyncio
+import json
+import aiohttp
+import pytest
+from aio_rpc.AioRPCServ import AioRPCServ
+from aio_rpc.constants import (RESUME_TOKEN_HEADER, CLOSE_NOT_GRANTED,
+        CLOSE_TOO_BIG)
+from aio_rpc.Messages import Response
+from aio_rpc.Watches import Subscriber
+from test_classes.blocking_class import Blocking
+
+
+class Writer():
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+class WebSocket():
+    '''records what the server sends in place of a websocket'''
+    def __init__(self):
+        self._writer = type('StreamWriter', (), {'writer': Writer()})()
+        self.sent = []
+        self.closed = False
+        self.close_code = None
+
+    def send_str(self, data):
+        self.sent.append(data)
+
+    async def close(self, *, code=1000, message=b''):
+        self.closed = True
+        self.close_code = code
+
+
+@pytest.fixture()
+def server(event_loop):
+    server = AioRPCServ(obj=Blocking(), secure=False, credentials={},
+            stream_results=True, stream_chunk_size=100)
+    yield server
+    server.watch_dog_task.cancel()
+    event_loop.run_until_complete(asyncio.wait([server.watch_dog_task]))
+
+
+def test_obj_cant_idle():
+    #an object passed in can't be made again once dropped
+    with pytest.raises(Exception):
+        AioRPCServ(obj=Blocking(), idle_timeout=60, secure=False,
+                credentials={})
+
+
+@pytest.mark.asyncio
+async def test_streamed_unencodable(server):
+    #found before anything is sent, so answered with an error
+    ws = WebSocket()
+    await server.send_streamed(ws, Response(3, [set()] + list(range(3000))),
+            None)
+    assert not ws._writer.writer.data
+    assert json.loads(ws.sent[0])['error']['code'] == -32603
+    assert json.loads(ws.sent[0])['id'] == 3
+    assert not ws.closed
+
+    #found part way through, after fragments went out
+    ws = WebSocket()
+    await server.send_streamed(ws, Response(4, list(range(3000)) + [set()]),
+            None)
+    assert ws._writer.writer.data
+    assert ws.close_code == 1011
+
+
+@pytest.mark.asyncio
+async def test_lease_end_stops_watches(server, event_loop):
+    ws = WebSocket()
+    subscriber = Subscriber(ws.send_str)
+    server.holder_watchers[subscriber] = ws
+    server.grant_lease()
+    server.watches.watch(subscriber, 1, 'add', [1, 2], {}, 0.01)
+    await asyncio.sleep(0.05)
+    assert json.loads(ws.sent[0])['params'] == {'subscription': 1, 'result': 3}
+    #the watchdog still ends a lease which is only watching
+    server.release_lease('timeout')
+    assert not subscriber.subscriptions
+    assert len(server.watches) == 0
+    await asyncio.sleep(0)
+    assert ws.close_code == 4001
+
+
+AUTH = aiohttp.BasicAuth('default', '123456')
+
+
+def drop(ws):
+    '''cut a connection without a close handshake'''
+    ws._response.connection.close()
+    ws._response.close()
+
+
+async def take_lease(event_loop, port):
+    '''log in, get access and connect the way AioRPCClient does
+
+    Returns:
+        tuple: (session, resume token, websocket)'''
+    #cookies are only kept for an IP address with an unsafe jar
+    session = aiohttp.ClientSession(loop=event_loop, auth=AUTH,
+            cookie_jar=aiohttp.CookieJar(unsafe=True, loop=event_loop))
+    async with session.get('http://127.0.0.1:{}/login'.format(port)):
+        pass
+    async with session.get(
+            'http://127.0.0.1:{}/get_access'.format(port)) as resp:
+        token = resp.headers[RESUME_TOKEN_HEADER]
+    ws = await session.ws_connect('ws://127.0.0.1:{}/ws'.format(port))
+    return session, token, ws
+
+
+async def resume(event_loop, port, token):
+    '''reconnect in a new session with only the resume token'''
+    session = aiohttp.ClientSession(loop=event_loop)
+    ws = await session.ws_connect('ws://127.0.0.1:{}/ws'.format(port),
+            headers={RESUME_TOKEN_HEADER: token})
+    return session, ws
+
+
+@pytest.mark.asyncio
+async def test_resume_grace(event_loop, serve):
+    server, port = await serve(resume_grace=0.5)
+    session, token, ws = await take_lease(event_loop, port)
+    #dropped without a close handshake, the lease is held for resume_grace
+    drop(ws)
+    await asyncio.sleep(0.1, loop=event_loop)
+    assert server.locked == token
+    session.close()
+
+    session, ws = await resume(event_loop, port, token)
+    ws.send_str(json.dumps({'jsonrpc': '2.0', 'method': 'block_10ms',
+        'params': [], 'id': 1}))
+    msg = await ws.receive()
+    assert json.loads(msg.data) == {'jsonrpc': '2.0', 'result': None, 'id': 1}
+    assert server.metrics.lease_grants.values[()] == 1
+    drop(ws)
+    session.close()
+
+    #the watchdog checks every second
+    await asyncio.sleep(1.6, loop=event_loop)
+    assert server.locked is False
+    assert server.metrics.lease_releases.values[('timeout',)] == 1
+    session, ws = await resume(event_loop, port, token)
+    await ws.receive()
+    assert ws.close_code == CLOSE_NOT_GRANTED
+    await ws.close()
+    session.close()
+
+
+async def post(session, port, body, **kwargs):
+    '''Returns:
+        tuple: (status, body text) of a POST to /rpc'''
+    async with session.post('http://127.0.0.1:{}/rpc'.format(port),
+            data=body, **kwargs) as resp:
+        return resp.status, await resp.text()
+
+
+@pytest.mark.asyncio
+async def test_http_rpc(event_loop, serve):
+    server, port = await serve(http_rpc=True)
+    session = aiohttp.ClientSession(loop=event_loop)
+    call = json.dumps({'jsonrpc': '2.0', 'method': 'add', 'params': [1, 2],
+        'id': 4})
+    assert (await post(session, port, call))[0] == 401
+    assert (await post(session, port, call,
+        auth=aiohttp.BasicAuth('default', 'wrong')))[0] == 401
+
+    status, text = await post(session, port, call, auth=AUTH)
+    assert status == 200
+    assert json.loads(text) == {'jsonrpc': '2.0', 'result': 3, 'id': 4}
+    #the lease lasts for the one POST
+    assert server.locked is False
+    assert server.metrics.lease_releases.values[('http',)] == 1
+
+    notification = json.dumps({'jsonrpc': '2.0', 'method': 'add',
+        'params': [1, 2]})
+    assert await post(session, port, notification, auth=AUTH) == (204, '')
+    assert server.metrics.lease_releases.values[('http',)] == 2
+
+    holder, token, ws = await take_lease(event_loop, port)
+    status, text = await post(session, port, call, auth=AUTH)
+    assert status == 503
+    assert server.locked == token
+    assert server.metrics.lease_denials.values[()] == 1
+    await ws.close()
+    holder.close()
+    await asyncio.sleep(0.05, loop=event_loop)
+    assert server.metrics.lease_releases.values[('closed',)] == 1
+    assert (await post(session, port, call, auth=AUTH))[0] == 200
+    session.close()
+
+
+def rpc_request(method, params, id_num):
+    return json.dumps({'jsonrpc': '2.0', 'method': method, 'params': params,
+        'id': id_num})
+
+
+@pytest.mark.asyncio
+async def test_admission(event_loop, serve):
+    server, port = await serve(connection_rate=0.01, connection_burst=2)
+    session = aiohttp.ClientSession(loop=event_loop, auth=AUTH)
+    statuses = []
+    for i in range(3):
+        async with session.get('http://127.0.0.1:{}/login'.format(port)) as resp:
+            statuses.append(resp.status)
+    assert statuses == [200, 200, 429]
+    assert server.metrics.rejected.values[('connection',)] == 1
+    session.close()
+
+
+@pytest.mark.asyncio
+async def test_ws_overloaded(event_loop, serve):
+    server, port = await serve(max_in_flight=1, user_rate=0.01, user_burst=1,
+            max_message_size=100)
+    session, token, ws = await take_lease(event_loop, port)
+    ws.send_str(rpc_request('block', [0.1], 1))
+    ws.send_str(rpc_request('add', [1, 2], 2))
+    responses = [json.loads((await ws.receive()).data) for i in range(2)]
+    assert responses[0]['id'] == 2
+    assert responses[0]['error']['code'] == -32003
+    assert responses[1] == {'jsonrpc': '2.0', 'result': None, 'id': 1}
+    assert server.metrics.rejected.values[('in_flight',)] == 1
+
+    #the user's only token went to the first call
+    ws.send_str(rpc_request('add', [1, 2], 3))
+    response = json.loads((await ws.receive()).data)
+    assert response['id'] == 3
+    assert response['error']['data']['details'] == 'too many calls, slow down'
+    assert server.metrics.rejected.values[('rate',)] == 1
+
+    ws.send_str(rpc_request('add', ['x'*100, 'y'], 4))
+    await ws.receive()
+    assert ws.close_code == CLOSE_TOO_BIG
+    assert server.metrics.rejected.values[('size',)] == 1
+    session.close()
+
+
+@pytest.mark.asyncio
+async def test_http_rpc_overloaded(event_loop, serve):
+    server, port = await serve(http_rpc=True, max_in_flight=1,
+            max_message_size=100)
+    session = aiohttp.ClientSession(loop=event_loop)
+    assert (await post(session, port, rpc_request('add', ['x'*100, 'y'], 1),
+        auth=AUTH))[0] == 413
+
+    #the first holds the lease, the second waits and the third is turned away
+    posts = [asyncio.ensure_future(post(session, port,
+        rpc_request('block', [0.1], i), auth=AUTH), loop=event_loop)
+        for i in range(2)]
+    await asyncio.sleep(0.05, loop=event_loop)
+    status, text = await post(session, port, rpc_request('add', [1, 2], 7),
+            auth=AUTH)
+    assert status == 429
+    response = json.loads(text)
+    assert response['id'] == 7
+    assert response['error']['code'] == -32003
+    assert [status for status, text in await asyncio.gather(*posts,
+        loop=event_loop)] == [200, 200]
+    assert server.metrics.rejected.values == {('size',): 1, ('in_flight',): 1}
+    session.close()
+
+
+@pytest.mark.asyncio
+async def test_traces_limit(event_loop, serve):
+    server, port = await serve(tracing=True)
+    session = aiohttp.ClientSession(loop=event_loop)
+    url = 'http://127.0.0.1:{}/traces?limit={}'
+    for limit, status in [('2', 200), ('0', 200), ('abc', 400), ('-1', 400),
+            ('1.5', 400)]:
+        async with session.get(url.format(port, limit)) as resp:
+            assert resp.status == status
+    session.close()
+
+
+@pytest.mark.asyncio
+async def test_watches_hold_lease(event_loop, serve):
+    server, port = await serve(watchdog_timeout=0.2, max_watch_idle=1.2)
+    session, token, ws = await take_lease(event_loop, port)
+    ws.send_str(rpc_request('rpc.watch', [1, 'add', [1, 2], 0.1], 1))
+    messages = [json.loads((await ws.receive()).data) for i in range(2)]
+    assert {'jsonrpc': '2.0', 'result': 1, 'id': 1} in messages
+    #held past watchdog_timeout while watching
+    await asyncio.sleep(1.1, loop=event_loop)
+    assert server.locked == token
+    #but not past max_watch_idle without hearing from the client
+    await asyncio.sleep(1, loop=event_loop)
+    assert server.locked is False
+    await ws.receive()
+    assert ws.close_code == CLOSE_NOT_GRANTED
+    session.close()
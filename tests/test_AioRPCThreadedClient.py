@@ -0,0 +1,64 @@
+import asyncio
+import threading
+import pytest
+from aio_rpc.AioRPCThreadedClient import AioRPCThreadedClient
+
+
+class Log():
+    def __init__(self):
+        self.items = []
+
+    def append(self, item):
+        self.items.append(item)
+        return len(self.items)
+
+    def get_items(self):
+        return self.items
+
+    def block(self, num):
+        threading.Event().wait(num)
+
+
+@pytest.fixture()
+def client(event_loop, serve):
+    '''a threaded client of a Log served from the test loop in another
+    thread'''
+    server, port = event_loop.run_until_complete(
+            serve(class_to_instantiate=Log))
+    thread = threading.Thread(target=event_loop.run_forever)
+    thread.start()
+    client = AioRPCThreadedClient(host_addr='127.0.0.1', port=port,
+            secure=False, login='default', pw='123456')
+    yield client
+    client.close()
+    event_loop.call_soon_threadsafe(event_loop.stop)
+    thread.join()
+
+
+def test_map_order(client):
+    assert list(client.map('append', range(50))) == list(range(1, 51))
+    #started in the order they were submitted
+    assert client.get_items() == list(range(50))
+
+
+def test_call_timeout(client):
+    with pytest.raises(asyncio.TimeoutError):
+        client.submit('block', (0.3,), timeout=0.05).result()
+    assert client.append('after') == 1
+
+
+def test_cancel_before_start(client):
+    #hold up the client's loop until the calls are submitted
+    started = threading.Event()
+    release = threading.Event()
+    def hold():
+        started.set()
+        release.wait()
+    client._event_loop.call_soon_threadsafe(hold)
+    started.wait()
+    futures = [client.submit('append', (i,)) for i in range(3)]
+    assert futures[1].cancel()
+    release.set()
+    assert futures[2].result() == 2
+    assert futures[1].cancelled()
+    assert client.get_items() == [0, 2]
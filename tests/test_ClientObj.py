@@ -1,8 +1,10 @@
 import pytest
+import asyncio
 # This restores the default Ctrl+C signal handler, which just kills the process
 import signal
 signal.signal(signal.SIGINT, signal.SIG_DFL)
-from aio_rpc.Exceptions import NotFoundError
+from aio_rpc.Exceptions import NotFoundError, InvalidParamsError
+from aio_rpc.ClientObj import ClientObj
 
 @pytest.mark.asyncio
 async def test_caller(client_mocked):
@@ -28,3 +30,32 @@ async def test_caller_srv_bad(client_srv_answerer):
         r = await client_srv_answerer.add_bad(1,2)
 
 
+@pytest.mark.asyncio
+async def test_caller_timeout(event_loop, json_client):
+    q = asyncio.Queue(loop=event_loop)
+    c = ClientObj(event_loop=event_loop, q=q, json_client=json_client,
+            timeout=0.05)
+    with pytest.raises(asyncio.TimeoutError):
+        await c.add(1,2)
+    #nothing is left waiting for a late response
+    assert json_client.future_dict == {}
+
+@pytest.mark.asyncio
+async def test_caller_mixed_args(event_loop, json_client):
+    q = asyncio.Queue(loop=event_loop)
+    c = ClientObj(event_loop=event_loop, q=q, json_client=json_client)
+    with pytest.raises(InvalidParamsError):
+        await c.add(1, num2=2)
+    assert q.empty()
+
+@pytest.mark.asyncio
+async def test_discover(client_srv_answerer):
+    description = await client_srv_answerer._discover()
+    assert [p['name'] for p in description['methods']['add']['params']] == \
+            ['num1', 'num2']
+    #checked locally, so nothing needs answering
+    with pytest.raises(InvalidParamsError):
+        await client_srv_answerer.add(1)
+    with pytest.raises(NotFoundError):
+        await client_srv_answerer.add_bad(1,2)
+    assert client_srv_answerer.add is client_srv_answerer.add
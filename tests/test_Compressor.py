@@ -0,0 +1,67 @@
+import pytest
+import json
+import zlib
+from aio_rpc.Compressor import Compressor
+from aio_rpc.Metrics import Metrics
+from aio_rpc.Exceptions import ParseError, ServerOverloadedError
+
+
+class FakeWs():
+    def __init__(self):
+        self.sent = []
+    def send_str(self, data):
+        self.sent.append(('text', data))
+    def send_bytes(self, data):
+        self.sent.append(('binary', data))
+
+
+def test_below_threshold_sent_as_text():
+    c = Compressor(threshold=1024)
+    ws = FakeWs()
+    message = json.dumps({'result': 3})
+    assert c.send(ws, message) == len(message)
+    assert ws.sent == [('text', message)]
+
+def test_compress_round_trip():
+    metrics = Metrics()
+    c = Compressor(threshold=100, level=9, metrics=metrics)
+    ws = FakeWs()
+    message = json.dumps({'result': list(range(1000))})
+    sent = c.send(ws, message)
+    tp, data = ws.sent[0]
+    assert tp == 'binary'
+    assert sent == len(data) < len(message)
+    assert c.decompress(data) == message
+    assert metrics.compression_raw_bytes.values[('sent',)] == len(message)
+    assert metrics.compressed_bytes.values[('sent',)] == len(data)
+    assert metrics.compressed_bytes.values[('received',)] == len(data)
+
+def test_incompressible_sent_as_text():
+    c = Compressor(threshold=10)
+    ws = FakeWs()
+    message = bytes(range(256)).hex()[:40]
+    c.send(ws, message)
+    assert ws.sent[0][0] == 'text'
+
+def test_decompress_garbage():
+    c = Compressor()
+    with pytest.raises(ParseError):
+        c.decompress(b'not deflated')
+
+def test_decompress_max_size():
+    c = Compressor()
+    data = zlib.compress(b'1' * 10000)
+    assert c.decompress(data, max_size=10000) == '1' * 10000
+    #a small message can't inflate into a huge one
+    with pytest.raises(ServerOverloadedError):
+        c.decompress(data, max_size=9999)
+    with pytest.raises(ParseError):
+        c.decompress(data[:-4], max_size=20000)
+
+def test_decompress_default_max_size():
+    #limited also when no limit is passed
+    c = Compressor(max_size=1000)
+    bomb = zlib.compress(b'0' * 100000)
+    with pytest.raises(ServerOverloadedError):
+        c.decompress(bomb)
+    assert c.decompress(zlib.compress(b'0' * 1000)) == '0' * 1000
@@ -0,0 +1,51 @@
+import json
+import pytest
+from aio_rpc.Messages import (Request, Notification, Response, Error, Invalid,
+        parse)
+
+def test_parse_round_trip():
+    r = parse(json.loads(Request('add', [1, 2], 3, trace='t').to_json()))
+    assert type(r) is Request
+    assert (r.method, r.params, r.id, r.trace) == ('add', [1, 2], 3, 't')
+
+    n = parse(json.loads(Notification('tick', {'n': 1}).to_json()))
+    assert type(n) is Notification
+    assert (n.method, n.params) == ('tick', {'n': 1})
+
+    r = parse(json.loads(Response(3, {'x': None}).to_json()))
+    assert type(r) is Response
+    assert (r.id, r.result, r.trace) == (3, {'x': None}, None)
+
+    e = parse(json.loads(Error(3, {'code': -32601}).to_json()))
+    assert type(e) is Error
+    assert (e.id, e.error) == (3, {'code': -32601})
+
+    #slots keep messages small
+    with pytest.raises(AttributeError):
+        Request('add').extra = 1
+
+@pytest.mark.parametrize('message, error, id_num', [
+    ([], 'Missing or invalid rpc spec information', 'null'),
+    ({'method': 'add', 'id': 1}, 'Missing or invalid rpc spec information', 'null'),
+    ({'jsonrpc': '2.0', 'method': 'add', 'id': '1'},
+        'id in request must be an integer', 'null'),
+    ({'jsonrpc': '2.0', 'method': 5, 'id': 1}, 'method cannot be a number', 1),
+    ({'jsonrpc': '2.0', 'method': None, 'id': 1},
+        'method name has to be a string', 1),
+    ({'jsonrpc': '2.0', 'method': '', 'id': 1}, 'method cannot be empty', 1),
+    ({'jsonrpc': '2.0', 'method': '1a', 'id': 1},
+        'method cannot start with a number', 1),
+    ({'jsonrpc': '2.0', 'method': 'add', 'params': 'ab', 'id': 1},
+        'params must be an array or an object', 1),
+    ({'jsonrpc': '2.0', 'method': 'add', 'params': 5, 'id': 2},
+        'params must be an array or an object', 2),
+    ({'jsonrpc': '2.0', 'result': 1}, 'Missing ID in result', 'null'),
+    ({'jsonrpc': '2.0', 'result': 1, 'error': {}, 'id': 1},
+        'Result contains a result and an error field', 'null'),
+    ({'jsonrpc': '2.0', 'id': 1}, 'Not a request, result or error', 'null'),
+    ])
+def test_parse_invalid(message, error, id_num):
+    i = parse(message)
+    assert type(i) is Invalid
+    assert i.error.args == (error,)
+    assert i.id == id_num
@@ -0,0 +1,55 @@
+import pytest
+import threading
+from aio_rpc.Metrics import Metrics, Counter, Histogram
+from aio_rpc.AioJsonSrv import AioJsonSrv
+
+def test_counter():
+    c = Counter('calls_total', 'calls', ('method',))
+    c.inc('add')
+    c.inc('add')
+    c.inc('sub', amount=5)
+    assert list(c.render()) == [
+            'calls_total{method="add"} 2',
+            'calls_total{method="sub"} 5']
+
+def test_histogram():
+    h = Histogram('duration_seconds', 'duration', buckets=(0.1, 1))
+    h.observe(0.05)
+    h.observe(0.1)
+    h.observe(0.5)
+    h.observe(2)
+    assert list(h.render()) == [
+            'duration_seconds_bucket{le="0.1"} 2',
+            'duration_seconds_bucket{le="1"} 3',
+            'duration_seconds_bucket{le="+Inf"} 4',
+            'duration_seconds_sum 2.65',
+            'duration_seconds_count 4']
+
+def test_counts_from_threads():
+    c = Counter('calls_total', 'calls', ('method',))
+    h = Histogram('wait_seconds', 'wait', buckets=(0.1,))
+    def record():
+        for i in range(10000):
+            c.inc('add')
+            h.observe(0.5)
+    threads = [threading.Thread(target=record) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert c.values == {('add',): 40000}
+    assert h.values[()] == [[0, 40000], 20000.0]
+
+@pytest.mark.asyncio
+async def test_srv_metrics(wrapped_obj):
+    metrics = Metrics()
+    srv = AioJsonSrv(obj=wrapped_obj, metrics=metrics)
+    req, id_num = srv.request('add', positional_params=[1,2])
+    await srv.process_incoming(req)
+    req, id_num = srv.request('missing_method')
+    await srv.process_incoming(req)
+
+    assert metrics.calls.values == {('add',): 1}
+    assert metrics.call_duration.values[('add',)][0][-1] == 0
+    assert metrics.errors.values == {(-32601,): 1}
+    assert '# TYPE aio_rpc_calls_total counter' in metrics.render()
@@ -1,6 +1,11 @@
+import asyncio
 from asyncio import TimeoutError
 import pytest
+import threading
 import time
+from functools import partial
+from aio_rpc.ObjectWrapper import ObjectWrapper
+from aio_rpc.Metrics import Metrics
 
 @pytest.mark.asyncio
 async def test_basic(rpc):
@@ -23,3 +28,138 @@ async def test_function_lookup(rpc):
 async def test_except(rpc):
     with pytest.raises(AttributeError):
         await rpc.undefined_func()
+
+class Status():
+    def __init__(self):
+        self.reads = 0
+    def read_status(self, channel):
+        self.reads += 1
+        time.sleep(0.02)
+        return channel * 10
+
+@pytest.mark.asyncio
+async def test_single_flight(event_loop):
+    status = Status()
+    metrics = Metrics()
+    w = ObjectWrapper(obj=status, loop=event_loop, timeout=1, metrics=metrics,
+            single_flight=['read_status'])
+    results = await asyncio.gather(
+            *[w.read_status(1) for i in range(5)] + [w.read_status(channel=2)],
+            loop=event_loop)
+    assert results == [10]*5 + [20]
+    assert status.reads == 2
+    assert metrics.single_flight_calls.values == {
+            ('read_status', 'ran'): 2, ('read_status', 'joined'): 4}
+    #once done the call runs again
+    assert await w.read_status(1) == 10
+    assert status.reads == 3
+
+class Cached():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {'read': 0, 'write': 0}
+        self.overlaps = []
+        #reads wait at the barrier, if set, until enough of them run at once
+        self.barrier = None
+    def _enter(self, kind):
+        with self.lock:
+            self.running[kind] += 1
+            self.overlaps.append(dict(self.running))
+    def _leave(self, kind):
+        with self.lock:
+            self.running[kind] -= 1
+    def read(self):
+        self._enter('read')
+        if self.barrier is not None:
+            self.barrier.wait(1)
+        time.sleep(0.05)
+        self._leave('read')
+    def write(self):
+        self._enter('write')
+        time.sleep(0.02)
+        self._leave('write')
+
+@pytest.mark.asyncio
+async def test_shared_methods(event_loop):
+    cached = Cached()
+    w = ObjectWrapper(obj=cached, loop=event_loop, timeout=1,
+            shared_methods=['read'], shared_workers=4)
+    #only passes if all four reads run together
+    cached.barrier = threading.Barrier(4)
+    await asyncio.gather(*[w.read() for i in range(4)], loop=event_loop)
+    assert max(o['read'] for o in cached.overlaps) == 4
+
+    cached.barrier = None
+    cached.overlaps = []
+    await asyncio.gather(w.read(), w.write(), w.read(), w.write(), w.read(),
+            loop=event_loop)
+    for o in cached.overlaps:
+        assert o['write'] == 0 or o == {'read': 0, 'write': 1}
+
+class Powered():
+    def __init__(self):
+        self.powered = False
+    def _power_up(self):
+        self.powered = True
+    def _power_down(self):
+        self.powered = False
+    def read(self):
+        return self.powered
+
+@pytest.mark.asyncio
+async def test_shared_calls_wait_for_hooks(event_loop):
+    powered = Powered()
+    w = ObjectWrapper(obj=powered, loop=event_loop, timeout=1,
+            shared_methods=['read'], acquire_hook='_power_up',
+            release_hook='_power_down')
+    await w.lease_granted()
+    assert await w.read()
+    await w.lease_ended()
+    #hold up the single worker so the acquire hook is still queued
+    release = threading.Event()
+    held = w._submit(partial(release.wait, 1))
+    granted = w.lease_granted()
+    read = asyncio.ensure_future(w.read(), loop=event_loop)
+    try:
+        await asyncio.sleep(0.02, loop=event_loop)
+        assert not read.done()
+    finally:
+        release.set()
+        await held
+    await granted
+    assert await read
+
+class Getter():
+    def __init__(self):
+        self.delay = 0
+    def thread(self):
+        time.sleep(self.delay)
+        return threading.get_ident()
+    def slow(self):
+        time.sleep(0.05)
+
+@pytest.mark.asyncio
+async def test_inline_fast_methods(event_loop):
+    getter = Getter()
+    metrics = Metrics()
+    w = ObjectWrapper(obj=getter, loop=event_loop, timeout=1, metrics=metrics,
+            inline_threshold=0.01, inline_after=3)
+    loop_thread = threading.get_ident()
+    for i in range(3):
+        assert await w.thread() != loop_thread
+    assert w.thread.stats['inline']
+    assert await w.thread() == loop_thread
+
+    #calls stay in order behind whatever is on the executor
+    slow = asyncio.ensure_future(w.slow(), loop=event_loop)
+    await asyncio.sleep(0.01, loop=event_loop)
+    assert await w.thread() != loop_thread
+    await slow
+
+    #an overrun sends it back to the executor
+    getter.delay = 0.02
+    assert await w.thread() == loop_thread
+    assert not w.thread.stats['inline']
+    assert await w.thread() != loop_thread
+    assert metrics.inline_demotions.values == {('thread',): 1}
+    assert metrics.inline_run.values[('thread',)][1] >= 0.02
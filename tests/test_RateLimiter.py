@@ -0,0 +1,15 @@
+from aio_rpc.RateLimiter import RateLimiter
+
+def test_rate_limiter():
+    now = [0.0]
+    limiter = RateLimiter(rate=1, burst=2, max_keys=2, clock=lambda: now[0])
+    assert limiter.allow('a')
+    assert limiter.allow('a')
+    assert not limiter.allow('a')
+    #each key has its own bucket
+    assert limiter.allow('b')
+    assert limiter.bucket('b') is limiter.bucket('b')
+    now[0] = 1
+    #at max_keys, buckets which have filled up again are dropped
+    assert limiter.allow('c')
+    assert set(limiter._buckets) == {'a', 'c'}
@@ -0,0 +1,26 @@
+from aio_rpc.Recorder import Recorder, load
+
+def test_record_and_load(tmpdir):
+    now = [10.0]
+    path = str(tmpdir.join('capture.jsonl'))
+    recorder = Recorder(path, clock=lambda: now[0])
+    first = recorder.session()
+    first('{"jsonrpc": "2.0", "method": "add", "params": [1, 2], "id": 0}')
+    second = recorder.session()
+    now[0] += 0.5
+    first('{"jsonrpc": "2.0", "method": "block", "params": [0.1], "id": 1}')
+    second('not json')
+    recorder.close()
+
+    #appended to, not overwritten
+    recorder = Recorder(path, clock=lambda: now[0])
+    recorder.session()('{}')
+    recorder.close()
+
+    sessions = load(path)
+    assert len(sessions) == 3
+    (s1, entries1), (s2, entries2), (s3, entries3) = sessions
+    assert len({s1, s2, s3}) == 3
+    assert [t for t, m in entries1] == [0, 0.5]
+    assert '"block"' in entries1[1][1]
+    assert entries2 == [(0.5, 'not json')]
@@ -0,0 +1,31 @@
+import pytest
+import json
+pytest.importorskip('multiprocessing.shared_memory')
+from aio_rpc.SharedBuffers import SharedBuffers
+from aio_rpc.custom_json import to_json, from_json_shared
+
+
+def test_export_round_trip():
+    buffers = SharedBuffers(threshold=1024)
+    data = bytes(range(256)) * 8
+    result = buffers.export({'capture': data, 'small': b'abc', 'n': 1})
+    assert result['small'] == b'abc'
+    handle = result['capture']
+    assert handle['__class__'] == 'shm' and handle['size'] == len(data)
+
+    #as the client would decode it
+    received = json.loads(json.dumps(result, default=to_json),
+            object_hook=from_json_shared)
+    shared = received['capture']
+    assert shared.buf == data
+    assert received['small'] == b'abc'
+    shared.close()
+
+    assert buffers.release([handle['name']]) == 1
+    assert buffers.segments == {}
+
+def test_release_all():
+    buffers = SharedBuffers(threshold=10)
+    buffers.export([bytearray(100), memoryview(bytes(50))])
+    assert len(buffers.segments) == 2
+    assert buffers.release_all() == 2
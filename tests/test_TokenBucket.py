@@ -0,0 +1,26 @@
+from aio_rpc.TokenBucket import TokenBucket
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = TokenBucket(rate=10, burst=2, clock=lambda: now[0])
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    #borrowed tokens are waited for in turn
+    assert abs(bucket.take() - 0.1) < 1e-9
+    assert abs(bucket.take() - 0.2) < 1e-9
+    now[0] = 10
+    #refills up to the burst only
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() > 0
+
+def test_try_take():
+    now = [0.0]
+    bucket = TokenBucket(rate=10, burst=1, clock=lambda: now[0])
+    assert bucket.try_take()
+    #nothing is borrowed when refused
+    assert not bucket.try_take()
+    now[0] = 0.05
+    assert not bucket.try_take()
+    now[0] = 0.1
+    assert bucket.try_take()
@@ -0,0 +1,147 @@
+import json
+import asyncio
+import pytest
+from aio_rpc.ObjectWrapper import ObjectWrapper
+from aio_rpc.AioJsonSrv import AioJsonSrv
+from aio_rpc.AioJsonClient import AioJsonClient
+from aio_rpc.ClientObj import ClientObj
+from aio_rpc.Watches import Watches, Subscriber
+from aio_rpc.Exceptions import ServerOverloadedError
+
+
+class Sensor():
+    def __init__(self):
+        self.value = 0
+        self.reads = 0
+
+    def read(self, offset=0):
+        self.reads += 1
+        return self.value + offset
+
+
+def watching_srv(event_loop, **kwargs):
+    sensor = Sensor()
+    obj = ObjectWrapper(obj=sensor, loop=event_loop, timeout=1)
+    watches = Watches(obj=obj, loop=event_loop, **kwargs)
+    srv = AioJsonSrv(obj=obj, watches=watches, min_watch_interval=0.01)
+    return srv, sensor
+
+
+def request(method, params, id_num=1):
+    return json.dumps({'jsonrpc': '2.0', 'method': method, 'params': params,
+        'id': id_num})
+
+
+@pytest.mark.asyncio
+async def test_watch(event_loop):
+    srv, sensor = watching_srv(event_loop)
+    pushed = []
+    subscriber = Subscriber(lambda message: pushed.append(json.loads(message)))
+    response, error = await srv.process_incoming(
+            request('rpc.watch', [7, 'read', [], 0.01]), subscriber)
+    assert error is None
+    assert json.loads(response)['result'] == 7
+    await asyncio.sleep(0.1)
+    #only the first result is sent while it stays the same
+    assert sensor.reads > 2
+    assert pushed == [{'jsonrpc': '2.0', 'method': 'rpc.changed',
+        'params': {'subscription': 7, 'result': 0}}]
+    sensor.value = 5
+    await asyncio.sleep(0.05)
+    assert [p['params']['result'] for p in pushed] == [0, 5]
+
+    response, error = await srv.process_incoming(
+            request('rpc.unwatch', [7]), subscriber)
+    assert json.loads(response)['result'] is True
+    assert not srv.watches._polls
+    sensor.value = 6
+    await asyncio.sleep(0.05)
+    assert len(pushed) == 2
+
+
+@pytest.mark.asyncio
+async def test_watch_shares_polls(event_loop):
+    srv, sensor = watching_srv(event_loop)
+    first, second, other = [], [], []
+    subscribers = [Subscriber(first.append), Subscriber(second.append),
+            Subscriber(other.append)]
+    await srv.process_incoming(request('rpc.watch', [1, 'read', [], 1]),
+            subscribers[0])
+    await asyncio.sleep(0.01)
+    await srv.process_incoming(request('rpc.watch', [1, 'read', [], 0.02]),
+            subscribers[1])
+    await srv.process_incoming(request('rpc.watch', [1, 'read', [2], 0.02]),
+            subscribers[2])
+    assert len(srv.watches) == 2
+    await asyncio.sleep(0.01)
+    #the second watcher is caught up with the result already sent
+    assert first == second
+    sensor.value = 1
+    await asyncio.sleep(0.05)
+    assert first == second
+    assert [json.loads(m)['params']['result'] for m in first] == [0, 1]
+    assert [json.loads(m)['params']['result'] for m in other] == [2, 3]
+    srv.watches.drop(subscribers[1])
+    srv.watches.drop(subscribers[2])
+    assert len(srv.watches) == 1
+    srv.watches.drop(subscribers[0])
+    assert len(srv.watches) == 0
+
+
+@pytest.mark.asyncio
+async def test_watch_errors(event_loop):
+    srv, sensor = watching_srv(event_loop, max_watches=1)
+    subscriber = Subscriber(lambda message: None)
+    for params, code in [
+            ([1, 'missing', [], 1], -32601),
+            ([1, 'read', [1, 2], 1], -32602),
+            ([1, 'read', [], 0], -32602)]:
+        response, error = await srv.process_incoming(
+                request('rpc.watch', params), subscriber)
+        assert error.code == code
+    await srv.process_incoming(request('rpc.watch', [1, 'read', [], 1]),
+            subscriber)
+    response, error = await srv.process_incoming(
+            request('rpc.watch', [2, 'read', [1], 1]), subscriber)
+    assert isinstance(error, ServerOverloadedError)
+    #watching again with the same id replaces the watch
+    response, error = await srv.process_incoming(
+            request('rpc.watch', [1, 'read', [1], 1]), subscriber)
+    assert error is None
+    assert len(srv.watches) == 1
+    #watches need a connection to send to
+    response, error = await srv.process_incoming(
+            request('rpc.watch', [1, 'read', [], 1]))
+    assert error.code == -32601
+    srv.watches.drop(subscriber)
+
+
+@pytest.mark.asyncio
+async def test_client_watch(event_loop):
+    srv, sensor = watching_srv(event_loop)
+    json_client = AioJsonClient(event_loop=event_loop, future_dict={})
+    q = asyncio.Queue(loop=event_loop)
+    client_obj = ClientObj(event_loop=event_loop, q=q, json_client=json_client)
+    subscriber = Subscriber(lambda message: asyncio.ensure_future(
+        json_client.process_incoming(message), loop=event_loop))
+
+    async def answerer():
+        while True:
+            id_num, method_name, request_json = await q.get()
+            response, error = await srv.process_incoming(request_json,
+                    subscriber)
+            await json_client.process_incoming(response)
+    task = asyncio.ensure_future(answerer(), loop=event_loop)
+
+    changes = []
+    subscription = await client_obj._watch('read', {'offset': 1},
+            interval=0.01, callback=changes.append)
+    assert await subscription.changed() == 1
+    sensor.value = 2
+    assert await subscription.changed() == 3
+    assert subscription.value == 3
+    assert changes == [subscription, subscription]
+    await subscription.close()
+    assert not json_client.subscriptions
+    assert not srv.watches._polls
+    task.cancel()
@@ -1,4 +1,93 @@
+import asyncio
+import threading
+import pytest
+from aio_rpc.Wrapper import Wrapper
+from test_classes.blocking_class import Blocking
 
 def test_function_lookup(wrapped_obj):
     wrapped_obj._loop.run_until_complete(wrapped_obj.block_10ms())
 
+
+class Device(Blocking):
+    instances = 0
+    def __init__(self):
+        Device.instances += 1
+        self.events = []
+    def power_up(self):
+        self.events.append('up')
+    def power_down(self):
+        self.events.append('down')
+    def close(self):
+        self.events.append('closed')
+
+@pytest.mark.asyncio
+async def test_lazy_lifecycle(event_loop):
+    Device.instances = 0
+    w = Wrapper(cls=Device, loop=event_loop, timeout=0.1, idle_timeout=0.05,
+            acquire_hook='power_up', release_hook='power_down',
+            teardown_hook='close')
+    assert Device.instances == 0
+    #hooks aren't exposed and signatures don't include self
+    assert 'power_up' not in w._funcs
+    assert 'close' not in w._func_sigs
+    assert list(w._func_sigs['add'].parameters) == ['num1', 'num2']
+
+    await w.lease_granted()
+    assert Device.instances == 1
+    assert await w.add(1, 2) == 3
+    obj = w._obj
+    await w.lease_ended()
+    assert obj.events == ['up', 'down']
+
+    await asyncio.sleep(0.15, loop=event_loop)
+    assert w._obj is None
+    assert obj.events == ['up', 'down', 'closed']
+
+    #made again on demand
+    assert await w.add(2, 2) == 4
+    assert Device.instances == 2
+
+def test_teardown_hook_not_exposed(event_loop):
+    w = Wrapper(cls=Device, loop=event_loop, timeout=0.1,
+            teardown_hook='close')
+    assert 'close' not in w._func_sigs
+    assert 'close' not in w._funcs
+
+
+class Fast():
+    def thread(self):
+        return threading.get_ident()
+
+@pytest.mark.asyncio
+async def test_lazy_inline(event_loop):
+    w = Wrapper(cls=Fast, loop=event_loop, timeout=0.1, lazy=True,
+            inline_threshold=0.01, inline_after=1)
+    loop_thread = threading.get_ident()
+    assert await w.thread() != loop_thread
+    assert w.thread.stats['inline']
+    assert await w.thread() == loop_thread
+
+    #once torn down the instance is made again on the executor
+    await w._run_on_executor(w._teardown)
+    assert w._obj is None
+    assert await w.thread() != loop_thread
+    assert w._obj is not None
+    assert await w.thread() == loop_thread
+
+
+class Kinds():
+    def method(self, a):
+        return a
+    @classmethod
+    def klass(cls, b):
+        return b
+    @staticmethod
+    def static(c):
+        return c
+
+def test_lazy_exposes_the_same(event_loop):
+    eager = Wrapper(cls=Kinds, loop=event_loop, timeout=0.1)
+    lazy = Wrapper(cls=Kinds, loop=event_loop, timeout=0.1, lazy=True)
+    assert set(lazy._func_sigs) == set(eager._func_sigs) == {'method', 'klass'}
+    for name in eager._func_sigs:
+        assert lazy._func_sigs[name] == eager._func_sigs[name]
@@ -118,6 +118,11 @@ def test_exception_responses(json_abc):
                 'id'      : 'null',
                 'error'  : exc.to_json_rpc_dict()}
 
+@pytest.mark.parametrize('value', ['ab', [300], ['a'], None])
+def test_malformed_bytes(json_abc, value):
+    with pytest.raises(ParseError):
+        json_abc.decode(json.dumps({'__class__': 'bytes', '__value__': value}))
+
 @pytest.mark.asyncio
 async def test_process_incoming_parse_error(json_abc):
 
@@ -163,3 +168,19 @@ async def test_process_incoming_missing_id(json_abc):
 
     assert  result == r
 
+
+def test_request_template(json_abc):
+    make_request = json_abc.request_template('func_name')
+    for params in ([1,2,3], {'arg_1': 1}, None):
+        if isinstance(params, dict):
+            json_obj, id_num = make_request(keyword_params=params)
+            expected, _ = json_abc.request('func_name', keyword_params=params,
+                    id_num=id_num)
+        else:
+            json_obj, id_num = make_request(positional_params=params,
+                    trace_id='t')
+            expected, _ = json_abc.request('func_name', positional_params=params,
+                    id_num=id_num, trace_id='t')
+        assert json.loads(json_obj) == json.loads(expected)
+    #ids carry on from those given out by request
+    assert make_request()[1] == json_abc.request('func_name')[1] - 1
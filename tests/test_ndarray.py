@@ -0,0 +1,45 @@
+import pytest
+import json
+np = pytest.importorskip('numpy')
+from aio_rpc.custom_json import to_json, from_json
+from aio_rpc.Exceptions import ParseError
+
+
+def round_trip(obj):
+    return json.loads(json.dumps(obj, default=to_json), object_hook=from_json)
+
+@pytest.mark.parametrize('a', [
+    np.arange(12, dtype='<f8').reshape(3,4),
+    np.arange(12, dtype='>i2').reshape(3,4)[:, 1:3],
+    np.array(5, dtype=np.uint8),
+    np.zeros((0, 3), dtype=np.complex64)])
+def test_ndarray_round_trip(a):
+    b = round_trip({'a': a})['a']
+    assert b.dtype == a.dtype
+    assert b.shape == a.shape
+    assert np.array_equal(a, b)
+
+def test_numpy_scalar():
+    assert round_trip([np.int64(3), np.float32(0.5)]) == [3, 0.5]
+
+def test_object_array_rejected():
+    with pytest.raises(TypeError):
+        json.dumps(np.array([object()]), default=to_json)
+
+@pytest.mark.parametrize('fields', [
+    {'dtype': 5, 'shape': [1], '__value__': 'AA=='},
+    {'dtype': 'u1', 'shape': [1]},
+    {'dtype': 'u1', '__value__': 'AA=='},
+    {'dtype': 'nonsense', 'shape': [1], '__value__': 'AA=='},
+    {'dtype': 'u1', 'shape': 'ab', '__value__': 'AA=='},
+    {'dtype': 'u1', 'shape': [2], '__value__': 'AA=='}])
+def test_malformed_ndarray(json_abc, fields):
+    fields['__class__'] = 'ndarray'
+    with pytest.raises(ParseError):
+        json_abc.decode(json.dumps(fields))
+
+@pytest.mark.asyncio
+async def test_ndarray_call(client_srv_answerer):
+    a = np.arange(5)
+    r = await client_srv_answerer.add_arrays(a, a)
+    assert r == [0, 2, 4, 6, 8]
@@ -0,0 +1,35 @@
+import json
+import zlib
+import pytest
+from aio_rpc.streaming import iterencode
+from aio_rpc.Messages import Response
+from aio_rpc.Compressor import Compressor
+
+@pytest.mark.parametrize('obj', [
+    5,
+    'text',
+    [],
+    {},
+    list(range(25)),
+    (1, 2, 3),
+    {str(i): i for i in range(25)},
+    {1: 'a', 2.5: None, True: [1], None: {}},
+    [list(range(12)), 'x', {'a': list(range(30))}, [[]]],
+    {'nested': {'deeper': [{'k': list(range(11))}] * 3}, 'n': 1},
+    ])
+def test_iterencode(obj):
+    pieces = list(iterencode(obj, items=10))
+    assert ''.join(pieces) == json.dumps(obj)
+
+def test_response_iterencode():
+    response = Response(7, {'samples': list(range(5000))}, trace={'id': 'a'})
+    pieces = list(response.iterencode(size=1000, items=100))
+    assert len(pieces) > 1
+    assert all(len(p) >= 1000 for p in pieces[:-1])
+    assert ''.join(pieces) == response.to_json()
+
+def test_compress_pieces():
+    compressor = Compressor()
+    pieces = [json.dumps(list(range(i, i+100))) for i in range(0, 1000, 100)]
+    data = b''.join(compressor.compress_pieces(pieces))
+    assert zlib.decompress(data).decode('utf-8') == ''.join(pieces)
@@ -0,0 +1,20 @@
+import pytest
+import ssl
+import hashlib
+from aio_rpc.tls import client_context, parse_fingerprint
+
+
+def test_parse_fingerprint():
+    digest = hashlib.sha256(b'cert').digest()
+    assert parse_fingerprint(digest) == digest
+    assert parse_fingerprint(digest.hex()) == digest
+    colons = ':'.join('{:02X}'.format(b) for b in digest)
+    assert parse_fingerprint(colons) == digest
+    with pytest.raises(ValueError):
+        parse_fingerprint(hashlib.md5(b'cert').digest())
+
+def test_client_context():
+    context = client_context()
+    assert context.verify_mode == ssl.CERT_NONE
+    assert context.options & ssl.OP_NO_TLSv1
+    assert context.options & ssl.OP_NO_TLSv1_1
@@ -0,0 +1,25 @@
+from aio_rpc.tokens import derive_key, sign_token, verify_token
+
+
+def test_token_round_trip():
+    key = derive_key(b'secret', 'token')
+    token, claims = sign_token(key, 'default', 60, now=1000)
+    assert verify_token(key, token, now=1000) == claims
+    assert claims['sub'] == 'default'
+
+def test_token_expired():
+    key = derive_key(b'secret', 'token')
+    token, claims = sign_token(key, 'default', 60, now=1000)
+    assert verify_token(key, token, now=1060) is None
+
+def test_token_forged():
+    key = derive_key(b'secret', 'token')
+    token, claims = sign_token(key, 'default', 60, now=1000)
+    assert verify_token(derive_key(b'other', 'token'), token, now=1000) is None
+    payload, signature = token.split('.')
+    assert verify_token(key, payload + '.' + signature[:-2], now=1000) is None
+    assert verify_token(key, 'not a token', now=1000) is None
+
+def test_keys_differ_by_purpose():
+    assert derive_key(b'secret', 'token') != derive_key(b'secret', 'cookie')
+    assert len(derive_key(b'secret', 'cookie')) == 32